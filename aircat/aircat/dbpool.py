@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import os
+import time
+import threading
+
+import django.db
+from django.core import signals
+from django.db import connections, DatabaseError
+from django.db.backends.signals import connection_created
+
+
+class ConnectionPool(object):
+
+    """Idle DB connections of one alias kept by worker process
+
+    Connections older than `max_age` seconds (None - unlimited) are
+    closed instead of reuse. Connection idle for more than `check_after`
+    seconds is checked with trivial query before reuse, so connections
+    dropped by server or network are replaced transparently. At most
+    `size` idle connections are kept.
+    """
+
+    def __init__(self, max_age, size, check_after):
+        self.max_age = max_age
+        self.size = size
+        self.check_after = check_after
+        self.lock = threading.Lock()
+        self.idle = []  # (connection, created at, released at)
+        self.pid = os.getpid()
+
+    def expired(self, created, now):
+        return self.max_age is not None and now - created >= self.max_age
+
+    def _fork_check(self):
+        if self.pid != os.getpid():
+            # connections of parent process must not be used or closed
+            # (closing would terminate parent's sessions)
+            self.idle = []
+            self.pid = os.getpid()
+
+    def get(self):
+        """Return (connection, created at) or None if there is no usable
+        idle connection"""
+        now = time.time()
+        while True:
+            with self.lock:
+                self._fork_check()
+                if not self.idle:
+                    return None
+                # most recently used first, the rest expire
+                conn, created, released = self.idle.pop()
+            if self.expired(created, now):
+                close_quietly(conn)
+            elif now - released >= self.check_after and not is_usable(conn):
+                close_quietly(conn)
+            else:
+                return conn, created
+
+    def put(self, conn, created):
+        now = time.time()
+        if not self.expired(created, now):
+            with self.lock:
+                self._fork_check()
+                if len(self.idle) < self.size:
+                    self.idle.append((conn, created, now))
+                    return
+        close_quietly(conn)
+
+    def clear(self):
+        with self.lock:
+            idle, self.idle = self.idle, []
+        for conn, created, released in idle:
+            close_quietly(conn)
+
+
+def is_usable(conn):
+    try:
+        cursor = conn.cursor()
+        try:
+            cursor.execute('SELECT 1')
+        finally:
+            cursor.close()
+        conn.rollback()
+    except Exception:
+        return False
+    return True
+
+
+def close_quietly(conn):
+    try:
+        conn.close()
+    except Exception:
+        pass
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(alias):
+    """Return `ConnectionPool` of DB alias or None if its connections are
+    closed after every request
+
+    Configured in `DATABASES` by `CONN_MAX_AGE` (seconds, 0 - close after
+    request as Django 1.5 does, None - unlimited), `CONN_POOL_SIZE` (max
+    idle connections per process, default 4) and `CONN_HEALTH_CHECK`
+    (idle seconds before connection is checked, default 30).
+    """
+    pool = _pools.get(alias)
+    if pool is not None:
+        return pool
+    settings_dict = connections[alias].settings_dict
+    max_age = settings_dict.get('CONN_MAX_AGE', 0)
+    if max_age == 0 or settings_dict['NAME'] == ':memory:':
+        return None
+    with _pools_lock:
+        if alias not in _pools:
+            _pools[alias] = ConnectionPool(
+                max_age, settings_dict.get('CONN_POOL_SIZE', 4),
+                settings_dict.get('CONN_HEALTH_CHECK', 30))
+        return _pools[alias]
+
+
+def mark_created(sender, connection, **kwargs):
+    connection._pool_created = time.time()
+
+
+def acquire_connections(**kwargs):
+    """Give idle connections to DB wrappers of request thread"""
+    for alias in connections:
+        pool = get_pool(alias)
+        if pool is None:
+            continue
+        conn = connections[alias]
+        if conn.connection is not None:
+            continue
+        pooled = pool.get()
+        if pooled is not None:
+            conn.connection, conn._pool_created = pooled
+
+
+def release_connections(**kwargs):
+    """Return connections of finished request to pools
+
+    Replaces `django.db.close_connection`: connections of DBs without
+    pool are closed, as well as broken ones.
+    """
+    for alias in connections:
+        conn = connections[alias]
+        try:
+            conn.abort()
+        except DatabaseError:
+            conn.close()
+            continue
+        pool = get_pool(alias)
+        if pool is None or conn.connection is None:
+            conn.close()
+            continue
+        raw = conn.connection
+        try:
+            # end transaction opened by reads, it would hold locks and
+            # snapshot while connection is idle
+            raw.rollback()
+        except Exception:
+            conn.close()
+            continue
+        conn.connection = None
+        pool.put(raw, getattr(conn, '_pool_created', time.time()))
+
+
+def install():
+    """Keep DB connections between requests
+
+    Called from WSGI application module, so management commands and
+    tests close connections as usual.
+    """
+    signals.request_finished.disconnect(django.db.close_connection)
+    signals.request_started.connect(acquire_connections)
+    signals.request_finished.connect(release_connections)
+    connection_created.connect(mark_created)
@@ -0,0 +1,272 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import os
+import re
+import sys
+import time
+import pstats
+import cProfile
+import logging
+import threading
+from StringIO import StringIO
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.core import signing
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.http import HttpResponse, HttpResponseForbidden
+from django.template.base import Template
+
+
+logger = logging.getLogger('aircat.queries')
+
+_literal_re = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+
+
+def get_view(view_func):
+    """Return class of class-based view or view function itself
+
+    `as_view()` (and decorators using `wraps`) copy name and module of
+    view class to view function, so the class is found by them.
+    """
+    module = sys.modules.get(getattr(view_func, '__module__', None))
+    view = getattr(module, getattr(view_func, '__name__', ''), None)
+    return view if view is not None else view_func
+
+
+def get_query_budget(view_func):
+    """Return `query_budget` declared by view or None"""
+    return getattr(get_view(view_func), 'query_budget', None)
+
+
+def query_shape(sql):
+    """SQL with literals replaced by placeholders"""
+    return _literal_re.sub('?', sql)
+
+
+def start_recording():
+    """Record queries on all connections (replicas too) even when DEBUG is
+    off, return state for `stop_recording`"""
+    state = {}
+    for conn in connections.all():
+        state[conn.alias] = (conn.use_debug_cursor, len(conn.queries))
+        conn.use_debug_cursor = True
+    return state
+
+
+def stop_recording(state):
+    """Restore state, return queries recorded since `start_recording`"""
+    queries = []
+    for conn in connections.all():
+        debug_cursor, start = state[conn.alias]
+        conn.use_debug_cursor = debug_cursor
+        queries.extend(conn.queries[start:])
+    return queries
+
+
+class QueryCountMiddleware(object):
+
+    """Count SQL queries and their time per request
+
+    Adds `X-Query-Count` and `X-Query-Time` (ms) headers and logs them to
+    `aircat.queries` logger. Repeated queries of the same shape (differing
+    only in literals) are a sign of N+1 pattern: when some shape runs
+    `QUERY_REPEAT_THRESHOLD` times or more, it is reported in
+    `X-Query-Repeats` header and logged as warning. So is exceeding of
+    view's `query_budget`.
+
+    Enabled with `QUERY_INSTRUMENTATION` setting (defaults to `DEBUG`).
+    """
+
+    def __init__(self):
+        enabled = getattr(settings, 'QUERY_INSTRUMENTATION', None)
+        if enabled is None:
+            enabled = settings.DEBUG
+        if not enabled:
+            raise MiddlewareNotUsed
+        self.repeat_threshold = getattr(settings, 'QUERY_REPEAT_THRESHOLD', 3)
+
+    def process_request(self, request):
+        request._query_count_state = start_recording()
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request._query_count_view = view_func
+
+    def process_response(self, request, response):
+        if not hasattr(request, '_query_count_state'):
+            return response
+        queries = stop_recording(request._query_count_state)
+        count = len(queries)
+        time = sum(float(q['time']) for q in queries) * 1000
+        response['X-Query-Count'] = str(count)
+        response['X-Query-Time'] = '{0:.1f}'.format(time)
+
+        view_func = getattr(request, '_query_count_view', None)
+        view_name = ('{0}.{1}'.format(view_func.__module__,
+                                      view_func.__name__)
+                     if view_func is not None else '-')
+        logger.debug('%s %s (%s): %d queries, %.1f ms', request.method,
+                     request.path, view_name, count, time)
+
+        shapes = Counter(query_shape(q['sql']) for q in queries)
+        repeated = [(n, sql) for sql, n in shapes.items()
+                    if n >= self.repeat_threshold]
+        if repeated:
+            response['X-Query-Repeats'] = str(max(repeated)[0])
+            for n, sql in sorted(repeated, reverse=True):
+                logger.warning('%s %s (%s): query repeated %d times, '
+                               'possible N+1: %s', request.method,
+                               request.path, view_name, n, sql)
+
+        budget = (get_query_budget(view_func)
+                  if view_func is not None else None)
+        if budget is not None and count > budget:
+            logger.warning('%s %s (%s): %d queries exceed budget of %d',
+                           request.method, request.path, view_name, count,
+                           budget)
+        return response
+
+
+class ProfileMiddleware(object):
+
+    """Profile requests carrying signed profiling token
+
+    Token (see `make_profile_token`) is passed in `X-Profile` header or
+    `_profile` GET param. View is run and its response rendered under
+    cProfile, render time of every template and SQL queries are recorded
+    too. Profile is saved to `PROFILING_DIR` (only `PROFILING_KEEP` latest
+    profiles are kept): `.prof` file for pstats and `.txt` summary, name
+    is returned in `X-Profile-File` header. With `X-Profile-Mode: summary`
+    header (or `_profile_mode=summary` param) summary is returned instead
+    of response.
+
+    Enabled with `PROFILING_ENABLED` setting. Requests without token are
+    not affected.
+    """
+
+    def __init__(self):
+        if not getattr(settings, 'PROFILING_ENABLED', False):
+            raise MiddlewareNotUsed
+        self.dir = settings.PROFILING_DIR
+        self.keep = settings.PROFILING_KEEP
+        self.max_age = settings.PROFILING_TOKEN_MAX_AGE
+        _install_template_timer()
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        token = (request.META.get('HTTP_X_PROFILE') or
+                 request.GET.get('_profile'))
+        if not token:
+            return None
+        try:
+            signing.TimestampSigner(salt=PROFILE_SALT).unsign(
+                                                token, max_age=self.max_age)
+        except signing.BadSignature:
+            return HttpResponseForbidden('Invalid profiling token')
+
+        def run():
+            response = view_func(request, *view_args, **view_kwargs)
+            if hasattr(response, 'render') and callable(response.render):
+                response.render()
+            return response
+
+        recording = start_recording()
+        _template_times.records = defaultdict(lambda: [0, 0.0])
+        profiler = cProfile.Profile()
+        started = time.time()
+        try:
+            response = profiler.runcall(run)
+        finally:
+            total = time.time() - started
+            templates = _template_times.records
+            _template_times.records = None
+            queries = stop_recording(recording)
+
+        summary = self.summary(request, total, profiler, templates, queries)
+        mode = (request.META.get('HTTP_X_PROFILE_MODE') or
+                request.GET.get('_profile_mode'))
+        if mode == 'summary':
+            return HttpResponse(summary, content_type='text/plain')
+        response['X-Profile-File'] = self.save(request, profiler, summary)
+        return response
+
+    def summary(self, request, total, profiler, templates, queries):
+        out = StringIO()
+        out.write('{0} {1}: {2:.1f} ms\n\n'.format(
+                        request.method, request.get_full_path(), total * 1000))
+
+        out.write('Templates (inclusive time):\n')
+        for name, (cnt, t) in sorted(templates.items(),
+                                     key=lambda x: -x[1][1]):
+            out.write('{0:10.1f} ms {1:5d} x {2}\n'.format(t * 1000, cnt,
+                                                          name))
+
+        sql_time = sum(float(q['time']) for q in queries)
+        out.write('\nSQL: {0} queries, {1:.1f} ms. Slowest:\n'.format(
+                                            len(queries), sql_time * 1000))
+        for q in sorted(queries, key=lambda q: -float(q['time']))[:10]:
+            out.write('{0:10.1f} ms {1}\n'.format(float(q['time']) * 1000,
+                                                 q['sql']))
+
+        out.write('\nPython (top functions by cumulative time):\n')
+        stats = pstats.Stats(profiler, stream=out)
+        stats.sort_stats('cumulative').print_stats(30)
+        return out.getvalue()
+
+    def save(self, request, profiler, summary):
+        """Save profile and its summary, remove old ones, return name"""
+        if not os.path.isdir(self.dir):
+            os.makedirs(self.dir)
+        path = re.sub(r'[^\w-]+', '_', request.path).strip('_')
+        name = '{0:.6f}-{1}'.format(time.time(), path or 'index')
+        profiler.dump_stats(os.path.join(self.dir, name + '.prof'))
+        with open(os.path.join(self.dir, name + '.txt'), 'wb') as f:
+            f.write(summary.encode('utf8'))
+
+        names = sorted(set(os.path.splitext(f)[0]
+                           for f in os.listdir(self.dir)))
+        for old in names[:-self.keep]:
+            for ext in ('.prof', '.txt'):
+                try:
+                    os.remove(os.path.join(self.dir, old + ext))
+                except OSError:
+                    pass
+        return name
+
+
+PROFILE_SALT = 'aircat.profile'
+
+# template render times of profiled request in `records`
+_template_times = threading.local()
+
+
+def make_profile_token():
+    """Return token activating `ProfileMiddleware` for a request"""
+    return signing.TimestampSigner(salt=PROFILE_SALT).sign('profile')
+
+
+def _install_template_timer():
+    """Wrap `Template._render` to record time of each template render
+
+    Records are kept only in thread which is being profiled, other
+    requests pay for one attribute check.
+    """
+    if getattr(Template._render, 'timed', False):
+        return
+    render = Template._render
+
+    def _render(self, context):
+        records = getattr(_template_times, 'records', None)
+        if records is None:
+            return render(self, context)
+        started = time.time()
+        try:
+            return render(self, context)
+        finally:
+            record = records[self.name or '<string>']
+            record[0] += 1
+            record[1] += time.time() - started
+    _render.timed = True
+    Template._render = _render
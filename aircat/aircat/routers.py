@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import time
+import itertools
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core import signals
+
+from locations import catalog
+
+
+_local = threading.local()
+
+
+@contextmanager
+def use_primary():
+    """Send all catalog queries of current thread to primary DB
+
+    Used by importer: it must read what it has just written.
+    """
+    _local.pinned = getattr(_local, 'pinned', 0) + 1
+    try:
+        yield
+    finally:
+        _local.pinned -= 1
+
+
+class ReplicaRouter(object):
+
+    """Route reads of catalog models to read replicas
+
+    Replicas are aliases from `DATABASES` listed in `CATALOG_REPLICAS`.
+    One replica is chosen for the whole request (so all its queries see
+    the same data) with `CATALOG_REPLICA_SELECTION` policy:
+     - 'round_robin' - replicas in turn;
+     - 'least_loaded' - replica serving fewest requests of the process.
+    Writes always go to primary ('default') DB, so do reads inside
+    `use_primary()` block and reads within `CATALOG_READ_YOUR_WRITES`
+    seconds after catalog change (see `locations.catalog.last_change`),
+    when replicas may not have caught up yet. Time of last change is read
+    at most once per `check_interval` seconds, the same way catalog
+    snapshots check version stamp.
+
+    Outside of requests (management commands) replica is chosen once per
+    thread.
+    """
+
+    apps = ('locations',)
+    check_interval = catalog.CatalogSnapshot.check_interval
+
+    def __init__(self):
+        self.replicas = tuple(getattr(settings, 'CATALOG_REPLICAS', ()))
+        self.selection = getattr(settings, 'CATALOG_REPLICA_SELECTION',
+                                 'round_robin')
+        if self.selection not in ('round_robin', 'least_loaded'):
+            raise ValueError('Unknown replica selection policy: {0}'.format(
+                                                            self.selection))
+        self.window = getattr(settings, 'CATALOG_READ_YOUR_WRITES', 0)
+        self.lock = threading.Lock()
+        self.turn = itertools.count()
+        self.load = dict((alias, 0) for alias in self.replicas)
+        self.local = threading.local()
+        self.changed_at = None
+        self.checked_at = 0
+        if self.replicas:
+            signals.request_finished.connect(self.release)
+
+    def recently_changed(self):
+        """Whether catalog was changed within read-your-writes window"""
+        now = time.time()
+        if now - self.checked_at >= self.check_interval:
+            self.changed_at = catalog.last_change()
+            self.checked_at = now
+        return (self.changed_at is not None and
+                now * 1000 - self.changed_at < self.window * 1000)
+
+    def choose(self):
+        """Return DB alias for reads of current request"""
+        if self.window and self.recently_changed():
+            return 'default'
+        with self.lock:
+            if self.selection == 'round_robin':
+                alias = self.replicas[next(self.turn) % len(self.replicas)]
+            else:
+                alias = min(self.replicas, key=lambda a: (self.load[a], a))
+            self.load[alias] += 1
+        return alias
+
+    def release(self, **kwargs):
+        """Forget replica chosen for finished request"""
+        alias = getattr(self.local, 'alias', None)
+        if alias is None:
+            return
+        self.local.alias = None
+        if alias in self.load:
+            with self.lock:
+                self.load[alias] -= 1
+
+    def db_for_read(self, model, **hints):
+        if not self.replicas or model._meta.app_label not in self.apps:
+            return None
+        if getattr(_local, 'pinned', 0):
+            return 'default'
+        instance = hints.get('instance')
+        if instance is not None and instance._state.db is not None:
+            # related objects are read from the same DB
+            return instance._state.db
+        alias = getattr(self.local, 'alias', None)
+        if alias is None:
+            alias = self.local.alias = self.choose()
+        return alias
+
+    def db_for_write(self, model, **hints):
+        if not self.replicas or model._meta.app_label not in self.apps:
+            return None
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # replicas hold the same data as primary
+        dbs = ('default',) + self.replicas
+        if obj1._state.db in dbs and obj2._state.db in dbs:
+            return True
+        return None
+
+    def allow_syncdb(self, db, model):
+        # replicas get tables from primary
+        if db in self.replicas:
+            return False
+        return None
@@ -1,4 +1,5 @@
 import os
+import tempfile
 PROJECT_DIR = os.path.dirname(__file__)
 
 # Django settings for aircat project.
@@ -21,9 +22,80 @@ DATABASES = {
         'PASSWORD': '',
         'HOST': '',                      # Empty for localhost through domain sockets or '127.0.0.1' for localhost through TCP.
         'PORT': '',                      # Set to empty string for default.
+        # Seconds to keep connection open between requests of web server
+        # (0 - close after every request, None - unlimited). Idle
+        # connections are kept in per process pool of CONN_POOL_SIZE
+        # connections and checked before reuse if idle for more than
+        # CONN_HEALTH_CHECK seconds (see aircat.dbpool).
+        'CONN_MAX_AGE': 0,
     }
 }
 
+# Reads of catalog may be spread over read replicas: list their aliases
+# from DATABASES in CATALOG_REPLICAS. Replica for request is selected in
+# turn ('round_robin') or by number of requests it serves
+# ('least_loaded'). Within CATALOG_READ_YOUR_WRITES seconds after import
+# reads go to primary DB while replicas catch up.
+DATABASE_ROUTERS = ['aircat.routers.ReplicaRouter']
+CATALOG_REPLICAS = ()
+CATALOG_REPLICA_SELECTION = 'round_robin'
+CATALOG_READ_YOUR_WRITES = 60
+
+# Cached pages and fragments are keyed on catalog version stamp, so they
+# may be kept per process. The stamp itself is bumped by importdata and
+# must be in cache shared between web workers and importdata process
+# (see locations.catalog). Both may point to the same memcached.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'TIMEOUT': 60 * 60 * 24,
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+        },
+    },
+    'catalog_version': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(tempfile.gettempdir(), 'aircat_cache'),
+    },
+}
+
+# Timeout of cached catalog list pages. Pages are invalidated on import
+# anyway, so it may be long.
+CATALOG_PAGE_CACHE_TIMEOUT = 60 * 60 * 24
+# Timeout of cached template fragments (info blocks, letter panel)
+CATALOG_FRAGMENT_CACHE_TIMEOUT = 60 * 60 * 24
+# Max number of entries (objects by slug and by key) in per process cache
+# of countries, cities and airports (locations.lookup)
+CATALOG_OBJECT_CACHE_SIZE = 10000
+
+# Store coordinates as floats instead of decimals (faster to load and to
+# compute with). Convert tables of existing DB with `migratecoordinates`
+# after changing it.
+CATALOG_FLOAT_COORDINATES = False
+
+# Release identifier (e.g. VCS revision) and its deploy time (Unix
+# timestamp) mixed into ETag and Last-Modified of catalog pages, so pages
+# rendered by new code are not answered with 304 for old validators. Deploy
+# time defaults to start of server process and is used as release
+# identifier when it is empty. Set both to share validators between
+# processes.
+CATALOG_RELEASE = ''
+CATALOG_RELEASE_TIME = None
+
+# Count SQL queries per request (aircat.middleware.QueryCountMiddleware).
+# None means enabled when DEBUG is on.
+QUERY_INSTRUMENTATION = None
+# Report queries repeated this number of times in one request (N+1)
+QUERY_REPEAT_THRESHOLD = 3
+
+# Profile requests with signed token (aircat.middleware.ProfileMiddleware,
+# get token with `manage.py profiletoken`). Safe to keep enabled.
+PROFILING_ENABLED = False
+PROFILING_DIR = os.path.join(tempfile.gettempdir(), 'aircat_profiles')
+# number of latest profiles kept in PROFILING_DIR
+PROFILING_KEEP = 50
+PROFILING_TOKEN_MAX_AGE = 60 * 60
+
 # Hosts/domain names that are valid for this site; required if DEBUG is False
 # See https://docs.djangoproject.com/en/1.5/ref/settings/#allowed-hosts
 ALLOWED_HOSTS = []
@@ -97,6 +169,8 @@ TEMPLATE_LOADERS = (
 )
 
 MIDDLEWARE_CLASSES = (
+    'aircat.middleware.QueryCountMiddleware',
+    'aircat.middleware.ProfileMiddleware',
     'django.middleware.common.CommonMiddleware',
 #    'django.contrib.sessions.middleware.SessionMiddleware',
 #    'django.middleware.csrf.CsrfViewMiddleware',
@@ -112,6 +186,7 @@ TEMPLATE_CONTEXT_PROCESSORS = (
 #    'django.core.context_processors.media',
     'django.core.context_processors.static',
 #    'django.core.context_processors.tz',
+    'locations.context_processors.catalog',
 )
 
 ROOT_URLCONF = 'aircat.urls'
@@ -119,6 +194,9 @@ ROOT_URLCONF = 'aircat.urls'
 # Python dotted path to the WSGI application used by Django's runserver.
 WSGI_APPLICATION = 'aircat.wsgi.application'
 
+# Runs tests with in-process caches instead of configured ones
+TEST_RUNNER = 'aircat.testrunner.TestRunner'
+
 TEMPLATE_DIRS = (
     # Put strings here, like "/home/html/django_templates" or "C:/www/django/templates".
     # Always use forward slashes, even on Windows.
@@ -154,6 +232,10 @@ LOGGING = {
         }
     },
     'handlers': {
+        'console': {
+            'level': 'DEBUG',
+            'class': 'logging.StreamHandler',
+        },
         'mail_admins': {
             'level': 'ERROR',
             'filters': ['require_debug_false'],
@@ -161,6 +243,13 @@ LOGGING = {
         }
     },
     'loggers': {
+        # N+1 and query budget warnings; set level to DEBUG to log query
+        # counts of every request
+        'aircat.queries': {
+            'handlers': ['console'],
+            'level': 'WARNING',
+            'propagate': False,
+        },
         'django.request': {
             'handlers': ['mail_admins'],
             'level': 'ERROR',
@@ -175,3 +264,9 @@ try:
     from localsettings import *
 except ImportError:
     pass
+
+# Compile templates once per process in production
+if not DEBUG:
+    TEMPLATE_LOADERS = (
+        ('django.template.loaders.cached.Loader', TEMPLATE_LOADERS),
+    )
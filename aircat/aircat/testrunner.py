@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+from django.dispatch import receiver
+from django.test.signals import setting_changed
+from django.test.simple import DjangoTestSuiteRunner
+from django.test.utils import override_settings
+
+from locations import catalog
+
+
+TEST_CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'aircat-test',
+    },
+    'catalog_version': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'aircat-test-catalog-version',
+    },
+}
+
+
+@receiver(setting_changed)
+def reset_catalog_cache(**kwargs):
+    if kwargs['setting'] == 'CACHES':
+        catalog.reset_cache()
+
+
+class TestRunner(DjangoTestSuiteRunner):
+
+    """Test runner isolating tests from caches of running servers
+
+    Tests bump catalog version stamp and fill page cache, so configured
+    (possibly shared, e.g. file based) caches are replaced with in-process
+    ones for the time of test run.
+    """
+
+    def setup_test_environment(self, **kwargs):
+        super(TestRunner, self).setup_test_environment(**kwargs)
+        self.caches_override = override_settings(CACHES=TEST_CACHES)
+        self.caches_override.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self.caches_override.disable()
+        super(TestRunner, self).teardown_test_environment(**kwargs)
@@ -27,6 +27,10 @@ os.environ.setdefault("DJANGO_SETTINGS_MODULE", "aircat.settings")
 from django.core.wsgi import get_wsgi_application
 application = get_wsgi_application()
 
+# Keep DB connections between requests (see CONN_MAX_AGE in settings)
+from aircat import dbpool
+dbpool.install()
+
 # Apply WSGI middleware here.
 # from helloworld.wsgi import HelloWorldApplication
 # application = HelloWorldApplication(application)
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+
+"""Performance benchmarks of catalog
+
+Benchmarks run against throwaway SQLite DB filled with synthetic data, so
+they need neither real data files nor configured DB. Run them from the
+project directory (where `manage.py` is), e.g.:
+
+    python -m benchmarks.web --scale 5000
+"""
+
+from __future__ import unicode_literals
+
+import os
+import sys
+import json
+import math
+
+
+def setup(db_name, **overrides):
+    """Configure Django to use SQLite DB `db_name` and override settings
+
+    Must be called before anything touching `django.db`.
+    """
+    if 'django.db' in sys.modules:
+        raise RuntimeError('Benchmark must be set up before DB is used')
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'aircat.settings')
+    from django.conf import settings
+    settings.DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': db_name,
+        },
+    }
+    for name, value in overrides.items():
+        setattr(settings, name, value)
+
+
+def percentile(values, p):
+    """Nearest-rank percentile of sorted `values`"""
+    if not values:
+        return None
+    rank = int(math.ceil(p / 100.0 * len(values)))
+    return values[max(rank, 1) - 1]
+
+
+def summarize(timings, queries):
+    """Statistics of one benchmark: timings (s) and query counts per call"""
+    timings = sorted(timings)
+    total = sum(timings)
+    return {
+        'requests': len(timings),
+        'rps': round(len(timings) / total, 1) if total else None,
+        'p50': round(percentile(timings, 50) * 1000, 3),
+        'p90': round(percentile(timings, 90) * 1000, 3),
+        'p99': round(percentile(timings, 99) * 1000, 3),
+        'max': round(timings[-1] * 1000, 3),
+        'queries': round(float(sum(queries)) / len(queries), 2),
+        'max_queries': max(queries),
+    }
+
+
+def load_baseline(path):
+    with open(path, 'rb') as f:
+        return json.loads(f.read().decode('utf8'))
+
+
+def save_baseline(path, data):
+    with open(path, 'wb') as f:
+        f.write(json.dumps(data, indent=2, sort_keys=True).encode('utf8'))
+        f.write(b'\n')
+
+
+def compare(results, baseline, tolerance, keys=('p50', 'p90')):
+    """Return list of regressions of `results` against `baseline`
+
+    Timing `keys` may grow by `tolerance` (fraction) at most, query counts
+    must not grow at all.
+    """
+    regressions = []
+    for name, stats in sorted(results.items()):
+        base = baseline.get(name)
+        if base is None:
+            continue
+        for key in keys:
+            if stats[key] > base[key] * (1 + tolerance):
+                regressions.append('{0}: {1} {2:.3f} ms > {3:.3f} ms'.format(
+                                        name, key, stats[key], base[key]))
+        if stats['max_queries'] > base['max_queries']:
+            regressions.append('{0}: {1} queries > {2}'.format(
+                            name, stats['max_queries'], base['max_queries']))
+    return regressions
@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+
+"""Import benchmark: `DataImporter.start` on synthetic `airports.dat`
+
+Generates `airports.dat` format file of `--rows` rows (see
+`synthetic.write_airports_dat` for its options) and imports it into
+fresh and pre-populated (already holding the same data) temporary SQLite
+DBs with every `--buffer` size. Geo provider is replaced with
+`synthetic.SyntheticGeo`, so no data files are needed. Every import runs
+in a separate process and reports rows/sec, number of queries and peak
+memory (RSS) growth.
+
+    python -m benchmarks.importer --rows 100000 --buffer 200,2000 --fast
+
+Only write data file (it can not be imported with real geo provider):
+
+    python -m benchmarks.importer --rows 100000 --generate airports.dat
+"""
+
+from __future__ import unicode_literals
+
+import os
+import sys
+import shutil
+import timeit
+import resource
+import tempfile
+import itertools
+import multiprocessing
+from optparse import OptionParser
+
+import benchmarks
+
+
+class _Discard(object):
+
+    """Output stream counting written messages"""
+
+    def __init__(self):
+        self.messages = 0
+
+    def write(self, msg):
+        self.messages += 1
+
+
+def _maxrss_mb():
+    # kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def run_import(path, geo, buffer_size, fast):
+    """Import file `path` into configured DB, return statistics
+
+    Meant to be run in a child process, so peak memory is its own.
+    """
+    from django.db import connection
+    from django.db.backends.util import CursorWrapper
+    from locations.management.commands.importdata import Command
+    from locations.management.dataimporter import DataImporter
+
+    queries = [0]
+
+    class CountingCursor(CursorWrapper):
+        def execute(self, sql, params=()):
+            queries[0] += 1
+            self.set_dirty()
+            return self.cursor.execute(sql, params)
+
+        def executemany(self, sql, param_list):
+            queries[0] += 1
+            self.set_dirty()
+            return self.cursor.executemany(sql, param_list)
+
+    # count queries without keeping them as debug cursor does
+    connection.use_debug_cursor = True
+    connection.make_debug_cursor = lambda c: CountingCursor(c, connection)
+
+    columns = dict(itertools.izip(Command.default_format.split(','),
+                                  itertools.count()))
+    errors = _Discard()
+    start_rss = _maxrss_mb()
+    start = timeit.default_timer()
+    with open(path, 'rb') as f:
+        importer = DataImporter(columns, stdout=_Discard(), stderr=errors,
+                                fast=fast, gp=geo)
+        importer.start(f, buffer_size=buffer_size)
+    elapsed = timeit.default_timer() - start
+    peak_rss = _maxrss_mb()
+    connection.close()
+    return {
+        'seconds': round(elapsed, 2),
+        'inserted': importer.inserted_airport_cnt,
+        'existing': importer.existing_airport_cnt,
+        'errors': errors.messages,
+        'queries': queries[0],
+        'peak_mb': round(peak_rss, 1),
+        'mem_mb': round(peak_rss - start_rss, 1),
+    }
+
+
+def in_child(func, *args):
+    """Run `func(*args)` in a new process, return its result"""
+    from django.db import connection
+    connection.close()
+    pool = multiprocessing.Pool(1)
+    try:
+        return pool.apply(func, args)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def report(results, rows, out=sys.stdout):
+    columns = ('seconds', 'rows/s', 'inserted', 'existing', 'errors',
+               'queries', 'mem_mb', 'peak_mb')
+    out.write('{0:<24}'.format('run') +
+              ''.join('{0:>10}'.format(c) for c in columns) + '\n')
+    for name, stats in results:
+        stats = dict(stats, **{'rows/s': int(rows / stats['seconds'])
+                                         if stats['seconds'] else None})
+        out.write('{0:<24}'.format(name) + ''.join(
+                        '{0:>10}'.format(stats[c]) for c in columns) + '\n')
+
+
+def main(argv=None):
+    parser = OptionParser(usage='python -m benchmarks.importer [options]')
+    parser.add_option('--rows', type='int', default=10000,
+        help='Number of rows in data file. Default: 10000')
+    parser.add_option('--duplicates', type='float', default=0.05,
+        help='Fraction of duplicate rows. Default: 0.05')
+    parser.add_option('--missing-iata', type='float', default=0.02,
+        help='Fraction of rows without IATA code. Default: 0.02')
+    parser.add_option('--unknown-city', type='float', default=0.02,
+        help='Fraction of airports in unknown cities. Default: 0.02')
+    parser.add_option('--encoding-errors', type='float', default=0.001,
+        help='Fraction of rows not in UTF-8. Default: 0.001')
+    parser.add_option('--buffer', default='200,1000,5000',
+        help='Comma separated buffer sizes. Default: 200,1000,5000')
+    parser.add_option('--fast', action='store_true', default=False,
+        help='Run imports in fast mode too')
+    parser.add_option('--seed', type='int', default=0,
+        help='Random seed of data file')
+    parser.add_option('--generate', metavar='FILE',
+        help='Only write data file to FILE')
+    parser.add_option('--save', metavar='FILE',
+        help='Save results to FILE (JSON)')
+    options, args = parser.parse_args(argv)
+    if args:
+        parser.error('No arguments expected')
+    try:
+        buffers = [int(b) for b in options.buffer.split(',')]
+    except ValueError:
+        parser.error('Invalid buffer sizes')
+    rates = {
+        'duplicate_rate': options.duplicates,
+        'missing_iata_rate': options.missing_iata,
+        'unknown_city_rate': options.unknown_city,
+        'encoding_error_rate': options.encoding_errors,
+    }
+
+    tmp_dir = tempfile.mkdtemp(prefix='aircat-bench-')
+    run_db = os.path.join(tmp_dir, 'run.db')
+    benchmarks.setup(run_db, DEBUG=False, CACHES={
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        },
+        'catalog_version': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'bench-catalog-version',
+        },
+    })
+    from django.core.management import call_command
+    from benchmarks import synthetic
+
+    try:
+        data = options.generate or os.path.join(tmp_dir, 'airports.dat')
+        start = timeit.default_timer()
+        with open(data, 'wb') as f:
+            geo = synthetic.write_airports_dat(f, options.rows,
+                                               seed=options.seed, **rates)
+        sys.stderr.write('Generated {0} rows ({1:.1f} s)\n'.format(
+                            options.rows, timeit.default_timer() - start))
+        if options.generate:
+            return 0
+
+        call_command('syncdb', interactive=False, verbosity=0)
+        empty_db = os.path.join(tmp_dir, 'empty.db')
+        shutil.copy(run_db, empty_db)
+        in_child(run_import, data, geo, max(buffers), True)
+        populated_db = os.path.join(tmp_dir, 'populated.db')
+        shutil.copy(run_db, populated_db)
+
+        results = []
+        modes = (False, True) if options.fast else (False,)
+        for db_name, db in (('fresh', empty_db), ('populated', populated_db)):
+            for fast in modes:
+                for buffer_size in buffers:
+                    name = '{0} buffer={1}{2}'.format(
+                                db_name, buffer_size, ' fast' if fast else '')
+                    sys.stderr.write('Running {0}...\n'.format(name))
+                    shutil.copy(db, run_db)
+                    results.append((name, in_child(
+                                run_import, data, geo, buffer_size, fast)))
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    report(results, options.rows)
+    if options.save:
+        benchmarks.save_baseline(options.save, {
+            'meta': dict(rates, rows=options.rows, seed=options.seed),
+            'results': dict(results),
+        })
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
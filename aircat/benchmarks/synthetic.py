@@ -0,0 +1,350 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import csv
+import bisect
+import random
+import string
+import itertools
+
+from django.db import transaction
+
+from locations.models import Country, City, Airport
+
+
+# (latin, cyrillic) syllables names are made of. All latin ones are of
+# two letters, so names can be decoded back to numbers (see `encode_name`)
+SYLLABLES = tuple(zip(
+    [c + v for c in 'bdfgklmnprstvzhc' for v in 'ao'],
+    [c + v for c in 'бдфгклмнпрствзхц' for v in 'ао']))
+_syllable_index = dict((lat, i) for i, (lat, cyr) in enumerate(SYLLABLES))
+
+AIRPORT_SUFFIXES = ('', ' International', ' Regional', ' Municipal',
+                    ' Airfield', ' Airbase')
+
+IATA_ALPHABET = string.ascii_uppercase + string.digits
+MAX_AIRPORTS = len(IATA_ALPHABET) ** 3
+
+
+class NameGenerator(object):
+
+    """Random pronounceable (name, name_ru) pairs, unique per generator"""
+
+    def __init__(self, rnd, min_parts=2, max_parts=4, ru_rate=0.9):
+        self.rnd = rnd
+        self.min_parts = min_parts
+        self.max_parts = max_parts
+        self.ru_rate = ru_rate
+        self.used = set()
+
+    def __call__(self):
+        rnd = self.rnd
+        while True:
+            parts = [rnd.choice(SYLLABLES) for _ in
+                     range(rnd.randint(self.min_parts, self.max_parts))]
+            name = ''.join(p[0] for p in parts).capitalize()
+            if name not in self.used:
+                break
+            # long names are unlikely to clash
+            self.max_parts += 1
+        self.used.add(name)
+        name_ru = (''.join(p[1] for p in parts).capitalize()
+                   if rnd.random() < self.ru_rate else '')
+        return name, name_ru
+
+
+def encode_name(n):
+    """Return (name, name_ru) pair encoding number `n`
+
+    Syllables are digits of `n` (least significant first, so first
+    letters are evenly distributed), padded to two syllables at least.
+    """
+    base = len(SYLLABLES)
+    parts = []
+    while n or len(parts) < 2:
+        n, digit = divmod(n, base)
+        parts.append(SYLLABLES[digit])
+    return (''.join(p[0] for p in parts).capitalize(),
+            ''.join(p[1] for p in parts).capitalize())
+
+
+def decode_name(name):
+    """Return number encoded by `encode_name` or None"""
+    name = name.lower()
+    if len(name) < 4 or len(name) % 2:
+        return
+    n = 0
+    for i in range(len(name) - 2, -1, -2):
+        digit = _syllable_index.get(name[i:i + 2])
+        if digit is None:
+            return
+        n = n * len(SYLLABLES) + digit
+    return n
+
+
+def iata_code(n):
+    """n-th IATA code in `IATA_ALPHABET`"""
+    base = len(IATA_ALPHABET)
+    return (IATA_ALPHABET[n // (base * base)] +
+            IATA_ALPHABET[n // base % base] + IATA_ALPHABET[n % base])
+
+
+def decode_iata(code):
+    if len(code) != 3:
+        return
+    n = 0
+    for c in code:
+        i = IATA_ALPHABET.find(c)
+        if i < 0:
+            return
+        n = n * len(IATA_ALPHABET) + i
+    return n
+
+
+def iso_codes():
+    return (''.join(c) for c in
+            itertools.product(string.ascii_uppercase, repeat=2))
+
+
+def iso_code_of(n):
+    """n-th code of `iso_codes()`"""
+    return string.ascii_uppercase[n // 26] + string.ascii_uppercase[n % 26]
+
+
+def iata_codes(rnd):
+    codes = [''.join(c) for c in
+             itertools.product(IATA_ALPHABET, repeat=3)]
+    rnd.shuffle(codes)
+    return codes
+
+
+def coord(value, limit):
+    return '{0:.6f}'.format(max(-limit, min(limit, value)))
+
+
+def zipf_chooser(rnd, n):
+    """Return function choosing index in range(n) with Zipf-like weights
+
+    Few large countries have most of the cities as in real catalog.
+    """
+    cumulative, total = [], 0.0
+    for i in range(n):
+        total += 1.0 / (i + 1)
+        cumulative.append(total)
+    return lambda: min(bisect.bisect(cumulative, rnd.random() * total), n - 1)
+
+
+def catalog_shape(airports):
+    """Return numbers of (countries, cities) for number of airports
+
+    Proportions follow the bundled catalog: about 20 airports per country
+    and 0.9 airports per city.
+    """
+    countries = max(1, min(26 * 26, airports // 20))
+    return countries, max(countries, airports * 9 // 10)
+
+
+def populate(airports, seed=0):
+    """Fill empty catalog with synthetic data, return (countries, cities,
+    airports) counts
+
+    Proportions are given by `catalog_shape`. Every country and city gets
+    at least one airport, so all of them are listed.
+    """
+    if not 1 <= airports <= MAX_AIRPORTS:
+        raise ValueError('Number of airports must be in [1, {0}]'.format(
+                                                            MAX_AIRPORTS))
+    rnd = random.Random(seed)
+    n_countries, n_cities = catalog_shape(airports)
+
+    country_names = NameGenerator(rnd)
+    countries = []
+    for iso in itertools.islice(iso_codes(), n_countries):
+        name, name_ru = country_names()
+        countries.append(Country(
+            iso_code=iso, name=name, name_ru=name_ru,
+            latitude=coord(rnd.uniform(-60, 70), 90),
+            longitude=coord(rnd.uniform(-180, 180), 180)))
+
+    choose_country = zipf_chooser(rnd, n_countries)
+    city_names = dict((c.iso_code, NameGenerator(rnd)) for c in countries)
+    cities = []
+    for i in range(n_cities):
+        country = countries[i if i < n_countries else choose_country()]
+        name, name_ru = city_names[country.iso_code]()
+        cities.append(City(
+            id=i + 1, country=country, name=name, name_ru=name_ru,
+            latitude=coord(float(country.latitude) + rnd.gauss(0, 5), 90),
+            longitude=coord(float(country.longitude) + rnd.gauss(0, 5), 180)))
+
+    codes = iata_codes(rnd)
+    airport_names = {}
+    objects = []
+    for i in range(airports):
+        city = cities[i if i < n_cities else rnd.randrange(n_cities)]
+        names = airport_names.setdefault(city.id, NameGenerator(rnd))
+        name, name_ru = names()
+        suffix = rnd.choice(AIRPORT_SUFFIXES)
+        objects.append(Airport(
+            iata_code=codes[i], city=city,
+            name=name + suffix, name_ru=name_ru,
+            latitude=coord(float(city.latitude) + rnd.uniform(-0.3, 0.3), 90),
+            longitude=coord(float(city.longitude) + rnd.uniform(-0.3, 0.3),
+                            180),
+            altitude=rnd.randint(-50, 4000)))
+        city.airport_count += 1
+        if city.airport_count == 1:
+            city.country.city_count += 1
+        city.country.airport_count += 1
+
+    with transaction.commit_on_success():
+        for model, objs in ((Country, countries), (City, cities),
+                            (Airport, objects)):
+            for o in objs:
+                o.make_slug()
+                o.set_first_letters()
+            model.objects.bulk_create(objs)
+    return len(countries), len(cities), len(objects)
+
+
+def _frac(n, salt):
+    """Cheap deterministic pseudo-random number in [0, 1) for `n`"""
+    return ((n * 2654435761 + salt * 40503) % 4294967291) / 4294967291.0
+
+
+class SyntheticGeo(object):
+
+    """Replacement of `geoprovider.GeoProvider` for `write_airports_dat`
+    files
+
+    Answers are computed from names and codes, so nothing is loaded and
+    memory used by importer is measured alone. Every third airport is
+    unknown to provider, then importer takes country and city from the
+    row. Airports with unknown cities are unknown as well and their
+    cities can not be resolved.
+    """
+
+    def __init__(self, rows, unknown_city_rate=0.0):
+        self.airports = min(rows, MAX_AIRPORTS)
+        self.countries, self.cities = catalog_shape(self.airports)
+        self.unknown_city_rate = unknown_city_rate
+
+    def is_lost(self, n):
+        """Whether airport `n` has unknown city"""
+        return _frac(n, 7) < self.unknown_city_rate
+
+    def city_of(self, n):
+        return n % self.cities
+
+    def country_of(self, city):
+        return city % self.countries
+
+    def latlon(self, n, salt):
+        return ('{0:.6f}'.format(-60 + 130 * _frac(n, salt)),
+                '{0:.6f}'.format(-180 + 360 * _frac(n, salt + 1)))
+
+    def _country(self, iso_code):
+        letters = string.ascii_uppercase
+        if (len(iso_code) != 2 or iso_code[0] not in letters or
+                iso_code[1] not in letters):
+            return
+        n = letters.index(iso_code[0]) * 26 + letters.index(iso_code[1])
+        return n if n < self.countries else None
+
+    def _city(self, iso_code, name):
+        n = decode_name(name)
+        if n is None or n >= self.cities:
+            return
+        return n if iso_code == iso_code_of(self.country_of(n)) else None
+
+    def country_names(self, iso_code):
+        n = self._country(iso_code)
+        return encode_name(n) if n is not None else None
+
+    def country_latlon(self, iso_code):
+        n = self._country(iso_code)
+        return self.latlon(n, 1) if n is not None else None
+
+    def country_iso_code(self, name):
+        n = decode_name(name)
+        if n is None or n >= self.countries:
+            return
+        return iso_code_of(n)
+
+    def city_names(self, iso_code, name):
+        n = self._city(iso_code, name)
+        return encode_name(n) if n is not None else None
+
+    def city_latlon(self, iso_code, name):
+        n = self._city(iso_code, name)
+        return self.latlon(n, 3) if n is not None else None
+
+    def _airport(self, iata_code):
+        n = decode_iata(iata_code)
+        if n is None or n >= self.airports or n % 3 == 0 or self.is_lost(n):
+            return
+        return n
+
+    def airport_names(self, iata_code):
+        n = self._airport(iata_code)
+        return encode_name(n) if n is not None else None
+
+    def country_city_by_iata(self, iata_code):
+        n = self._airport(iata_code)
+        if n is None:
+            return
+        city = self.city_of(n)
+        return iso_code_of(self.country_of(city)), encode_name(city)[0]
+
+    def add_alt_city_name(self, iso_code, name, alt_name):
+        pass
+
+
+def write_airports_dat(f, rows, duplicate_rate=0.0, missing_iata_rate=0.0,
+                       unknown_city_rate=0.0, encoding_error_rate=0.0,
+                       seed=0):
+    """Write `rows` rows of `airports.dat` format to file `f`
+
+    Returns `SyntheticGeo` matching written data. Rows are new airports
+    except for given fractions of duplicates (repeating one of recent
+    airports), rows with empty IATA code, airports in cities unknown to
+    geo provider and rows not in UTF-8. There are no more than
+    `MAX_AIRPORTS` distinct IATA codes, so larger files repeat them.
+    """
+    if duplicate_rate + missing_iata_rate + encoding_error_rate > 1:
+        raise ValueError('Sum of rates must not exceed 1')
+    rnd = random.Random(seed)
+    geo = SyntheticGeo(rows, unknown_city_rate)
+    writer = csv.writer(f, quoting=csv.QUOTE_NONNUMERIC, lineterminator='\n')
+    dup_limit = duplicate_rate
+    missing_limit = dup_limit + missing_iata_rate
+    encoding_limit = missing_limit + encoding_error_rate
+    n = 0
+    for row_num in xrange(1, rows + 1):
+        # first row is always valid, importer checks its encoding
+        x = rnd.random() if row_num > 1 else 1.0
+        if x < dup_limit and n:
+            airport = max(0, n - rnd.randint(1, 2000)) % MAX_AIRPORTS
+        else:
+            airport = n % MAX_AIRPORTS
+            n += 1
+        city = geo.city_of(airport)
+        country = geo.country_of(city)
+        if geo.is_lost(airport):
+            city += geo.cities + airport
+        lat, lon = geo.latlon(airport, 5)
+        row = [row_num, encode_name(airport)[0], encode_name(city)[0],
+               encode_name(country)[0], iata_code(airport),
+               'X' + iata_code(airport), float(lat), float(lon),
+               int(_frac(airport, 9) * 4000),
+               int(_frac(airport, 11) * 24) - 11, 'U']
+        if dup_limit <= x < missing_limit:
+            row[4] = ''
+        row = [c.encode('utf8') if isinstance(c, unicode) else c
+               for c in row]
+        if missing_limit <= x < encoding_limit:
+            # latin-1 byte is not valid UTF-8
+            row[1] += b' Caf\xe9'
+        writer.writerow(row)
+    return geo
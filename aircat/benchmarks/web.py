@@ -0,0 +1,268 @@
+# -*- coding: utf-8 -*-
+
+"""Web benchmark: request every URL pattern of catalog
+
+Loads synthetic catalog of `--scale` airports into temporary SQLite DB
+and requests lists (with every first letter filter and deep pages),
+detail pages, JSON endpoints and bulk JSON API (whole tables, filtered,
+paged and gzipped; streamed responses are read to the end) through
+Django test client. Reports requests/sec, latency percentiles and
+queries per request for each group of URLs. Page and fragment caches are
+disabled unless `--cached` is given, so views and templates are measured
+rather than cache hits.
+
+Save baseline before change and compare after it:
+
+    python -m benchmarks.web --save web-baseline.json
+    python -m benchmarks.web --baseline web-baseline.json
+
+Exits with status 1 if some group got slower than baseline by more than
+`--tolerance` or runs more queries.
+"""
+
+from __future__ import unicode_literals
+
+import os
+import sys
+import random
+import shutil
+import logging
+import tempfile
+import timeit
+from collections import OrderedDict
+from optparse import OptionParser
+
+import benchmarks
+
+
+def collect_urls(limit, rnd):
+    """Return OrderedDict: group name -> list of URLs
+
+    Detail pages and parametrized lists are sampled by `limit` objects
+    per group (all of them if `limit` is 0).
+    """
+    from django.core.urlresolvers import reverse
+    from django.utils.http import urlencode
+    from locations.models import Country, City, Airport
+    from locations.views import KeysetPaginationMixin
+
+    def sample(values):
+        values = list(values)
+        if limit and len(values) > limit:
+            values = rnd.sample(values, limit)
+        return values
+
+    def letter_urls(path, qs, field, param):
+        letters = set(qs.values_list(field, flat=True)) - set([''])
+        return ['{0}?{1}'.format(path, urlencode({param: l}))
+                for l in sorted(letters)]
+
+    urls = OrderedDict()
+    countries = reverse('loc:countries')
+    urls['countries'] = [countries]
+    urls['countries?fl_en'] = letter_urls(countries, Country.objects,
+                                          'name_fl', 'fl_en')
+    urls['countries?fl_ru'] = letter_urls(countries, Country.objects,
+                                          'name_ru_fl', 'fl_ru')
+
+    iso_codes = sample(Country.objects.values_list('iso_code', flat=True))
+    urls['cities'] = [reverse('loc:cities', kwargs={'country': iso})
+                      for iso in iso_codes]
+    # letter filters and deep pages of the largest country
+    largest = Country.objects.order_by('-city_count')[0]
+    cities = reverse('loc:cities', kwargs={'country': largest.iso_code})
+    country_cities = City.objects.filter(country=largest)
+    urls['cities?fl_en'] = letter_urls(cities, country_cities,
+                                       'name_fl', 'fl_en')
+    urls['cities?fl_ru'] = letter_urls(cities, country_cities,
+                                       'name_ru_fl', 'fl_ru')
+    urls['cities?after'] = [
+        '{0}?after={1}'.format(cities, KeysetPaginationMixin.encode_cursor(
+                                                                    [name]))
+        for name in sample(country_cities.values_list('name', flat=True))]
+
+    city_ids = sample(City.objects.values_list('id', flat=True))
+    urls['airports'] = [reverse('loc:airports', kwargs={'city': pk})
+                        for pk in city_ids]
+
+    for model, name in ((Country, 'country'), (City, 'city'),
+                        (Airport, 'airport')):
+        urls[name] = [reverse('loc:' + name, kwargs={'slug': slug})
+                      for slug in sample(
+                            model.objects.values_list('slug', flat=True))]
+
+    airports = sample(Airport.objects.values_list(
+                            'iata_code', 'name', 'latitude', 'longitude'))
+    search = reverse('loc:search')
+    urls['search'] = ['{0}?q={1}'.format(search, name[:3])
+                      for code, name, lat, lon in airports]
+    nearby = reverse('loc:nearby')
+    urls['nearby'] = ['{0}?lat={1}&lon={2}&radius=300'.format(nearby, *p)
+                      for p in [a[2:] for a in airports]]
+    distance = reverse('loc:distance')
+    codes = [a[0] for a in airports]
+    urls['distance'] = ['{0}?route={1}'.format(distance, ','.join(
+                                rnd.sample(codes, min(4, len(codes)))))
+                        for _ in codes]
+    urls['distance?matrix'] = [
+        '{0}?from=country:{1}&to=country:{2}'.format(distance, a, b)
+        for a, b in zip(iso_codes, reversed(iso_codes))]
+
+    def api(table, **params):
+        path = reverse('loc:api', kwargs={'table': table})
+        return '{0}?{1}'.format(path, urlencode(params)) if params else path
+
+    urls['api'] = [api('countries'), api('cities'), api('airports')]
+    urls['api?gzip'] = [api('airports', gzip=1)]
+    urls['api?filter'] = ([api('cities', country=iso) for iso in iso_codes] +
+                          [api('airports', city=pk) for pk in city_ids])
+    urls['api?after'] = [api('airports', after=code, limit=500)
+                         for code in codes]
+    return urls
+
+
+def run(urls, repeat):
+    """Request every URL `repeat` times, return group -> statistics"""
+    from django.test.client import Client
+    from aircat.middleware import start_recording, stop_recording
+
+    client = Client()
+
+    def get(url):
+        response = client.get(url)
+        if not response.streaming:
+            return response, int(response['X-Query-Count'])
+        # streamed responses run their queries while being consumed
+        state = start_recording()
+        try:
+            b''.join(response.streaming_content)
+        finally:
+            queries = stop_recording(state)
+        return response, int(response['X-Query-Count']) + len(queries)
+
+    # warm up template loader, snapshots, etc
+    for group in urls.values():
+        for url in group:
+            get(url)
+
+    results = OrderedDict()
+    timer = timeit.default_timer
+    for name, group in urls.items():
+        timings, queries = [], []
+        for _ in range(repeat):
+            for url in group:
+                start = timer()
+                response, count = get(url)
+                timings.append(timer() - start)
+                if response.status_code != 200:
+                    raise RuntimeError('{0}: status {1}'.format(
+                                            url, response.status_code))
+                queries.append(count)
+        if timings:
+            results[name] = benchmarks.summarize(timings, queries)
+    return results
+
+
+def report(results, baseline=None, out=sys.stdout):
+    columns = ('requests', 'rps', 'p50', 'p90', 'p99', 'max', 'queries')
+    out.write('{0:<18}'.format('group') +
+              ''.join('{0:>10}'.format(c) for c in columns) +
+              ('{0:>10}'.format('p50 diff') if baseline else '') + '\n')
+    for name, stats in results.items():
+        line = '{0:<18}'.format(name) + ''.join(
+                                '{0:>10}'.format(stats[c]) for c in columns)
+        base = (baseline or {}).get(name)
+        if base:
+            line += '{0:>+9.1f}%'.format(
+                                (stats['p50'] / base['p50'] - 1) * 100)
+        out.write(line + '\n')
+
+
+def main(argv=None):
+    parser = OptionParser(usage='python -m benchmarks.web [options]')
+    parser.add_option('--scale', type='int', default=5000,
+        help='Number of airports in synthetic catalog. Default: 5000')
+    parser.add_option('--limit', type='int', default=50,
+        help='Number of sampled URLs per group, 0 - all objects. '
+             'Default: 50')
+    parser.add_option('--repeat', type='int', default=3,
+        help='Number of passes over URLs. Default: 3')
+    parser.add_option('--seed', type='int', default=0,
+        help='Random seed of catalog and URL sampling')
+    parser.add_option('--cached', action='store_true', default=False,
+        help='Keep page and fragment caches enabled')
+    parser.add_option('--save', metavar='FILE',
+        help='Save results as baseline to FILE')
+    parser.add_option('--baseline', metavar='FILE',
+        help='Compare results with baseline from FILE')
+    parser.add_option('--tolerance', type='float', default=0.2,
+        help='Allowed slowdown against baseline (fraction). Default: 0.2')
+    options, args = parser.parse_args(argv)
+    if args:
+        parser.error('No arguments expected')
+
+    tmp_dir = tempfile.mkdtemp(prefix='aircat-bench-')
+    benchmarks.setup(
+        os.path.join(tmp_dir, 'bench.db'),
+        DEBUG=False, TEMPLATE_DEBUG=False, ALLOWED_HOSTS=['testserver'],
+        QUERY_INSTRUMENTATION=True, PROFILING_ENABLED=False)
+    from django.conf import settings
+    caches = dict(settings.CACHES)
+    # keep version stamp of throwaway catalog away from shared cache
+    caches['catalog_version'] = {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'bench-catalog-version',
+    }
+    if not options.cached:
+        caches['default'] = {
+            'BACKEND': 'django.core.cache.backends.dummy.DummyCache',
+        }
+    settings.CACHES = caches
+    from django.core.management import call_command
+    from benchmarks import synthetic
+
+    if not any(isinstance(l, tuple) for l in settings.TEMPLATE_LOADERS):
+        # as production settings do when DEBUG is off
+        settings.TEMPLATE_LOADERS = (
+            ('django.template.loaders.cached.Loader',
+             settings.TEMPLATE_LOADERS),)
+    # counts are reported by benchmark itself
+    logging.getLogger('aircat.queries').setLevel(logging.ERROR)
+
+    try:
+        call_command('syncdb', interactive=False, verbosity=0)
+        start = timeit.default_timer()
+        counts = synthetic.populate(options.scale, options.seed)
+        sys.stderr.write('Catalog: {0} countries, {1} cities, {2} airports '
+                         '({3:.1f} s)\n'.format(*counts + (
+                                    timeit.default_timer() - start,)))
+
+        urls = collect_urls(options.limit, random.Random(options.seed))
+        results = run(urls, options.repeat)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    meta = {'scale': options.scale, 'limit': options.limit,
+            'cached': options.cached}
+    baseline = None
+    if options.baseline:
+        data = benchmarks.load_baseline(options.baseline)
+        if data['meta'] != meta:
+            sys.stderr.write('Warning: baseline was made with other '
+                             'options: {0}\n'.format(data['meta']))
+        baseline = data['results']
+    report(results, baseline)
+    if options.save:
+        benchmarks.save_baseline(options.save,
+                                 {'meta': meta, 'results': results})
+    if baseline:
+        regressions = benchmarks.compare(results, baseline,
+                                         options.tolerance)
+        for r in regressions:
+            sys.stderr.write('REGRESSION {0}\n'.format(r))
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import time
+import threading
+
+from django.conf import settings
+from django.core.cache import get_cache
+
+
+VERSION_KEY = 'locations:catalog_version'
+CHANGE_KEY = 'locations:catalog_changed'
+VERSION_TIMEOUT = 60 * 60 * 24 * 365
+VERSION_CACHE = 'catalog_version'
+
+
+def _get_cache():
+    # falls back to default cache if there is no separate one configured
+    return get_cache(VERSION_CACHE if VERSION_CACHE in settings.CACHES
+                     else 'default')
+
+
+cache = _get_cache()
+
+
+def reset_cache():
+    """Reload version stamp cache after `CACHES` setting is changed"""
+    global cache
+    cache = _get_cache()
+
+
+def _now():
+    return int(time.time() * 1000)
+
+
+def get_version():
+    """Return catalog version stamp
+
+    Catalog data change only on import, so everything derived from them
+    (cached pages, in-memory indexes, etc) may be keyed on this stamp.
+    Stamp is a timestamp (in milliseconds) of last catalog change and is
+    stored in `catalog_version` cache, so it must be shared between web
+    workers and `importdata` process (e.g. file based cache or memcached).
+    """
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        # stamp is lost (cache was cleared or expired), start new one
+        cache.add(VERSION_KEY, _now(), VERSION_TIMEOUT)
+        version = cache.get(VERSION_KEY) or _now()
+    return version
+
+
+def bump_version():
+    """Mark catalog as changed, return new version stamp"""
+    version = max(_now(), (cache.get(VERSION_KEY) or 0) + 1)
+    cache.set_many({VERSION_KEY: version, CHANGE_KEY: version},
+                   VERSION_TIMEOUT)
+    return version
+
+
+def last_change():
+    """Return timestamp (in milliseconds) of last catalog change or `None`
+    if it is unknown
+
+    Unlike version stamp it is set only by `bump_version`, so stamp started
+    anew after cache loss is not taken for a change.
+    """
+    return cache.get(CHANGE_KEY)
+
+
+class CatalogSnapshot(object):
+
+    """In-process data derived from catalog, rebuilt when catalog changes
+
+    `build` is called lazily on first `get()` and again after catalog
+    version is bumped. Version stamp is checked at most once per
+    `check_interval` seconds, so `get()` is almost free. While snapshot is
+    rebuilt by one thread others keep using the previous one.
+    """
+
+    check_interval = 1.0
+
+    def __init__(self, build):
+        self.build = build
+        self.lock = threading.Lock()
+        self.value = None
+        self.version = None
+        self.checked_at = 0
+
+    def get(self):
+        now = time.time()
+        if (self.value is not None and
+                now - self.checked_at < self.check_interval):
+            return self.value
+        version = get_version()
+        self.checked_at = now
+        if self.value is not None and version == self.version:
+            return self.value
+        # wait for other thread only if there is nothing to return
+        if not self.lock.acquire(self.value is None):
+            return self.value
+        try:
+            if self.value is None or self.version != version:
+                self.value = self.build()
+                # may be already outdated if import is running, then it is
+                # rebuilt on next check
+                self.version = version
+        finally:
+            self.lock.release()
+        return self.value
+
+    def reset(self):
+        """Force rebuild on next `get()`"""
+        self.checked_at = 0
+        self.version = None
@@ -0,0 +1,15 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+from django.conf import settings
+
+from locations.catalog import get_version
+
+
+def catalog(request):
+    """Catalog version and timeout for `{% cache %}` of catalog fragments"""
+    return {
+        'catalog_version': get_version(),
+        'catalog_cache_timeout': settings.CATALOG_FRAGMENT_CACHE_TIMEOUT,
+    }
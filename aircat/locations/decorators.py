@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import time
+import hashlib
+from datetime import datetime
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.cache import patch_cache_control
+from django.utils.decorators import available_attrs
+from django.utils.encoding import iri_to_uri
+from django.views.decorators.http import condition
+
+from locations import catalog
+
+
+_started_at = time.time()
+
+
+def release_time():
+    """Return deploy time of running code (Unix timestamp)"""
+    return settings.CATALOG_RELEASE_TIME or _started_at
+
+
+def release():
+    return settings.CATALOG_RELEASE or '{0:.0f}'.format(release_time())
+
+
+def request_version(request):
+    """Return catalog version stamp, read once per request"""
+    if not hasattr(request, '_catalog_version'):
+        request._catalog_version = catalog.get_version()
+    return request._catalog_version
+
+
+def catalog_etag(request, *args, **kwargs):
+    # path holds object key, query string - filters and page cursors
+    key = '{0}\n{1}\n{2}'.format(release(), request_version(request),
+                                 iri_to_uri(request.get_full_path()))
+    return hashlib.md5(key.encode('utf8')).hexdigest()
+
+
+def catalog_last_modified(request, *args, **kwargs):
+    return datetime.utcfromtimestamp(max(request_version(request) // 1000,
+                                         int(release_time())))
+
+
+def catalog_conditional(view_func):
+    """Answer conditional GET and HEAD requests of catalog view
+
+    Strong `ETag` (from release, catalog version stamp, request path and
+    query string) and `Last-Modified` (time of last catalog change or code
+    deployment, whichever is later) are known without calling the view, so
+    unchanged page is answered with 304 before any query or template
+    rendering. Responses must be revalidated by clients, otherwise pages
+    would be served from their caches heuristically after import.
+    """
+    conditional_view = condition(catalog_etag, catalog_last_modified)(
+                                                                view_func)
+
+    @wraps(view_func, assigned=available_attrs(view_func))
+    def _wrapped_view(request, *args, **kwargs):
+        response = conditional_view(request, *args, **kwargs)
+        if not response.has_header('Cache-Control'):
+            patch_cache_control(response, max_age=0)
+        return response
+    return _wrapped_view
+
+
+def catalog_page_cache(params=('fl_en', 'fl_ru', 'after', 'before', 'size')):
+    """Cache whole responses of catalog view
+
+    Cache key consists of request path, values of GET `params` and
+    catalog version stamp, so all cached pages are invalidated at once
+    when catalog is changed by import. Only successful GET and HEAD
+    responses are cached.
+    """
+    def decorator(view_func):
+        @wraps(view_func, assigned=available_attrs(view_func))
+        def _wrapped_view(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return view_func(request, *args, **kwargs)
+
+            key_parts = [iri_to_uri(request.path)]
+            for p in params:
+                key_parts.append(request.GET.get(p, ''))
+            key = 'locations:page:{0}:{1}'.format(
+                request_version(request),
+                hashlib.md5('\n'.join(key_parts).encode('utf8')).hexdigest())
+            response = cache.get(key)
+            if response is not None:
+                # page is shared by requests differing in other params,
+                # validators of the request it was cached for are set
+                # anew by `catalog_conditional`
+                for header in ('ETag', 'Last-Modified'):
+                    del response[header]
+                return response
+
+            response = view_func(request, *args, **kwargs)
+            if response.status_code != 200 or response.streaming:
+                return response
+            timeout = settings.CATALOG_PAGE_CACHE_TIMEOUT
+            if hasattr(response, 'render') and callable(response.render):
+                response.add_post_render_callback(
+                    lambda r: cache.set(key, r, timeout))
+            else:
+                cache.set(key, response, timeout)
+            return response
+        return _wrapped_view
+    return decorator
@@ -0,0 +1,272 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import math
+from array import array
+from functools import partial
+from collections import defaultdict
+
+from django.core.urlresolvers import reverse
+
+from locations.catalog import CatalogSnapshot
+from locations.geomath import (
+    KM_PER_DEGREE, haversine, distance_matrix, numpy)
+from locations.models import Airport, City
+from locations.queryutils import iter_chunks
+
+
+class GridIndex(object):
+
+    """In-memory grid of airports for nearest neighbour queries
+
+    Airports are bucketed into `cell_size` x `cell_size` degree cells.
+    Query visits only cells intersecting bounding box of search circle
+    and ranks their airports by exact great-circle distance.
+
+    Entries are tuples `(lat, lon, iata, name, name_ru, slug)`.
+    """
+
+    cell_size = 1.0
+
+    def __init__(self):
+        self.cells = {}
+        self.url_prefix = ''
+
+    @classmethod
+    def from_db(cls):
+        index = cls()
+        fields = ('latitude', 'longitude', 'name', 'name_ru', 'slug')
+        for rows in iter_chunks(Airport.objects.all(), fields):
+            for iata, lat, lon, name, name_ru, slug in rows:
+                index.add((float(lat), float(lon), iata, name, name_ru, slug))
+        index.url_prefix = reverse('loc:airport', kwargs={'slug': '-'})[:-1]
+        return index
+
+    def cell(self, lat, lon):
+        return (self.grid_pos(lat), self.wrap(self.grid_pos(lon)))
+
+    def grid_pos(self, degrees):
+        return int(math.floor(degrees / self.cell_size))
+
+    def wrap(self, lon_cell):
+        """Wrap longitude cell around the antimeridian"""
+        n = int(360 / self.cell_size)
+        return (lon_cell + n // 2) % n - n // 2
+
+    def add(self, entry):
+        self.cells.setdefault(self.cell(entry[0], entry[1]), []).append(entry)
+
+    def cells_around(self, lat, lon, radius):
+        """Yield keys of cells intersecting bounding box of circle"""
+        dlat = radius / KM_PER_DEGREE
+        lat_min, lat_max = max(lat - dlat, -90.0), min(lat + dlat, 90.0)
+        # longitude span grows towards poles, take it at the widest latitude
+        cos_lat = math.cos(math.radians(max(abs(lat_min), abs(lat_max))))
+        if cos_lat < 1e-9 or dlat / cos_lat >= 180:
+            dlon = 180.0
+        else:
+            dlon = dlat / cos_lat
+        lon_cells = set(self.wrap(c)
+                        for c in range(self.grid_pos(lon - dlon),
+                                       self.grid_pos(lon + dlon) + 1))
+        for lat_cell in range(self.grid_pos(lat_min),
+                              self.grid_pos(lat_max) + 1):
+            for lon_cell in lon_cells:
+                yield (lat_cell, lon_cell)
+
+    def nearest(self, lat, lon, radius, limit=10):
+        """Return [(distance, entry), ...] within `radius` km, nearest first"""
+        found = []
+        cells = self.cells
+        for key in self.cells_around(lat, lon, radius):
+            for entry in cells.get(key, ()):
+                dist = haversine(lat, lon, entry[0], entry[1])
+                if dist <= radius:
+                    found.append((dist, entry))
+        found.sort(key=lambda x: x[0])
+        return found[:limit]
+
+
+index = CatalogSnapshot(GridIndex.from_db)
+
+
+def nearby_airports(lat, lon, radius, limit=10):
+    """Find airports around point, return JSON-ready dicts"""
+    snapshot = index.get()
+    results = []
+    for dist, (a_lat, a_lon, iata, name, name_ru, slug) in snapshot.nearest(
+                                                    lat, lon, radius, limit):
+        results.append({
+            'code': iata,
+            'name': name,
+            'name_ru': name_ru,
+            'latitude': a_lat,
+            'longitude': a_lon,
+            'distance': round(dist, 1),
+            'slug': slug,
+            'url': snapshot.url_prefix + slug,
+        })
+    return results
+
+
+class CoordinateArrays(object):
+
+    """Coordinates of all rows of `Airport` or `City` model
+
+    `latitudes` and `longitudes` are contiguous float64 arrays (NumPy ones
+    when it is installed, `array.array` otherwise) aligned with `pks`,
+    rows are in primary key order. Arrays are shared by all users of
+    snapshot and must not be modified.
+    """
+
+    def __init__(self, pks, latitudes, longitudes):
+        self.pks = pks
+        self.latitudes = latitudes
+        self.longitudes = longitudes
+        self.positions = dict((pk, i) for i, pk in enumerate(pks))
+
+    @classmethod
+    def from_db(cls, model, chunk_size=10000):
+        pks, lats, lons = [], array(b'd'), array(b'd')
+        for rows in iter_chunks(model.objects.all(),
+                                ('latitude', 'longitude'), chunk_size):
+            chunk_pks, chunk_lats, chunk_lons = zip(*rows)
+            pks.extend(chunk_pks)
+            # Decimals are converted here, floats are taken as is
+            lats.extend(chunk_lats)
+            lons.extend(chunk_lons)
+        if numpy is not None:
+            pks = numpy.array(pks)
+            # no copy, arrays use buffers of `array.array`
+            lats, lons = numpy.frombuffer(lats), numpy.frombuffer(lons)
+        return cls(pks, lats, lons)
+
+    def __len__(self):
+        return len(self.pks)
+
+    def position(self, pk):
+        """Return index of row with primary key `pk` in arrays"""
+        return self.positions[pk]
+
+
+arrays = dict((model, CatalogSnapshot(partial(CoordinateArrays.from_db,
+                                              model)))
+              for model in (Airport, City))
+
+
+def coordinate_arrays(model):
+    """Return `CoordinateArrays` of `Airport` or `City`, loaded once per
+    catalog version"""
+    return arrays[model].get()
+
+
+class AirportCoords(object):
+
+    """Airport coordinates with selectors for batch distance computations
+
+    Coordinates are airport `CoordinateArrays` (`codes` are their primary
+    keys), only selector positions are loaded on top of them. Airports are
+    selected for computations by selectors: IATA code, `city:<city id>` or
+    `country:<ISO code>`.
+    """
+
+    def __init__(self, arrays):
+        self.arrays = arrays
+        self.codes = arrays.pks
+        self.lats = arrays.latitudes
+        self.lons = arrays.longitudes
+        self.positions = arrays.positions
+        self.by_selector = defaultdict(list)
+
+    @classmethod
+    def from_arrays(cls, arrays, chunk_size=10000):
+        coords = cls(arrays)
+        fields = ('city', 'city__country')
+        for rows in iter_chunks(Airport.objects.all(), fields, chunk_size):
+            for iata, city_id, iso in rows:
+                pos = coords.positions.get(iata)
+                if pos is not None:  # added after arrays were loaded
+                    coords.add(pos, city_id, iso)
+        return coords
+
+    def add(self, pos, city_id, iso):
+        self.by_selector['city:{0}'.format(city_id)].append(pos)
+        self.by_selector['country:{0}'.format(iso)].append(pos)
+
+    def select(self, selectors):
+        """Return positions of airports matched by comma separated selectors
+
+        Raises `ValueError` for unknown selectors.
+        """
+        result = []
+        for selector in selectors.split(','):
+            selector = selector.strip()
+            if selector.upper() in self.positions:
+                result.append(self.positions[selector.upper()])
+            elif selector in self.by_selector:
+                result.extend(self.by_selector[selector])
+            else:
+                raise ValueError('Unknown airport selector: ' + selector)
+        return result
+
+    def take(self, values, positions):
+        if numpy is not None:
+            return values[positions]
+        return [values[i] for i in positions]
+
+    def distances(self, rows, cols):
+        """Distance matrix between airports at positions `rows` and `cols`"""
+        return distance_matrix(self.take(self.lats, rows),
+                               self.take(self.lons, rows),
+                               self.take(self.lats, cols),
+                               self.take(self.lons, cols))
+
+    def distance(self, i, j):
+        return haversine(self.lats[i], self.lons[i],
+                         self.lats[j], self.lons[j])
+
+
+_coords = [None]
+
+
+def airport_coords():
+    """Return `AirportCoords` of current airport `CoordinateArrays`
+
+    Selectors are rebuilt together with arrays snapshot, so both always
+    describe the same airports.
+    """
+    snapshot = coordinate_arrays(Airport)
+    coords = _coords[0]
+    if coords is None or coords.arrays is not snapshot:
+        coords = _coords[0] = AirportCoords.from_arrays(snapshot)
+    return coords
+
+
+def distances(from_selectors, to_selectors, max_size=None):
+    """Distances between two sets of airports
+
+    Returns (from codes, to codes, matrix in km), see `AirportCoords` for
+    selectors syntax and `distance_matrix` for matrix type. Raises
+    `ValueError` before computing anything if matrix would have more than
+    `max_size` cells.
+    """
+    snapshot = airport_coords()
+    rows = snapshot.select(from_selectors)
+    cols = snapshot.select(to_selectors)
+    if max_size is not None and len(rows) * len(cols) > max_size:
+        raise ValueError('Too many airports, use Python API for large '
+                         'matrices')
+    return ([snapshot.codes[i] for i in rows],
+            [snapshot.codes[i] for i in cols],
+            snapshot.distances(rows, cols))
+
+
+def route_legs(codes):
+    """Return [(from code, to code, distance in km), ...] of route"""
+    snapshot = airport_coords()
+    positions = snapshot.select(','.join(codes))
+    if len(positions) != len(codes):
+        raise ValueError('Route must consist of IATA codes')
+    return [(snapshot.codes[i], snapshot.codes[j], snapshot.distance(i, j))
+            for i, j in zip(positions, positions[1:])]
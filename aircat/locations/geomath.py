@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import math
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+EARTH_RADIUS = 6371.0  # km
+KM_PER_DEGREE = math.pi * EARTH_RADIUS / 180
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    """Great-circle distance in km between points given in degrees"""
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = (math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2)
+         * math.sin((lon2 - lon1) / 2) ** 2)
+    return 2 * EARTH_RADIUS * math.asin(min(1.0, math.sqrt(a)))
+
+
+def distance_matrix(lats1, lons1, lats2, lons2, block_size=1024):
+    """Great-circle distances in km between two sets of points
+
+    Returns len(lats1) x len(lats2) matrix: NumPy array when NumPy is
+    installed (computed in blocks of `block_size` rows to bound size of
+    temporary arrays), list of lists otherwise.
+    """
+    if numpy is None:
+        return [[haversine(lat1, lon1, lat2, lon2)
+                 for lat2, lon2 in zip(lats2, lons2)]
+                for lat1, lon1 in zip(lats1, lons1)]
+
+    lat1, lon1, lat2, lon2 = [numpy.radians(numpy.asarray(a, dtype=float))
+                              for a in (lats1, lons1, lats2, lons2)]
+    cos_lat2 = numpy.cos(lat2)
+    result = numpy.empty((len(lat1), len(lat2)))
+    for start in range(0, len(lat1), block_size):
+        end = start + block_size
+        rlat, rlon = lat1[start:end, None], lon1[start:end, None]
+        a = numpy.sin((lat2 - rlat) / 2) ** 2
+        a += numpy.cos(rlat) * cos_lat2 * numpy.sin((lon2 - rlon) / 2) ** 2
+        numpy.clip(a, 0.0, 1.0, out=a)
+        numpy.sqrt(a, out=a)
+        numpy.arcsin(a, out=a)
+        result[start:end] = a
+    result *= 2 * EARTH_RADIUS
+    return result
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db.models.signals import post_save, post_delete
+
+from locations.catalog import CatalogSnapshot
+from locations.models import Country, City, Airport
+
+
+class LRUCache(object):
+
+    """Bounded mapping dropping least recently used items"""
+
+    def __init__(self, size):
+        self.size = size
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            value = self.items.pop(key, None)
+            if value is not None:
+                self.items[key] = value
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.items.pop(key, None)
+            self.items[key] = value
+            while len(self.items) > self.size:
+                self.items.popitem(last=False)
+
+    def __len__(self):
+        return len(self.items)
+
+
+# querysets objects are loaded with, parents are fetched at once
+querysets = {
+    Country: lambda: Country.objects.all(),
+    City: lambda: City.objects.select_related('country'),
+    Airport: lambda: Airport.objects.select_related('city__country'),
+}
+
+# new empty cache after every catalog change
+cache = CatalogSnapshot(
+    lambda: LRUCache(getattr(settings, 'CATALOG_OBJECT_CACHE_SIZE', 10000)))
+
+
+def clear(**kwargs):
+    # objects changed in this process (not by import, e.g. in admin)
+    cache.reset()
+
+for model in querysets:
+    post_save.connect(clear, sender=model)
+    post_delete.connect(clear, sender=model)
+
+
+def get(model, field, value):
+    """Return `Country`, `City` or `Airport` by unique `field` (`slug` or
+    `pk`), raise `model.DoesNotExist` if it is not found
+
+    Read through process-wide LRU cache: hot objects are served without
+    DB queries until next import. Cached instances (and their parents)
+    are shared between requests and must not be modified.
+    """
+    if field in ('pk', model._meta.pk.name):
+        # keys of objects are of pk type, URL kwargs are strings
+        field = 'pk'
+        try:
+            value = model._meta.pk.to_python(value)
+        except ValidationError:
+            raise model.DoesNotExist
+    lru = cache.get()
+    key = (model.__name__, field, value)
+    obj = lru.get(key)
+    if obj is None:
+        obj = querysets[model]().get(**{field: value})
+        lru.set((model.__name__, 'pk', obj.pk), obj)
+        lru.set((model.__name__, 'slug', obj.slug), obj)
+    return obj
@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+
+from locations.management import queryaudit
+
+
+class Command(NoArgsCommand):
+
+    option_list = NoArgsCommand.option_list + (
+        make_option('--database',
+            action='store',
+            dest='database',
+            default=DEFAULT_DB_ALIAS,
+            help='DB to explain queries on. Default: "default"'),
+    )
+
+    help = '''Explains querysets of catalog views and importer on configured
+              DB (EXPLAIN QUERY PLAN on SQLite, EXPLAIN on PostgreSQL and
+              MySQL), reports full table scans and temporary sorts and
+              suggests indexes removing them. DB should hold imported
+              catalog. Plans of all queries are printed with -v 2.'''
+
+    def handle_noargs(self, **options):
+        try:
+            audit = queryaudit.QueryAudit(options['database'])
+            queries = audit.run()
+        except queryaudit.Error as e:
+            raise CommandError(e)
+        verbosity = int(options['verbosity'])
+
+        for query in queries:
+            if not query.problems and verbosity < 2:
+                continue
+            status = ', '.join(query.problems) or 'ok'
+            self.stdout.write('[{0}] {1}'.format(status, query.label))
+            for line in query.plan:
+                self.stdout.write('    {0}'.format(line))
+            if query.covered_by is not None:
+                self.stdout.write('    index {0} exists, but is not used '
+                                  '(run ANALYZE?)'.format(
+                                        ', '.join(query.covered_by)))
+
+        problems = sum(1 for q in queries if q.problems)
+        self.stdout.write('Audited queries: {0}, with full scans or '
+                          'temporary sorts: {1}'.format(len(queries),
+                                                        problems))
+        suggested = audit.suggest(queries)
+        if not suggested:
+            self.stdout.write('No missing indexes')
+            return
+        self.stdout.write('Missing indexes (Meta.index_together entries):')
+        for model, index in suggested:
+            columns = [model._meta.get_field(f).column for f in index]
+            self.stdout.write('    {0}: {1!r}  # {2} ({3})'.format(
+                model.__name__, tuple(str(f) for f in index),
+                model._meta.db_table, ', '.join(columns)))
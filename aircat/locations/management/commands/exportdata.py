@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import sys
+import gzip
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from locations.management import dataexporter
+
+
+class Command(BaseCommand):
+
+    option_list = BaseCommand.option_list + (
+        make_option('--format',
+            action='store',
+            dest='format',
+            default='csv',
+            type='choice',
+            choices=dataexporter.DataExporter.formats,
+            help='Output format: csv (airports.dat compatible), jsonl or '
+                 'snapshot (length-prefixed JSON records). Default: csv'),
+        make_option('--gzip',
+            action='store_true',
+            dest='gzip',
+            default=False,
+            help='Compress output with gzip'),
+        make_option('--chunk',
+            action='store',
+            dest='chunk_size',
+            default=2000,
+            type='int',
+            help='Set number of rows fetched from DB per query'),
+    )
+
+    args = '[<output_file>]'
+    help = '''Exports catalog (countries, cities and airports) from DB.
+              Writes to stdout if "output_file" is omitted or "-".'''
+
+    def handle(self, *args, **options):
+        if len(args) > 1:
+            raise CommandError('Command takes one optional argument')
+        if options['chunk_size'] < 1:
+            raise CommandError('Chunk size must be positive')
+
+        output_file = args[0] if args else '-'
+        exporter = dataexporter.DataExporter(options['chunk_size'])
+        try:
+            f = (sys.stdout if output_file == '-'
+                 else open(output_file, 'wb'))
+        except IOError as e:
+            raise CommandError('Can not open file: {0}'.format(e))
+        try:
+            out = gzip.GzipFile(fileobj=f, mode='wb') if options['gzip'] else f
+            try:
+                cnt = exporter.export(out, options['format'])
+            finally:
+                if out is not f:
+                    out.close()
+        finally:
+            if f is not sys.stdout:
+                f.close()
+        self.stderr.write('Exported rows: {0}'.format(cnt))
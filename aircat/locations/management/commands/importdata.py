@@ -8,7 +8,8 @@ from optparse import make_option
 
 from django.core.management.base import BaseCommand, CommandError
 
-from locations.management import dataimporter
+from locations import catalog
+from locations.management import dataimporter, staging
 
 
 class Command(BaseCommand):
@@ -24,6 +25,19 @@ class Command(BaseCommand):
             default=200,
             type='int',
             help='Set buffer size for bulk insert operations'),
+        make_option('--fast',
+            action='store_true',
+            dest='fast',
+            default=False,
+            help='Tune SQLite DB for bulk load during import (WAL journal, '
+                 'no fsync, large transactions, secondary indexes are '
+                 'rebuilt after load)'),
+        make_option('--staging',
+            action='store_true',
+            dest='staging',
+            default=False,
+            help='Load data into staging copies of catalog tables and '
+                 'publish them at once after successful import'),
     )
 
     args = '[<input_file> <input_format>]'
@@ -48,6 +62,13 @@ class Command(BaseCommand):
             if c not in columns:
                 raise CommandError('Missed required column: {0}'.format(c))
 
+        tables = None
+        if options['staging']:
+            try:
+                tables = staging.StagingTables()
+            except staging.Error as e:
+                raise CommandError(e)
+
         try:
             with open(input_file, 'rb') as f:
                 self.stdout.write('Initializing data importer '
@@ -55,13 +76,35 @@ class Command(BaseCommand):
                 self.stdout.flush()
                 try:
                     importer = dataimporter.DataImporter(
-                        columns, stdout=self.stdout, stderr=self.stderr)
-                except dataimporter.Error:
+                        columns, stdout=self.stdout, stderr=self.stderr,
+                        fast=options['fast'],
+                        models=tables.models if tables else None)
+                except dataimporter.Error as e:
                     self.stdout.write('ERROR')
-                    raise CommandError('Can not continue processing')
+                    raise CommandError(
+                            'Can not continue processing: {0}'.format(e))
                 else:
                     self.stdout.write('DONE')
 
-                importer.start(f, buffer_size=options['buffer_size'])
+                if tables is None:
+                    importer.start(f, buffer_size=options['buffer_size'])
+                else:
+                    self.staging_import(importer, tables, f, options)
         except IOError as e:
             raise CommandError('Can not open file: {0}'.format(e))
+
+    def staging_import(self, importer, tables, f, options):
+        self.stdout.write('Copying catalog to staging tables...')
+        tables.create()
+        try:
+            importer.start(f, buffer_size=options['buffer_size'])
+            self.stdout.write('Building staging tables indexes...')
+            tables.build_indexes()
+        except:
+            self.stderr.write('Import failed, dropping staging tables')
+            tables.drop()
+            raise
+        self.stdout.write('Publishing staging tables...')
+        tables.publish()
+        catalog.bump_version()
+        self.stdout.write('DONE')
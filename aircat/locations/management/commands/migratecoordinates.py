@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+
+from locations import catalog
+from locations.management import staging
+from locations.models import Country
+
+
+class Command(NoArgsCommand):
+
+    option_list = NoArgsCommand.option_list + (
+        make_option('--database',
+            action='store',
+            dest='database',
+            default=DEFAULT_DB_ALIAS,
+            help='DB to convert. Default: "default"'),
+    )
+
+    help = '''Rebuilds catalog tables with coordinate columns of current
+              CATALOG_FLOAT_COORDINATES setting (float or decimal). Data
+              are copied to staging tables, which then replace live ones
+              at once, so readers are not blocked. Run it after changing
+              the setting and restart web server. Also upgrades tables of
+              older DBs: missing first letter and counter columns are
+              added and filled from existing rows.'''
+
+    def handle_noargs(self, **options):
+        try:
+            tables = staging.StagingTables(using=options['database'])
+        except staging.Error as e:
+            raise CommandError(e)
+        kind = Country._meta.get_field('latitude').get_internal_type()
+        self.stdout.write('Copying catalog to tables with {0} '
+                          'coordinates...'.format(kind))
+        try:
+            tables.create()
+        except staging.Error as e:
+            raise CommandError(e)
+        for live, model in zip(tables.live_models, tables.models):
+            if tables.missing[model]:
+                self.stdout.write('Filled missing columns of {0}: {1}'.format(
+                                    live._meta.db_table,
+                                    ', '.join(tables.missing[model])))
+        try:
+            self.stdout.write('Building indexes...')
+            tables.build_indexes()
+        except:
+            self.stderr.write('Conversion failed, dropping new tables')
+            tables.drop()
+            raise
+        self.stdout.write('Publishing new tables...')
+        tables.publish()
+        catalog.bump_version()
+        self.stdout.write('DONE')
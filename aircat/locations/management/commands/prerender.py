@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from locations.management import prerender
+
+
+class Command(BaseCommand):
+
+    option_list = BaseCommand.option_list + (
+        make_option('--processes',
+            action='store',
+            dest='processes',
+            default=None,
+            type='int',
+            help='Set number of worker processes. Default: number of CPUs'),
+        make_option('--force',
+            action='store_true',
+            dest='force',
+            default=False,
+            help='Render all pages, not only changed ones (e.g. after '
+                 'templates update)'),
+    )
+
+    args = '<output_dir>'
+    help = '''Renders catalog pages to static HTML files in "output_dir".
+              Only pages with changed data are rendered on repeated runs.'''
+
+    def handle(self, *args, **options):
+        if len(args) != 1:
+            raise CommandError('Command takes one required argument')
+        if options['processes'] is not None and options['processes'] < 1:
+            raise CommandError('Number of processes must be positive')
+
+        renderer = prerender.Prerenderer(args[0], options['processes'])
+        try:
+            rendered, failed, removed = renderer.run(options['force'])
+        except (prerender.Error, EnvironmentError) as e:
+            raise CommandError(e)
+        for path in failed:
+            self.stderr.write('FAILED: {0}'.format(path))
+        self.stdout.write('Pages rendered: {0}, removed: {1}, failed: {2}'
+                          .format(len(rendered), len(removed), len(failed)))
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.core.management.base import NoArgsCommand
+
+from aircat.middleware import make_profile_token
+
+
+class Command(NoArgsCommand):
+
+    help = '''Prints token for profiling requests (pass it in X-Profile
+              header or _profile GET param). Token is valid for
+              PROFILING_TOKEN_MAX_AGE seconds.'''
+
+    def handle_noargs(self, **options):
+        if not settings.PROFILING_ENABLED:
+            self.stderr.write('Warning: PROFILING_ENABLED is off')
+        self.stdout.write(make_profile_token())
@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import csv
+import json
+import struct
+
+from locations.models import Country, City, Airport
+from locations.queryutils import iter_chunks
+
+
+class Error(Exception):
+    pass
+
+
+SNAPSHOT_MAGIC = b'AIRCAT-SNAPSHOT-2\n'
+# record length prefix: unsigned 32-bit big-endian
+SNAPSHOT_LENGTH = struct.Struct(b'>I')
+SNAPSHOT_MAX_RECORD = 256 * 1024 * 1024
+
+
+class DataExporter(object):
+
+    """Export country, city and airport information from DB
+
+    Rows are streamed in chunks of `chunk_size` (see `iter_chunks`), so
+    memory usage doesn't depend on catalog size. Supported formats:
+     - csv: airports only, `airports.dat` compatible (can be loaded back
+       with `importdata` default format)
+     - jsonl: one JSON object per line for each country, city and airport
+     - snapshot: length-prefixed JSON records, see `export_snapshot`
+    """
+
+    formats = ('csv', 'jsonl', 'snapshot')
+
+    # model name -> (model, exported fields)
+    tables = (
+        ('country', Country, ('name', 'name_ru', 'slug',
+                              'latitude', 'longitude')),
+        ('city', City, ('country', 'name', 'name_ru', 'slug',
+                        'latitude', 'longitude')),
+        ('airport', Airport, ('city', 'name', 'name_ru', 'slug',
+                              'latitude', 'longitude', 'altitude')),
+    )
+    float_fields = ('latitude', 'longitude')
+
+    def __init__(self, chunk_size=2000):
+        self.chunk_size = chunk_size
+        self.exported_cnt = 0
+
+    def export(self, f, format='csv'):
+        """Write catalog to binary file-like object `f`"""
+        if format not in self.formats:
+            raise Error('Unknown format: {0}'.format(format))
+        self.exported_cnt = 0
+        getattr(self, 'export_' + format)(f)
+        return self.exported_cnt
+
+    def export_csv(self, f):
+        # row_num,airport_name,city_name,country_name,iata,icao,
+        # lat,lon,alt,dst,utc_offset
+        writer = csv.writer(f, quoting=csv.QUOTE_NONNUMERIC)
+        fields = ('name', 'city__name', 'city__country__name',
+                  'latitude', 'longitude', 'altitude')
+        for rows in iter_chunks(Airport.objects.all(), fields,
+                                self.chunk_size):
+            writerows = []
+            for iata, name, city, country, lat, lon, alt in rows:
+                self.exported_cnt += 1
+                writerows.append((self.exported_cnt,
+                                  name.encode('utf8'), city.encode('utf8'),
+                                  country.encode('utf8'), iata.encode('utf8'),
+                                  b'', float(lat), float(lon), alt,
+                                  b'', b''))
+            writer.writerows(writerows)
+
+    def export_jsonl(self, f):
+        for name, rows in self.iter_rows():
+            lines = []
+            for row in rows:
+                row['model'] = name
+                lines.append(json.dumps(row, ensure_ascii=False))
+            lines.append('')
+            f.write('\n'.join(lines).encode('utf8'))
+
+    def export_snapshot(self, f):
+        """Snapshot is magic line `AIRCAT-SNAPSHOT-2` followed by records.
+        Record is UTF-8 JSON prefixed with its length in bytes (4 bytes,
+        unsigned big-endian). Each table is written as header record
+        `{"model": name, "fields": [pk, field, ...]}`, records with arrays
+        of rows (arrays of values in order of fields) and empty array
+        closing the table. Any language with JSON parser can read it, see
+        `read_snapshot`."""
+        f.write(SNAPSHOT_MAGIC)
+        for name, model, fields in self.tables:
+            write_record(f, {'model': name,
+                             'fields': (model._meta.pk.name,) + fields})
+            for rows in self.iter_table(model, fields):
+                write_record(f, rows)
+            write_record(f, [])
+
+    def iter_rows(self):
+        """Yield (model name, chunk of row dicts) pairs"""
+        for name, model, fields in self.tables:
+            keys = (model._meta.pk.name,) + fields
+            for rows in self.iter_table(model, fields):
+                yield name, [dict(zip(keys, row)) for row in rows]
+
+    def iter_table(self, model, fields, qs=None, after=None):
+        """Yield chunks of row tuples with float coordinates
+
+        Rows of queryset `qs` (all rows of `model` by default) are taken
+        in primary key order, starting after `after` key when given.
+        """
+        if qs is None:
+            qs = model.objects.all()
+        float_idx = [i + 1 for i, field in enumerate(fields)
+                     if field in self.float_fields]
+        for rows in iter_chunks(qs, fields, self.chunk_size, after):
+            chunk = []
+            for row in rows:
+                row = list(row)
+                for i in float_idx:
+                    row[i] = float(row[i])
+                chunk.append(tuple(row))
+            self.exported_cnt += len(chunk)
+            yield chunk
+
+
+def read_snapshot(f):
+    """Read snapshot written by `DataExporter`
+
+    Yields (model name, field names, chunk of row tuples) triples.
+    """
+    if f.read(len(SNAPSHOT_MAGIC)) != SNAPSHOT_MAGIC:
+        raise Error('Not a snapshot file')
+    while True:
+        header = read_record(f)
+        if header is None:
+            return
+        if not isinstance(header, dict):
+            raise Error('Invalid snapshot table header')
+        name, fields = header['model'], tuple(header['fields'])
+        while True:
+            rows = read_record(f)
+            if rows is None:
+                raise Error('Unexpected end of snapshot')
+            if not rows:
+                break
+            yield name, fields, [tuple(row) for row in rows]
+
+
+def write_record(f, data):
+    data = json.dumps(data, ensure_ascii=False,
+                      separators=(',', ':')).encode('utf8')
+    f.write(SNAPSHOT_LENGTH.pack(len(data)))
+    f.write(data)
+
+
+def read_record(f):
+    """Return next snapshot record or None at the end of file"""
+    prefix = f.read(SNAPSHOT_LENGTH.size)
+    if not prefix:
+        return None
+    if len(prefix) != SNAPSHOT_LENGTH.size:
+        raise Error('Unexpected end of snapshot')
+    length, = SNAPSHOT_LENGTH.unpack(prefix)
+    if length > SNAPSHOT_MAX_RECORD:
+        raise Error('Snapshot record is too large')
+    data = f.read(length)
+    if len(data) != length:
+        raise Error('Unexpected end of snapshot')
+    try:
+        return json.loads(data.decode('utf8'))
+    except ValueError:
+        raise Error('Invalid snapshot record')
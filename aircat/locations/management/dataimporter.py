@@ -4,19 +4,41 @@ from __future__ import unicode_literals
 
 import sys
 import csv
-import itertools
+import contextlib
+from collections import Counter, defaultdict
 
-from django.core.exceptions import ValidationError
 from django.db import connections, models, transaction, IntegrityError
 
 import geoprovider
+from aircat import routers
+from locations import catalog
 from locations.models import Country, City, Airport
+from locations.management.validation import BatchValidator
 
 
 class Error(Exception):
     pass
 
 
+class _Ref(object):
+
+    """Compact cache record for a country or city
+
+    `pk` is set once the object is saved (or found) in DB, `obj` holds
+    constructed model instance until it is saved.
+    """
+
+    __slots__ = ('pk', 'obj')
+
+    def __init__(self, pk=None, obj=None):
+        self.pk = pk
+        self.obj = obj
+
+    def set_saved(self, pk):
+        self.pk = pk
+        self.obj = None
+
+
 class DataImporter(object):
 
     """Import airport, city and country information into DB
@@ -24,35 +46,88 @@ class DataImporter(object):
     Uses two sources:
      - file-like object with CSV airport data
      - GeoProvider instance to get missing data like city and country
-       coords, Russian names, etc
+       coords, Russian names, etc (other object with the same interface
+       may be passed in `gp`)
 
     Queries DB for existing countries, cities and airports to avoid
     duplicate insertion attempts.
 
-    Currently stores `Country` and `City` objects cache to support
-    automatic unique slug generation based on parent-child relations.
-    May be optimized by storing only object ids and manual slug assignment
-    during import process.
+    Countries and cities are cached as compact `_Ref` records holding
+    only primary key of saved objects. Model instances are kept only
+    until they are saved, airports are bound to cities by raw `city_id`.
+
+    In `fast` mode (SQLite only) DB is tuned for bulk load for the time
+    of import (see `sqlite_fast_mode`) and objects are saved in large
+    transactions committed every `fast_commit_size` inserted airports.
+    Keys of existing countries, cities and airports are preloaded by three
+    queries at start of fast import instead of being looked up row by row
+    (see `preload`).
+
+    Objects are saved to `Country`, `City` and `Airport` tables unless
+    other model triple is passed in `models` (e.g. staging tables).
+
+    Catalog version stamp is bumped after every commit of new objects
+    into live tables. Staging tables are not visible to readers, their
+    publisher bumps it once after publishing.
     """
 
-    def __init__(self, columns, stdout=sys.stdout, stderr=sys.stderr):
+    fast_commit_size = 50000
+    # max number of rows updated by one query (SQLite limits number of
+    # query params to 999)
+    update_batch_size = 500
+
+    def __init__(self, columns, stdout=sys.stdout, stderr=sys.stderr,
+                 fast=False, models=None, gp=None):
         self.columns = columns
         self.stdout = stdout
         self.stderr = stderr
-        try:
-            self.gp = geoprovider.GeoProvider()
-        except geoprovider.Error as e:
-            raise Error('GeoProvider init error: {0}'.format(e))
-        self.countries = {}  # iso -> Country
-        self.cities = {}  # (iso, name) -> City
-        self.saved_countries = set()  # iso
-        self.saved_cities = set()  # (iso, name)
+        self.fast = fast
+        self.country_model, self.city_model, self.airport_model = (
+                                    models or (Country, City, Airport))
+        self.live = self.airport_model is Airport
+        if fast and connections['default'].vendor != 'sqlite':
+            raise Error('Fast mode is supported only for SQLite')
+        if gp is None:
+            try:
+                gp = geoprovider.GeoProvider()
+            except geoprovider.Error as e:
+                raise Error('GeoProvider init error: {0}'.format(e))
+        self.gp = gp
+        self.countries = {}  # iso -> _Ref
+        self.cities = {}  # (iso, name) -> _Ref
         self.saved_airports = set()  # iata
+        self.preloaded = False
+        self.existing_airports = set()  # iata, filled by `preload`
+        self.validators = {}  # (model, exclude) -> BatchValidator
 
         self.inserted_airport_cnt = 0
         self.existing_airport_cnt = 0
+        self.uncommitted_airport_cnt = 0
 
     def start(self, f, buffer_size=200, encoding='utf8'):
+        # reads must see what was just written, not lagging replicas
+        with routers.use_primary():
+            if not self.fast:
+                return self.process(f, buffer_size, encoding)
+            self.start_fast(f, buffer_size, encoding)
+
+    def start_fast(self, f, buffer_size, encoding):
+        self.stdout.write('Switching SQLite to fast import mode')
+        with sqlite_fast_mode(connections['default'],
+                              (self.country_model, self.city_model,
+                               self.airport_model)):
+            with transaction.commit_manually():
+                try:
+                    self.preload()
+                    self.process(f, buffer_size, encoding)
+                except:
+                    transaction.rollback()
+                    raise
+                else:
+                    self.commit()
+        self.stdout.write('SQLite settings and indexes restored')
+
+    def process(self, f, buffer_size, encoding):
         columns = self.columns
         gp = self.gp
 
@@ -122,15 +197,15 @@ class DataImporter(object):
                     continue
 
                 # construct City
-                city = self.get_city(city_name, country)
+                city = self.get_city(city_name, iso)
                 if not city:
                     skipped_insuf_info.add(iata)
                     skipped_insuf_reason['city'] += 1
                     continue
 
                 # construct Airport
-                airport = self.get_airport(iata, row, city)
-                if not airport:
+                airport = self.get_airport(iata, row)
+                if airport is None:
                     skipped_insuf_info.add(iata)
                     skipped_insuf_reason['airport'] += 1
                     continue
@@ -146,16 +221,20 @@ class DataImporter(object):
                     countries_buf, cities_buf, airports_buf = {}, {}, {}
                     self.stdout.write('Processing file again...')
 
-                if iso not in self.saved_countries:
+                if country.pk is None:
                     countries_buf[iso] = country
-                if (iso, city_name) not in self.saved_cities:
+                if city.pk is None:
                     cities_buf[(iso, city_name)] = city
                 if iata not in self.saved_airports:
-                    airports_buf[iata] = airport
+                    airports_buf[iata] = (airport, city, iso)
 
             except IndexError as e:
                 self.stderr.write('SKIP: Invalid data row: {0}'.format(e))
                 rows_cnt -= 1
+            except UnicodeDecodeError as e:
+                self.stderr.write('SKIP: Invalid encoding of row {0}: '
+                                  '{1}'.format(reader.line_num, e))
+                rows_cnt -= 1
 
         self.stdout.write('Saving remaining objects to DB...')
         self.flush_obj_buffers(countries_buf.viewvalues(),
@@ -181,58 +260,82 @@ class DataImporter(object):
                                                    sr['city'],
                                                    sr['airport']))
 
+    def preload(self):
+        """Cache keys of all countries, cities and airports in DB
+
+        Afterwards objects missing in caches (and `existing_airports`) are
+        known to be missing in DB.
+        """
+        self.stdout.write('Loading existing countries, cities and airports')
+        for iso in self.country_model.objects.values_list('pk', flat=True):
+            self.countries[iso] = _Ref(pk=iso)
+        for iso, name, pk in self.city_model.objects.values_list(
+                                                'country', 'name', 'pk'):
+            self.cities[(iso, name)] = _Ref(pk=pk)
+        self.existing_airports.update(
+                self.airport_model.objects.values_list('pk', flat=True))
+        self.preloaded = True
+
     def get_country(self, iso):
         cache = self.countries
         if iso in cache:
             return cache[iso]
 
-        try:
-            # try load country from DB
-            c = Country.objects.get(iso_code=iso)
-            self.saved_countries.add(iso)
-        except Country.DoesNotExist:
+        # try find country in DB
+        if (not self.preloaded and
+                self.country_model.objects.filter(iso_code=iso).exists()):
+            ref = _Ref(pk=iso)
+        else:
             # construct new country
             names = self.gp.country_names(iso)
             latlon = self.gp.country_latlon(iso)
             if not names or not latlon:
                 return
-            c = Country(iso_code=iso,
-                        name=names[0], name_ru=names[1],
-                        latitude=latlon[0], longitude=latlon[1])
-        cache[iso] = c
-        return c
-
-    def get_city(self, name, country):
-        iso = country.iso_code
+            ref = _Ref(obj=self.country_model(
+                                iso_code=iso,
+                                name=names[0], name_ru=names[1],
+                                latitude=latlon[0], longitude=latlon[1]))
+        cache[iso] = ref
+        return ref
+
+    def get_city(self, name, iso):
         cache = self.cities
         if (iso, name) in cache:
             return cache[(iso, name)]
 
-        try:
-            # try load city from DB
-            c = City.objects.get(country__iso_code=iso, name=name)
-            self.saved_cities.add((iso, name))
-        except City.DoesNotExist:
+        # try find city in DB
+        pks = ()
+        if not self.preloaded:
+            pks = self.city_model.objects.filter(
+                    country=iso, name=name).values_list('pk', flat=True)[:1]
+        if pks:
+            ref = _Ref(pk=pks[0])
+        else:
             # construct new city
             names = self.gp.city_names(iso, name)
             latlon = self.gp.city_latlon(iso, name)
             if not names or not latlon:
                 return
-            c = City(name=names[0], name_ru=names[1],
-                     latitude=latlon[0], longitude=latlon[1],
-                     country=country)
-        cache[(iso, name)] = c
-        return c
-
-    def get_airport(self, iata, row, city):
-        try:
-            # try load airport from DB
-            a = Airport.objects.get(iata_code=iata)
+            ref = _Ref(obj=self.city_model(
+                                name=names[0], name_ru=names[1],
+                                latitude=latlon[0], longitude=latlon[1],
+                                country_id=iso))
+        cache[(iso, name)] = ref
+        return ref
+
+    def get_airport(self, iata, row):
+        """Return new `Airport` (without city), `False` if it exists in DB
+        or `None` if it can not be constructed"""
+        # try find airport in DB
+        if self.preloaded:
+            exists = iata in self.existing_airports
+        else:
+            exists = self.airport_model.objects.filter(
+                                            iata_code=iata).exists()
+        if exists:
             self.existing_airport_cnt += 1
             self.saved_airports.add(iata)
-            return a
-        except Airport.DoesNotExist:
-            pass
+            return False
 
         # construct new airport
         cols = self.columns
@@ -245,16 +348,23 @@ class DataImporter(object):
 
         coords = (row[cols['lat']], row[cols['lon']],
                   row[cols['alt']])
-        return Airport(
+        return self.airport_model(
                    iata_code=iata,
                    name=names[0], name_ru=names[1],
-                   latitude=coords[0], longitude=coords[1], altitude=coords[2],
-                   city=city)
+                   latitude=coords[0], longitude=coords[1], altitude=coords[2])
 
     def flush_obj_buffers(self, countries, cities, airports):
-        saved_countries = self.bulk_save(Country, countries)
+        """Save buffered objects to DB
+
+        `countries` and `cities` are iterables of `_Ref` records with
+        unsaved objects, `airports` - of (`Airport`, city `_Ref`, country
+        ISO code) triples. Child counters of parent countries and cities
+        are increased by numbers of saved objects.
+        """
+        saved_countries = self.bulk_save(self.country_model,
+                                         [r.obj for r in countries])
         for c in saved_countries:
-            self.saved_countries.add(c.iso_code)
+            self.countries[c.iso_code].set_saved(c.iso_code)
 
         # Setting ids on cities objects is necessary because airports objects
         # references them. But why we can't use bulk_create for
@@ -262,49 +372,107 @@ class DataImporter(object):
         # https://code.djangoproject.com/ticket/19527
 
         # skip cities for which parents (countries) wasn't saved
-        saved_countries_filter = (lambda o:
-                                  o.country.iso_code in self.saved_countries)
+        cities = [r for r in cities
+                  if self.countries[r.obj.country_id].pk is not None]
         saved_cities = self.bulk_save(
-                City,
-                itertools.ifilter(saved_countries_filter, cities),
+                self.city_model,
+                [r.obj for r in cities],
                 ('country',), real_bulk=False)
-        for c in saved_cities:
-            self.saved_cities.add((c.country.iso_code, c.name))
-
-        # reassign cities after save to init foreign key fields
-        for a in airports:
-            a.city = a.city
-
-        # skip airports for which parents (cities) wasn't saved
-        saved_cities_filter = (
-           lambda o:
-           ((o.city.country.iso_code, o.city.name) in self.saved_cities))
-
-        saved_airports = self.bulk_save(
-                Airport,
-                itertools.ifilter(saved_cities_filter, airports),
-                ('city',))
+        country_city_counts = Counter(c.country_id for c in saved_cities)
+        saved_cities = set(map(id, saved_cities))
+        for r in cities:
+            if id(r.obj) in saved_cities:
+                r.set_saved(r.obj.pk)
+
+        # skip airports for which parents (cities) wasn't saved,
+        # bind the rest by raw foreign key
+        ready_airports, airport_countries = [], {}
+        for a, city, iso in airports:
+            if city.pk is None:
+                continue
+            a.city_id = city.pk
+            ready_airports.append(a)
+            airport_countries[a.iata_code] = iso
+
+        saved_airports = self.bulk_save(self.airport_model, ready_airports,
+                                        ('city',))
         self.inserted_airport_cnt += len(saved_airports)
         for a in saved_airports:
             self.saved_airports.add(a.iata_code)
 
+        counts = (
+            (self.country_model, 'city_count', country_city_counts),
+            (self.country_model, 'airport_count',
+             Counter(airport_countries[a.iata_code] for a in saved_airports)),
+            (self.city_model, 'airport_count',
+             Counter(a.city_id for a in saved_airports)),
+        )
+        if self.fast:
+            self.add_counts(counts)
+        else:
+            with transaction.commit_on_success():
+                self.add_counts(counts)
+
+        if not self.fast:
+            # every batch is already committed
+            if saved_countries or saved_cities or saved_airports:
+                self.catalog_changed()
+            return
+        self.uncommitted_airport_cnt += len(saved_airports)
+        if self.uncommitted_airport_cnt >= self.fast_commit_size:
+            self.commit()
+
+    def add_counts(self, counts):
+        """Increase counter fields by bulk updates
+
+        `counts` is iterable of (model, field, {pk: increment}) triples.
+        Rows with equal increments are updated by single query.
+        """
+        for model_cls, field, increments in counts:
+            by_increment = defaultdict(list)
+            for pk, n in increments.items():
+                by_increment[n].append(pk)
+            for n, pks in by_increment.items():
+                for i in range(0, len(pks), self.update_batch_size):
+                    model_cls.objects.filter(
+                        pk__in=pks[i:i + self.update_batch_size]).update(
+                            **{field: models.F(field) + n})
+
+    def commit(self):
+        """Commit fast mode transaction"""
+        transaction.commit()
+        self.uncommitted_airport_cnt = 0
+        self.catalog_changed()
+
+    def catalog_changed(self):
+        if self.live:
+            catalog.bump_version()
+
     def bulk_save(self, model_cls, objs, validation_exclude=None,
                   real_bulk=True):
         if not objs:
             return ()
 
-        saved_objs = []
+        slugged_objs = []
         for o in objs:
             try:
                 o.make_slug()
             except ValueError:
                 self.stderr.write('SKIP: Can not make slug for {0}'.format(o))
                 continue
-            try:
-                # skip unique checks for performance
-                o.clean_fields(exclude=validation_exclude)
-                o.clean()
-            except ValidationError as e:
+            # bulk_create() does not call save()
+            o.set_first_letters()
+            slugged_objs.append(o)
+
+        # skip unique checks for performance
+        key = (model_cls, validation_exclude)
+        validator = self.validators.get(key)
+        if validator is None:
+            validator = self.validators[key] = BatchValidator(
+                                            model_cls, validation_exclude)
+        saved_objs = []
+        for o, e in zip(slugged_objs, validator.validate(slugged_objs)):
+            if e is not None:
                 self.stderr.write(
                       'SKIP: Validation failed for {0}: {1}'.format(o, e))
                 continue
@@ -316,6 +484,16 @@ class DataImporter(object):
         retry_by_one = [False]
 
         def try_bulk():
+            if self.fast:
+                # already inside of import transaction. SQLite rolls back
+                # only failed statement, so there is nothing to roll back
+                try:
+                    model_cls.objects.bulk_create(saved_objs)
+                except IntegrityError as e:
+                    self.stderr.write('Bulk insertion failed: {0}'.format(e))
+                    self.stderr.write('Falling back to save one by one')
+                    retry_by_one[0] = True
+                return
             with transaction.commit_manually():
                 try:
                     model_cls.objects.bulk_create(saved_objs)
@@ -329,6 +507,10 @@ class DataImporter(object):
 
         def try_one_by_one():
             for obj in saved_objs[:]:
+                if (self.fast and retry_by_one[0] and
+                        model_cls.objects.filter(pk=obj.pk).exists()):
+                    # inserted by one of batches of failed bulk_create
+                    continue
                 try:
                     obj.save(force_insert=True)
                 except IntegrityError as e:
@@ -342,17 +524,23 @@ class DataImporter(object):
             conn = connections['default']
             if (conn.vendor == 'sqlite' and
                     isinstance(saved_objs[0]._meta.pk, models.AutoField)):
-                with transaction.commit_on_success():
+                def try_bulk_with_pks():
                     # emulate SQLite behaviour on the insert
                     # get one larger than the largest ROWID in the table
                     # ref: http://www.sqlite.org/autoinc.html
-                    pk = City.objects.aggregate(
+                    pk = model_cls.objects.aggregate(
                                         max_pk=models.Max('pk'))['max_pk']
                     pk = (pk or 0) + 1  # pk is None if table is empty
                     for o in saved_objs:
                         o.pk = pk
                         pk += 1
                     try_bulk()
+
+                if self.fast:
+                    try_bulk_with_pks()
+                else:
+                    with transaction.commit_on_success():
+                        try_bulk_with_pks()
             else:
                 try_one_by_one()
 
@@ -360,3 +548,46 @@ class DataImporter(object):
             try_one_by_one()
 
         return saved_objs
+
+
+@contextlib.contextmanager
+def sqlite_fast_mode(conn, models):
+    """Tune SQLite connection for bulk load into `models` tables
+
+    Switches journal to WAL, disables fsync, enlarges page cache, keeps
+    temp data in memory and drops non-unique indexes of model tables.
+    Initial settings and indexes are restored on exit.
+    """
+    pragmas = {
+        'journal_mode': 'WAL',
+        'synchronous': 'OFF',
+        'cache_size': '-262144',  # KiB
+        'temp_store': 'MEMORY',
+    }
+    tables = [m._meta.db_table for m in models]
+    cursor = conn.cursor()
+
+    saved_pragmas = {}
+    for name in pragmas:
+        cursor.execute('PRAGMA {0}'.format(name))
+        saved_pragmas[name] = cursor.fetchone()[0]
+    cursor.execute(
+        'SELECT name, sql FROM sqlite_master '
+        'WHERE type = \'index\' AND sql IS NOT NULL '
+        'AND sql NOT LIKE \'CREATE UNIQUE %%\' '
+        'AND tbl_name IN ({0})'.format(', '.join(['%s'] * len(tables))),
+        tables)
+    indexes = cursor.fetchall()
+
+    for name, value in pragmas.iteritems():
+        cursor.execute('PRAGMA {0} = {1}'.format(name, value))
+    for name, sql in indexes:
+        cursor.execute('DROP INDEX {0}'.format(conn.ops.quote_name(name)))
+    try:
+        yield
+    finally:
+        cursor = conn.cursor()
+        for name, sql in indexes:
+            cursor.execute(sql)
+        for name, value in saved_pragmas.iteritems():
+            cursor.execute('PRAGMA {0} = {1}'.format(name, value))
@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import os
+import json
+import hashlib
+import multiprocessing
+from collections import defaultdict
+
+from django.core.urlresolvers import reverse, resolve
+from django.db import connections
+from django.test.client import RequestFactory
+
+from locations.models import Country, City, Airport
+from locations.queryutils import iter_chunks
+
+
+class Error(Exception):
+    pass
+
+
+MANIFEST_NAME = '.prerender-manifest.json'
+
+
+def row_digest(row):
+    data = '\x1f'.join('' if v is None else '{0}'.format(v) for v in row)
+    return hashlib.md5(data.encode('utf8')).hexdigest()
+
+
+def combine(*digests):
+    return hashlib.md5(''.join(digests).encode('ascii')).hexdigest()
+
+
+def page_file(output_dir, path):
+    """File of page with url `path`: /a/b -> <output_dir>/a/b.html"""
+    path = path.strip('/')
+    return os.path.join(output_dir, *((path or 'index').split('/'))) + '.html'
+
+
+def render_page(path):
+    """Render page by calling its view, return content or None"""
+    request = RequestFactory().get(path)
+    match = resolve(path)
+    response = match.func(request, *match.args, **match.kwargs)
+    if hasattr(response, 'render') and callable(response.render):
+        response.render()
+    if response.status_code != 200:
+        return None
+    return response.content
+
+
+def render_pages(args):
+    """Render pages to files, return (rendered paths, failed paths)"""
+    output_dir, paths = args
+    rendered, failed = [], []
+    for path in paths:
+        content = render_page(path)
+        if content is None:
+            failed.append(path)
+            continue
+        filename = page_file(output_dir, path)
+        dirname = os.path.dirname(filename)
+        if not os.path.isdir(dirname):
+            try:
+                os.makedirs(dirname)
+            except OSError:
+                # created by other worker
+                if not os.path.isdir(dirname):
+                    raise
+        # nginx never sees partially written file
+        tmp_filename = '{0}.{1}.tmp'.format(filename, os.getpid())
+        with open(tmp_filename, 'wb') as f:
+            f.write(content)
+        os.rename(tmp_filename, filename)
+        rendered.append(path)
+    return rendered, failed
+
+
+class Prerenderer(object):
+
+    """Render catalog pages to static HTML files
+
+    Renders index page, country list and pages of every country, city and
+    airport (lists without query string, i.e. first page unfiltered) to
+    `output_dir`, so they can be served by web server directly (see
+    `page_file` for layout). Pages are rendered by `processes` worker
+    processes.
+
+    Every page gets digest of DB rows it shows, digests are saved to
+    manifest file in `output_dir`. Next run renders only pages with
+    changed digest and removes pages of deleted objects. Templates are
+    not tracked: run with `force` after changing them.
+    """
+
+    chunk_size = 100
+
+    def __init__(self, output_dir, processes=None):
+        self.output_dir = output_dir
+        self.processes = processes or multiprocessing.cpu_count()
+        self.manifest_file = os.path.join(output_dir, MANIFEST_NAME)
+
+    def collect_pages(self):
+        """Return {url path: digest of rows shown on page}"""
+        countries = {}
+        for iso, slug, digest, _ in self.iter_rows(Country):
+            countries[iso] = (slug, digest)
+        cities, country_cities = {}, defaultdict(list)
+        for pk, slug, digest, iso in self.iter_rows(City, 'country_id'):
+            cities[pk] = (slug, digest, iso)
+            country_cities[iso].append(digest)
+        airports, city_airports = {}, defaultdict(list)
+        for iata, slug, digest, city_id in self.iter_rows(Airport, 'city_id'):
+            airports[iata] = (slug, digest, city_id)
+            city_airports[city_id].append(digest)
+
+        url = lambda name, **kwargs: reverse(name, kwargs=kwargs)
+        pages = {
+            url('home'): '',
+            url('loc:countries'): combine(
+                        *[countries[iso][1] for iso in sorted(countries)]),
+        }
+        for iso, (slug, digest) in countries.items():
+            pages[url('loc:country', slug=slug)] = digest
+            pages[url('loc:cities', country=iso)] = combine(
+                                        digest, *country_cities[iso])
+        for pk, (slug, digest, iso) in cities.items():
+            digest = combine(digest, countries.get(iso, ('', ''))[1])
+            pages[url('loc:city', slug=slug)] = digest
+            pages[url('loc:airports', city=pk)] = combine(
+                                        digest, *city_airports[pk])
+        for iata, (slug, digest, city_id) in airports.items():
+            city_slug, city_digest, iso = cities.get(city_id, ('', '', ''))
+            pages[url('loc:airport', slug=slug)] = combine(
+                        digest, city_digest, countries.get(iso, ('', ''))[1])
+        return pages
+
+    @staticmethod
+    def iter_rows(model, parent_field=None):
+        """Yield (pk, slug, row digest, parent id) for all `model` rows"""
+        fields = [f.attname for f in model._meta.fields if not f.primary_key]
+        slug_pos = 1 + fields.index('slug')
+        parent_pos = 1 + fields.index(parent_field) if parent_field else None
+        for rows in iter_chunks(model.objects.all(), fields):
+            for row in rows:
+                yield (row[0], row[slug_pos], row_digest(row),
+                       row[parent_pos] if parent_pos else None)
+
+    def load_manifest(self):
+        try:
+            with open(self.manifest_file, 'rb') as f:
+                return json.loads(f.read().decode('utf8'))
+        except IOError:
+            return {}
+        except ValueError:
+            raise Error('Manifest file is broken, run with force option')
+
+    def save_manifest(self, pages):
+        tmp_filename = self.manifest_file + '.tmp'
+        with open(tmp_filename, 'wb') as f:
+            f.write(json.dumps(pages, sort_keys=True).encode('utf8'))
+        os.rename(tmp_filename, self.manifest_file)
+
+    def run(self, force=False):
+        """Render changed pages, return (rendered, failed, removed) paths"""
+        if not os.path.isdir(self.output_dir):
+            os.makedirs(self.output_dir)
+        old_pages = {} if force else self.load_manifest()
+        pages = self.collect_pages()
+
+        removed = sorted(set(old_pages) - set(pages))
+        for path in removed:
+            try:
+                os.remove(page_file(self.output_dir, path))
+            except OSError:
+                pass
+
+        paths = sorted(path for path, digest in pages.items()
+                       if old_pages.get(path) != digest or
+                       not os.path.isfile(page_file(self.output_dir, path)))
+        tasks = [(self.output_dir, paths[i:i + self.chunk_size])
+                 for i in range(0, len(paths), self.chunk_size)]
+        rendered, failed = [], []
+        if self.processes > 1 and len(tasks) > 1:
+            # workers must open their own DB connections
+            for conn in connections.all():
+                conn.close()
+            pool = multiprocessing.Pool(self.processes)
+            try:
+                results = pool.imap_unordered(render_pages, tasks)
+                for chunk_rendered, chunk_failed in results:
+                    rendered.extend(chunk_rendered)
+                    failed.extend(chunk_failed)
+            finally:
+                pool.terminate()
+                pool.join()
+        else:
+            for task in tasks:
+                chunk_rendered, chunk_failed = render_pages(task)
+                rendered.extend(chunk_rendered)
+                failed.extend(chunk_failed)
+
+        # failed pages are retried on next run
+        for path in failed:
+            del pages[path]
+        self.save_manifest(pages)
+        return rendered, failed, removed
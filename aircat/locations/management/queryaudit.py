@@ -0,0 +1,292 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+from django.db import connections, models
+from django.test.client import RequestFactory
+
+from locations import lookup
+from locations.models import Country, City, Airport
+from locations.queryutils import seek
+from locations.views import CountryListView, CityListView, AirportListView
+
+
+class Error(Exception):
+    pass
+
+
+FULL_SCAN = 'full scan'
+TEMP_SORT = 'temp sort'
+
+
+class AuditedQuery(object):
+
+    """Queryset checked by `QueryAudit`
+
+    Best index for the query starts with `equal` fields (compared for
+    equality, in any order) followed by `order` fields (ordering or
+    grouping).
+    """
+
+    def __init__(self, label, queryset, equal=(), order=()):
+        self.label = label
+        self.queryset = queryset
+        self.equal = tuple(equal)
+        self.order = tuple(order)
+        self.plan = []
+        self.problems = []
+        self.covered_by = None
+
+    @property
+    def model(self):
+        return self.queryset.model
+
+    @property
+    def index(self):
+        return self.equal + tuple(f for f in self.order
+                                  if f not in self.equal)
+
+
+def explain(connection, sql, params):
+    """Return query plan of `sql` as list of lines"""
+    cursor = connection.cursor()
+    vendor = connection.vendor
+    if vendor == 'sqlite':
+        cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+        return [row[-1] for row in cursor.fetchall()]
+    if vendor == 'postgresql':
+        cursor.execute('EXPLAIN ' + sql, params)
+        return [row[0] for row in cursor.fetchall()]
+    if vendor == 'mysql':
+        cursor.execute('EXPLAIN ' + sql, params)
+        names = [d[0] for d in cursor.description]
+        return ['table={table} type={type} key={key} rows={rows} '
+                'extra={Extra}'.format(**dict(zip(names, row)))
+                for row in cursor.fetchall()]
+    raise Error('EXPLAIN is not supported for {0}'.format(vendor))
+
+
+def _sqlite_problem(line):
+    if line.startswith('SCAN ') and 'INDEX' not in line:
+        return FULL_SCAN
+    if 'TEMP B-TREE' in line:
+        return TEMP_SORT
+
+
+def _postgresql_problem(line):
+    line = line.strip()
+    if line.startswith('->'):
+        line = line[2:].strip()
+    if line.startswith('Seq Scan'):
+        return FULL_SCAN
+    if line.startswith('Sort ') or line.startswith('Sort('):
+        return TEMP_SORT
+
+
+def _mysql_problem(line):
+    if 'type=ALL ' in line:
+        return FULL_SCAN
+    if 'filesort' in line or 'temporary' in line:
+        return TEMP_SORT
+
+
+_problem_checks = {
+    'sqlite': _sqlite_problem,
+    'postgresql': _postgresql_problem,
+    'mysql': _mysql_problem,
+}
+
+
+def plan_problems(vendor, plan):
+    """Return full scans and temporary sorts found in query plan"""
+    problems = []
+    for line in plan:
+        problem = _problem_checks[vendor](line)
+        if problem and problem not in problems:
+            problems.append(problem)
+    return problems
+
+
+def model_indexes(model, vendor):
+    """Return field name tuples of indexes `model` has"""
+    opts = model._meta
+    indexes = [(opts.pk.name,)]
+    for field in opts.local_fields:
+        if (field.db_index or field.unique) and not field.primary_key:
+            indexes.append((field.name,))
+    indexes.extend(tuple(i) for i in opts.unique_together)
+    indexes.extend(tuple(i) for i in opts.index_together)
+    if vendor == 'mysql' or (vendor == 'sqlite' and
+                             isinstance(opts.pk, models.AutoField)):
+        # secondary index entries end with primary key (InnoDB) or rowid
+        # (SQLite, integer primary key is rowid)
+        indexes = [i if i[0] == opts.pk.name else i + (opts.pk.name,)
+                   for i in indexes]
+    return indexes
+
+
+def covers(index, equal, order):
+    """Whether `index` serves lookup by `equal` fields ordered by `order`"""
+    n = len(equal)
+    order = tuple(f for f in order if f not in equal)
+    return (set(index[:n]) == set(equal) and
+            index[n:n + len(order)] == order)
+
+
+def _first(qs, default):
+    objs = list(qs[:1])
+    return objs[0] if objs else default
+
+
+class QueryAudit(object):
+
+    """Explain querysets of `locations.views` and `DataImporter`
+
+    Querysets are built by view code (list views) or the same way as in
+    views and importer, with representative parameters taken from DB
+    `using`: the country with most cities, the city with most airports and
+    their first letters. Plans depend on table statistics, so DB should
+    hold real catalog (SQLite and PostgreSQL need `ANALYZE` after import).
+    """
+
+    def __init__(self, using='default'):
+        self.using = using
+        self.connection = connections[using]
+        if self.connection.vendor not in _problem_checks:
+            raise Error('EXPLAIN is not supported for {0}'.format(
+                                                self.connection.vendor))
+        self.factory = RequestFactory()
+
+    def samples(self):
+        """Return (country, city, airport) used as query parameters"""
+        db = self.using
+        country = _first(Country.objects.using(db).order_by('-city_count'),
+                         Country(iso_code='RU', name='A', name_ru='А',
+                                 slug='ru-a'))
+        city = _first(City.objects.using(db).filter(country=country)
+                          .order_by('-airport_count'),
+                      City(pk=1, country=country, name='A', name_ru='А',
+                           slug='ru-a'))
+        airport = _first(Airport.objects.using(db).filter(city=city),
+                         Airport(iata_code='AAA', city=city, slug='aaa-a'))
+        return country, city, airport
+
+    def list_queries(self, view_cls, label, equal, letters, **attrs):
+        """Queries of list view: pages (first, next and previous) without
+        and with letter filters and letter facets"""
+        variants = [({}, ())]
+        if letters:
+            variants.extend([({'fl_en': letters[0]}, ('name_fl',)),
+                             ({'fl_ru': letters[1]}, ('name_ru_fl',))])
+        for params, letter_equal in variants:
+            view = view_cls(request=self.factory.get('/', params),
+                            args=(), kwargs={}, **attrs)
+            qs = view.get_queryset()
+            key = view.get_ordering_key()
+            size = view.get_paginate_by(qs) + 1
+            name = label + ''.join(' {0}={1}'.format(*p)
+                                   for p in params.items())
+            query_equal = equal + letter_equal
+            first = seek(qs, key, None)
+            row = _first(first.using(self.using).values_list(*key), None)
+            values = list(row) if row else [''] * len(key)
+            yield AuditedQuery(name + ', first page', first[:size],
+                               query_equal, key)
+            yield AuditedQuery(name + ', next page',
+                               seek(qs, key, values)[:size],
+                               query_equal, key)
+            yield AuditedQuery(name + ', previous page',
+                               seek(qs, key, values, True)[:size],
+                               query_equal, key)
+            if letters and not params:
+                for attr in ('name_fl', 'name_ru_fl'):
+                    yield AuditedQuery(
+                        '{0}, {1} letters'.format(label, attr),
+                        view_cls.letter_counts(qs, attr), equal, (attr,))
+
+    def view_queries(self, country, city, airport):
+        letters = ((country.name_fl or 'A'), (country.name_ru_fl or 'А'))
+        city_letters = ((city.name_fl or 'A'), (city.name_ru_fl or 'А'))
+        for query in self.list_queries(CountryListView, 'countries', (),
+                                       letters):
+            yield query
+        for query in self.list_queries(CityListView, 'cities', ('country',),
+                                       city_letters, country=country):
+            yield query
+        for query in self.list_queries(AirportListView, 'airports',
+                                       ('city',), None,
+                                       city=city, country=country):
+            yield query
+
+        # detail pages and list view parents (see `lookup.get`)
+        for obj in (country, city, airport):
+            model = obj.__class__
+            yield AuditedQuery(
+                '{0} by slug'.format(model.__name__.lower()),
+                lookup.querysets[model]().filter(slug=obj.slug), ('slug',))
+        yield AuditedQuery('city by pk',
+                           lookup.querysets[City]().filter(pk=city.pk),
+                           ('id',))
+
+        # API (chunks of `iter_chunks`)
+        yield AuditedQuery('api countries', Country.objects.filter(
+                                pk__gt=country.pk).order_by('pk')[:2000],
+                           (), ('iso_code',))
+        yield AuditedQuery('api cities country=...', City.objects.filter(
+                                country=country).order_by('pk')[:2000],
+                           ('country',), ('id',))
+        yield AuditedQuery('api airports city=...', Airport.objects.filter(
+                                city=city).order_by('pk')[:2000],
+                           ('city',), ('iata_code',))
+
+    def importer_queries(self, country, city, airport):
+        yield AuditedQuery('import: country exists', Country.objects.filter(
+                                iso_code=country.pk), ('iso_code',))
+        yield AuditedQuery('import: city by name', City.objects.filter(
+                                country=country.pk, name=city.name)
+                                .values_list('pk', flat=True)[:1],
+                           ('country', 'name'))
+        yield AuditedQuery('import: airport exists', Airport.objects.filter(
+                                iata_code=airport.pk), ('iata_code',))
+        for obj in (country, city):
+            model = obj.__class__
+            yield AuditedQuery(
+                'import: {0} counters update'.format(model.__name__.lower()),
+                model.objects.filter(pk__in=[obj.pk]),
+                (model._meta.pk.name,))
+
+    def run(self):
+        """Explain all queries, return list of `AuditedQuery`"""
+        samples = self.samples()
+        queries = (list(self.view_queries(*samples)) +
+                   list(self.importer_queries(*samples)))
+        for query in queries:
+            self.check(query)
+        return queries
+
+    def check(self, query):
+        """Set plan, problems and existing index of `AuditedQuery`"""
+        vendor = self.connection.vendor
+        sql, params = query.queryset.query.get_compiler(self.using).as_sql()
+        query.plan = explain(self.connection, sql, params)
+        query.problems = plan_problems(vendor, query.plan)
+        if query.problems:
+            for index in model_indexes(query.model, vendor):
+                if covers(index, query.equal, query.order):
+                    query.covered_by = index
+                    break
+
+    @staticmethod
+    def suggest(queries):
+        """Return (model, index fields) pairs of indexes removing problems
+        of `queries`, indexes being prefixes of others are left out"""
+        wanted = []
+        for query in queries:
+            if query.problems and query.covered_by is None:
+                item = (query.model, query.index)
+                if item not in wanted:
+                    wanted.append(item)
+        return [(model, index) for model, index in wanted
+                if not any(m is model and other != index and
+                           other[:len(index)] == index
+                           for m, other in wanted)]
@@ -0,0 +1,252 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import copy
+import time
+from collections import defaultdict
+
+from django.core.management.color import no_style
+from django.db import connections, models, transaction
+
+from locations.models import Location, Country, City, Airport, first_letter
+from locations.queryutils import iter_chunks
+
+
+class Error(Exception):
+    pass
+
+
+class StagingTables(object):
+
+    """Staging copies of `Country`, `City` and `Airport` tables
+
+    Allows to import data without exposing partially loaded catalog to
+    readers:
+     - `create()` creates staging tables (without secondary indexes) and
+       copies current catalog into them, columns missing in live tables of
+       older DBs (`derived_fields`) are computed from copied rows;
+     - data are loaded through staging `models`;
+     - `build_indexes()` creates secondary indexes after load;
+     - `publish()` swaps live and staging tables by renaming them in one
+       short transaction and drops old tables.
+    `drop()` removes staging tables if import fails.
+
+    Publish is atomic on backends with transactional DDL (SQLite,
+    PostgreSQL) and on MySQL (single multi-table RENAME).
+    """
+
+    live_models = (Country, City, Airport)
+    # fields computed from other data, may be missing in live tables
+    derived_fields = ('name_fl', 'name_ru_fl', 'city_count', 'airport_count')
+    update_batch_size = 500
+
+    def __init__(self, suffix=None, using='default'):
+        # names of indexes built on staging tables contain suffix and stay
+        # after publish, so it must differ from previous runs
+        self.suffix = suffix or 'stg{0}'.format(int(time.time() * 1000))
+        self.conn = connections[using]
+        if self.conn.vendor not in ('sqlite', 'postgresql', 'mysql'):
+            raise Error('Staging import is not supported for {0}'.format(
+                                                        self.conn.vendor))
+        self.models = make_staging_models(self.suffix)
+        # staging model -> names of fields missing in live table
+        self.missing = {}
+
+    def execute(self, statements):
+        """Execute SQL strings or (SQL, params) pairs"""
+        cursor = self.conn.cursor()
+        for sql in statements:
+            if isinstance(sql, tuple):
+                cursor.execute(*sql)
+            else:
+                cursor.execute(sql)
+
+    def live_columns(self, model):
+        cursor = self.conn.cursor()
+        return set(row[0] for row in self.conn.introspection
+                        .get_table_description(cursor, model._meta.db_table))
+
+    def create(self):
+        style = no_style()
+        creation, qn = self.conn.creation, self.conn.ops.quote_name
+        known_models = set()
+        statements = []
+        for live, staging in zip(self.live_models, self.models):
+            sql, _ = creation.sql_create_model(staging, style, known_models)
+            statements.extend(sql)
+            known_models.add(staging)
+            existing = self.live_columns(live)
+            copied, missing = [], []
+            for f in live._meta.local_fields:
+                (copied if f.column in existing else missing).append(f)
+            unknown = [f.name for f in missing
+                       if f.name not in self.derived_fields]
+            if unknown:
+                raise Error('Table {0} lacks columns of {1}'.format(
+                                live._meta.db_table, ', '.join(unknown)))
+            self.missing[staging] = [f.name for f in missing]
+            # missing columns get defaults, computed by `fill_missing()`
+            columns = ', '.join(qn(f.column) for f in copied + missing)
+            select = ', '.join([qn(f.column) for f in copied] +
+                               ['%s'] * len(missing))
+            statements.append((
+                'INSERT INTO {0} ({1}) SELECT {2} FROM {3}'.format(
+                    qn(staging._meta.db_table), columns, select,
+                    qn(live._meta.db_table)),
+                [f.get_default() for f in missing]))
+        statements.extend(
+            self.conn.ops.sequence_reset_sql(style, self.models))
+        with transaction.commit_on_success(using=self.conn.alias):
+            self.execute(statements)
+            self.fill_missing()
+            transaction.set_dirty(using=self.conn.alias)
+
+    def fill_missing(self):
+        """Compute first letters and child counters missing in live
+        tables"""
+        country, city, airport = self.models
+        for model in self.models:
+            if set(self.missing[model]) & set(['name_fl', 'name_ru_fl']):
+                self.fill_first_letters(model)
+
+        # counted by grouping queries, staging tables have no indexes yet
+        db = self.conn.alias
+        city_airports = dict(airport.objects.using(db).values_list('city')
+                                    .annotate(models.Count('pk'))
+                                    .order_by())
+        country_airports = defaultdict(int)
+        for pk, iso in city.objects.using(db).values_list('pk', 'country'):
+            country_airports[iso] += city_airports.get(pk, 0)
+        country_cities = dict(city.objects.using(db).values_list('country')
+                                    .annotate(models.Count('pk'))
+                                    .order_by())
+        counts = (
+            (country, 'city_count', country_cities),
+            (country, 'airport_count', country_airports),
+            (city, 'airport_count', city_airports),
+        )
+        for model, field, values in counts:
+            if field not in self.missing[model]:
+                continue
+            by_value = defaultdict(list)
+            for pk, n in values.items():
+                if n:  # the rest got default of 0
+                    by_value[n].append(pk)
+            for n, pks in by_value.items():
+                self.update(model, pks, **{field: n})
+
+    def update(self, model, pks, **values):
+        qs = model.objects.using(self.conn.alias)
+        for i in range(0, len(pks), self.update_batch_size):
+            qs.filter(pk__in=pks[i:i + self.update_batch_size]
+                      ).update(**values)
+
+    def fill_first_letters(self, model):
+        # computed in Python: DB UPPER() may not handle non-ASCII letters
+        qs = model.objects.using(self.conn.alias)
+        for rows in iter_chunks(qs.all(), ('name', 'name_ru'), 10000):
+            by_letters = defaultdict(list)
+            for pk, name, name_ru in rows:
+                by_letters[(first_letter(name),
+                            first_letter(name_ru))].append(pk)
+            for (name_fl, name_ru_fl), pks in by_letters.items():
+                self.update(model, pks, name_fl=name_fl,
+                            name_ru_fl=name_ru_fl)
+
+    def build_indexes(self):
+        style = no_style()
+        statements = []
+        for staging in self.models:
+            statements.extend(
+                self.conn.creation.sql_indexes_for_model(staging, style))
+        with transaction.commit_on_success(using=self.conn.alias):
+            self.execute(statements)
+            transaction.set_dirty(using=self.conn.alias)
+
+    def publish(self):
+        qn = self.conn.ops.quote_name
+        renames = []
+        for live, staging in zip(self.live_models, self.models):
+            table = live._meta.db_table
+            old_table = '{0}_old_{1}'.format(table, self.suffix)
+            renames.append((table, old_table))
+            renames.append((staging._meta.db_table, table))
+        drops = ['DROP TABLE {0}'.format(qn(old))
+                 for table, old in reversed(renames[::2])]
+
+        if self.conn.vendor == 'mysql':
+            self.execute(['RENAME TABLE ' + ', '.join(
+                '{0} TO {1}'.format(qn(a), qn(b)) for a, b in renames)])
+            self.execute(drops)
+            return
+
+        statements = ['ALTER TABLE {0} RENAME TO {1}'.format(qn(a), qn(b))
+                      for a, b in renames]
+        if self.conn.vendor == 'sqlite':
+            # SQLite driver commits implicitly before DDL statements, so
+            # its transaction handling is switched off and transaction is
+            # controlled explicitly
+            transaction.commit_unless_managed(using=self.conn.alias)
+            self.conn.cursor()  # ensure connection
+            isolation_level = self.conn.connection.isolation_level
+            self.conn.connection.isolation_level = None
+            try:
+                self.execute(['BEGIN'])
+                try:
+                    self.execute(statements)
+                except:
+                    self.execute(['ROLLBACK'])
+                    raise
+                self.execute(['COMMIT'] + drops)
+            finally:
+                self.conn.connection.isolation_level = isolation_level
+            return
+
+        with transaction.commit_on_success(using=self.conn.alias):
+            self.execute(statements + drops)
+            transaction.set_dirty(using=self.conn.alias)
+
+    def drop(self):
+        qn = self.conn.ops.quote_name
+        transaction.commit_unless_managed(using=self.conn.alias)
+        self.execute(['DROP TABLE IF EXISTS {0}'.format(
+                                            qn(staging._meta.db_table))
+                      for staging in reversed(self.models)])
+
+
+def make_staging_models(suffix):
+    """Create (country, city, airport) models mapped to staging tables
+
+    Fields, constraints and methods are copied from live models, foreign
+    keys reference staging models.
+    """
+    location_fields = set(f.name for f in Location._meta.fields)
+    created = {}
+    for live in StagingTables.live_models:
+        opts = live._meta
+        attrs = {
+            '__module__': __name__,
+            'Meta': type(str('Meta'), (object,), {
+                'app_label': 'locations_staging',
+                'db_table': '{0}_{1}'.format(opts.db_table, suffix),
+                'unique_together': opts.unique_together,
+                'index_together': opts.index_together,
+            }),
+            'make_slug': live.make_slug.__func__,
+        }
+        for f in opts.local_fields:
+            if f.auto_created or f.name in location_fields:
+                continue
+            if isinstance(f, models.ForeignKey):
+                field = models.ForeignKey(created[f.rel.to],
+                                          related_name='+',
+                                          db_column=f.db_column,
+                                          verbose_name=f.verbose_name)
+                field.creation_counter = f.creation_counter
+            else:
+                field = copy.deepcopy(f)
+            attrs[f.name] = field
+        name = str('{0}{1}'.format(live.__name__, suffix.capitalize()))
+        created[live] = type(name, (Location,), attrs)
+    return tuple(created[live] for live in StagingTables.live_models)
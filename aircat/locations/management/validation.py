@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import math
+import decimal
+
+from django.core import validators
+from django.core.exceptions import ValidationError
+from django.db import models
+from django.utils.encoding import force_text, smart_text
+
+
+class BatchValidator(object):
+
+    """Validate buffer of model objects column by column
+
+    Replacement for per-object `Model.clean_fields()` + `Model.clean()`
+    calls during bulk import. Field values are converted and checked for
+    the whole buffer at once with cheap type-specific code paths (string
+    lengths, value ranges, decimal and integer conversion). Produced error
+    messages are the same as `clean_fields()` ones.
+
+    Fields with choices or of types without fast path are validated with
+    regular `Field.clean()`.
+    """
+
+    def __init__(self, model_cls, exclude=None):
+        exclude = exclude or ()
+        self.fields = [f for f in model_cls._meta.fields
+                       if f.name not in exclude]
+        self.custom_clean = (model_cls.clean.__func__ is not
+                             models.Model.clean.__func__)
+
+    def validate(self, objs):
+        """Clean field values of `objs` in place
+
+        Returns list of `ValidationError` (or `None` for valid objects)
+        aligned with `objs`.
+        """
+        errors = [None] * len(objs)
+        for f in self.fields:
+            self.validate_column(f, objs, errors)
+
+        result = []
+        for o, e in zip(objs, errors):
+            if e is None and self.custom_clean:
+                try:
+                    o.clean()
+                except ValidationError as clean_error:
+                    result.append(clean_error)
+                    continue
+            result.append(ValidationError(e) if e is not None else None)
+        return result
+
+    def validate_column(self, f, objs, errors):
+        attname = f.attname
+        blank, null = f.blank, f.null
+        empty = validators.EMPTY_VALUES
+
+        to_python = self.converter(f)
+        if to_python is None or f._choices or not f.editable:
+            for i, o in enumerate(objs):
+                raw_value = getattr(o, attname)
+                if blank and raw_value in empty:
+                    continue
+                try:
+                    setattr(o, attname, f.clean(raw_value, o))
+                except ValidationError as e:
+                    self.add_error(errors, i, f, e.messages)
+            return
+
+        # convert values and check nullability. Converted values of
+        # non-empty raw values are never empty, so emptiness of converted
+        # value is checked only for empty raw ones
+        idx, raw_values, values = [], [], []
+        for i, o in enumerate(objs):
+            raw_value = getattr(o, attname)
+            is_empty = raw_value in empty
+            if is_empty and blank:
+                continue
+            if raw_value is not None:
+                try:
+                    value = to_python(raw_value)
+                except (TypeError, ValueError, decimal.InvalidOperation):
+                    self.add_error(errors, i, f,
+                                   [f.error_messages['invalid'] % raw_value])
+                    continue
+                if value is not raw_value:
+                    setattr(o, attname, value)
+            else:
+                value = None
+            if is_empty and value in empty:
+                if value is None and not null:
+                    self.add_error(errors, i, f, [f.error_messages['null']])
+                else:
+                    self.add_error(errors, i, f, [f.error_messages['blank']])
+                continue
+            idx.append(i)
+            raw_values.append(raw_value)
+            values.append(value)
+
+        if not values or not f.validators:
+            return
+
+        # run validators over the whole column
+        failed = {}  # index in column -> messages
+        lengths, floats = None, None
+        for v in f.validators:
+            if isinstance(v, (validators.MinLengthValidator,
+                              validators.MaxLengthValidator)):
+                if lengths is None:
+                    lengths = [len(x) for x in values]
+                column = lengths
+            elif (isinstance(v, (validators.MinValueValidator,
+                                 validators.MaxValueValidator)) and
+                    isinstance(f, models.DecimalField)):
+                # pure Python `Decimal` comparison is slow, compare floats
+                # and fall back to exact comparison only near the limit
+                if floats is None:
+                    floats = [float(x) for x in raw_values]
+                limit, compare = v.limit_value, v.compare
+                for j, x in enumerate(floats):
+                    if abs(x - limit) < 1e-6:
+                        if not compare(values[j], limit):
+                            continue
+                    elif not compare(x, limit):
+                        continue
+                    params = {'limit_value': limit, 'show_value': values[j]}
+                    failed.setdefault(j, []).extend(self.validator_messages(
+                            f, v, [force_text(v.message % params)], params))
+                continue
+            elif isinstance(v, (validators.MinValueValidator,
+                                validators.MaxValueValidator)):
+                column = values
+            else:
+                for j, value in enumerate(values):
+                    try:
+                        v(value)
+                    except ValidationError as e:
+                        failed.setdefault(j, []).extend(
+                                    self.validator_messages(f, e, e.messages))
+                continue
+
+            limit, compare = v.limit_value, v.compare
+            for j, cleaned in enumerate(column):
+                if compare(cleaned, limit):
+                    params = {'limit_value': limit, 'show_value': cleaned}
+                    failed.setdefault(j, []).extend(self.validator_messages(
+                            f, v, [force_text(v.message % params)], params))
+
+        for j, messages in failed.iteritems():
+            self.add_error(errors, idx[j], f, messages)
+
+    @staticmethod
+    def converter(f):
+        """Return fast `to_python` replacement for field or `None`"""
+        if isinstance(f, models.AutoField):
+            return None
+        if isinstance(f, models.CharField):
+            return lambda x: x if type(x) is unicode else smart_text(x)
+        if isinstance(f, models.DecimalField):
+            return lambda x: (x if isinstance(x, decimal.Decimal)
+                              else decimal.Decimal(x))
+        if isinstance(f, models.IntegerField):
+            return int
+        if isinstance(f, models.FloatField):
+            return finite_float
+        return None
+
+    @staticmethod
+    def validator_messages(f, v, messages, params=None):
+        """Replace validator messages with field ones like
+        `Field.run_validators()` does"""
+        code = getattr(v, 'code', None)
+        if code is None or code not in f.error_messages:
+            return messages
+        message = f.error_messages[code]
+        params = params if params is not None else getattr(v, 'params', None)
+        if params:
+            message = message % params
+        return [force_text(message)]
+
+    @staticmethod
+    def add_error(errors, i, f, messages):
+        if errors[i] is None:
+            errors[i] = {}
+        errors[i][f.name] = [force_text(m) for m in messages]
+
+
+def finite_float(x):
+    # NaN passes range validators
+    value = float(x)
+    if math.isnan(value) or math.isinf(value):
+        raise ValueError
+    return value
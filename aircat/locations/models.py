@@ -2,11 +2,31 @@
 
 from __future__ import unicode_literals
 
+from django.conf import settings
 from django.db import models
 from django.core.urlresolvers import reverse
-from django.core.validators import MinLengthValidator
+from django.core.validators import (
+    MinLengthValidator, MinValueValidator, MaxValueValidator)
 from django.utils.text import slugify
 
+from locations.geomath import haversine
+
+
+def coordinate_field(verbose_name, limit, use_float=None):
+    """Return field of coordinate in [-limit, limit] degrees
+
+    `FloatField` if `CATALOG_FLOAT_COORDINATES` setting is on (values are
+    loaded without `Decimal` conversion), `DecimalField` otherwise. Tables
+    of existing DB are converted by `migratecoordinates` command.
+    """
+    if use_float is None:
+        use_float = getattr(settings, 'CATALOG_FLOAT_COORDINATES', False)
+    validators = [MinValueValidator(-limit), MaxValueValidator(limit)]
+    if use_float:
+        return models.FloatField(verbose_name, validators=validators)
+    return models.DecimalField(verbose_name, max_digits=9, decimal_places=6,
+                               validators=validators)
+
 
 class Location(models.Model):
 
@@ -18,13 +38,26 @@ class Location(models.Model):
                                db_index=True, blank=True)
     slug = models.SlugField(max_length=100, unique=True)
 
-    latitude = models.DecimalField('широта', max_digits=9, decimal_places=6)
-    longitude = models.DecimalField('долгота', max_digits=9, decimal_places=6)
+    # normalized first letters of names for indexed letter filtering,
+    # maintained by `set_first_letters()`
+    name_fl = models.CharField(max_length=1, blank=True, editable=False)
+    name_ru_fl = models.CharField(max_length=1, blank=True, editable=False)
+
+    latitude = coordinate_field('широта', 90)
+    longitude = coordinate_field('долгота', 180)
 
     def make_slug(self, *args):
         """Generate and set slug for model"""
         raise NotImplementedError
 
+    def set_first_letters(self):
+        self.name_fl = first_letter(self.name)
+        self.name_ru_fl = first_letter(self.name_ru)
+
+    def save(self, *args, **kwargs):
+        self.set_first_letters()
+        super(Location, self).save(*args, **kwargs)
+
     def extended_name(self):
         """Returns both names (en, ru) when available"""
         if self.name_ru:
@@ -44,6 +77,13 @@ class Location(models.Model):
         return self.name
 
 
+class ParentLocationManager(models.Manager):
+
+    def non_empty(self):
+        """Locations having at least one airport"""
+        return self.get_query_set().filter(airport_count__gt=0)
+
+
 class Country(Location):
 
     class Meta:
@@ -51,11 +91,21 @@ class Country(Location):
         verbose_name_plural = 'страны'
         ordering = ['name']
         unique_together = ('name',)
+        index_together = [('name_fl', 'name'),
+                          ('name_ru_fl', 'name_ru', 'name')]
 
     iso_code = models.CharField('ISO код', primary_key=True, max_length=2,
                                 validators=[MinLengthValidator(2)],
                                 help_text='ISO 3166-1 alpha-2 код страны')
 
+    # maintained by importer
+    city_count = models.PositiveIntegerField('число городов', default=0,
+                                             editable=False)
+    airport_count = models.PositiveIntegerField('число аэропортов',
+                                                default=0, editable=False)
+
+    objects = ParentLocationManager()
+
     def make_slug(self, *args):
         if args:
             self.slug = slugify_args(args)
@@ -72,22 +122,32 @@ class City(Location):
         verbose_name_plural = 'города'
         ordering = ['name']
         unique_together = ('country', 'name')
+        index_together = [
+            # list of country cities ordered by russian name
+            ('country', 'name_ru', 'name'),
+            # lists filtered by first letter
+            ('country', 'name_fl', 'name'),
+            ('country', 'name_ru_fl', 'name_ru', 'name'),
+        ]
 
     country = models.ForeignKey(Country, related_name='cities',
                                 db_column='country_iso',
                                 verbose_name='страна')
 
+    # maintained by importer
+    airport_count = models.PositiveIntegerField('число аэропортов',
+                                                default=0, editable=False)
+
+    objects = ParentLocationManager()
+
     def make_slug(self, *args):
         if args:
             self.slug = slugify_args(args)
             return
-        try:
-            self.country
-        except Country.DoesNotExist:
+        # country pk is its ISO code, so no need to fetch related object
+        if not self.name or not self.country_id:
             raise ValueError
-        if not self.name or not self.country.iso_code:
-            raise ValueError
-        self.slug = slugify_args(self.country.iso_code, self.name)
+        self.slug = slugify_args(self.country_id, self.name)
 
 
 class Airport(Location):
@@ -97,6 +157,10 @@ class Airport(Location):
         verbose_name_plural = 'аэропорты'
         ordering = ['name']
         unique_together = ('city', 'name')
+        index_together = [
+            # bulk API list of city airports in primary key order
+            ('city', 'iata_code'),
+        ]
 
     altitude = models.IntegerField('высота')
 
@@ -106,6 +170,11 @@ class Airport(Location):
     city = models.ForeignKey(City, related_name='airports',
                                 verbose_name='город')
 
+    def distance_to(self, other):
+        """Great-circle distance to other location in km"""
+        return haversine(float(self.latitude), float(self.longitude),
+                         float(other.latitude), float(other.longitude))
+
     def make_slug(self, *args):
         if args:
             self.slug = slugify_args(args)
@@ -115,6 +184,11 @@ class Airport(Location):
         self.slug = slugify_args(self.iata_code, self.name)
 
 
+def first_letter(name):
+    """Normalized first letter of name (as matched by `istartswith`)"""
+    return name[:1].upper() if name else ''
+
+
 def slugify_args(*args):
     if not args:
         raise ValueError
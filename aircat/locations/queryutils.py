@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+from django.db.models import Q
+
+
+def iter_chunks(qs, fields, chunk_size=2000, after=None):
+    """Iterate over `qs` rows in chunks ordered by primary key
+
+    Yields lists of value tuples (pk first, then `fields`) with at most
+    `chunk_size` items. Each chunk is fetched by separate keyset query
+    (`pk > last seen pk`), so neither DB nor Python side has to hold more
+    than one chunk and deep chunks cost the same as first one. Iteration
+    starts after `after` primary key when given.
+    """
+    qs = qs.order_by('pk').values_list('pk', *fields)
+    while True:
+        chunk_qs = qs if after is None else qs.filter(pk__gt=after)
+        rows = list(chunk_qs[:chunk_size])
+        if not rows:
+            return
+        yield rows
+        if len(rows) < chunk_size:
+            return
+        after = rows[-1][0]
+
+
+def seek(qs, key, values, backward=False):
+    """Filter and order `qs` for keyset pagination
+
+    `key` is a tuple of field names which must be unique within `qs`,
+    `values` are key values of the boundary row. Returns rows following
+    the boundary in `key` order or, if `backward` is set, rows preceding
+    it in reversed order. Without `values` just orders `qs`.
+    """
+    order = tuple(('-' + f if backward else f) for f in key)
+    if values is None:
+        return qs.order_by(*order)
+    lookup = 'lt' if backward else 'gt'
+    cond = None
+    # (a, b) > (x, y)  <=>  a > x OR (a = x AND b > y)
+    for i, field in enumerate(key):
+        kwargs = dict(zip(key[:i], values[:i]))
+        kwargs['{0}__{1}'.format(field, lookup)] = values[i]
+        cond = Q(**kwargs) if cond is None else cond | Q(**kwargs)
+    return qs.filter(cond).order_by(*order)
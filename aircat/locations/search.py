@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import bisect
+
+from django.core.urlresolvers import reverse
+
+from locations.catalog import CatalogSnapshot
+from locations.models import Country, City, Airport
+from locations.queryutils import iter_chunks
+
+
+class PrefixIndex(object):
+
+    """In-memory prefix index over countries, cities and airports
+
+    Lower-cased english and russian names are kept in one sorted list, so
+    prefix lookup is a binary search followed by a scan of matching
+    range. Country ISO and airport IATA codes are matched exactly and go
+    first in results.
+
+    Entries are tuples `(type, code, name, name_ru, slug, context)` where
+    code is ISO/IATA code or city id and context is a short description
+    of where city or airport is.
+    """
+
+    def __init__(self):
+        self.keys = []
+        self.entry_ids = []
+        self.entries = []
+        self.codes = {}
+        self.url_prefixes = {}
+
+    @classmethod
+    def from_db(cls):
+        index = cls()
+        countries = {}
+        for rows in iter_chunks(Country.objects.all(),
+                                ('name', 'name_ru', 'slug')):
+            for iso, name, name_ru, slug in rows:
+                countries[iso] = name
+                index.add(('country', iso, name, name_ru, slug, ''), iso)
+
+        cities = {}
+        for rows in iter_chunks(City.objects.all(),
+                                ('name', 'name_ru', 'slug', 'country')):
+            for pk, name, name_ru, slug, iso in rows:
+                cities[pk] = '{0}, {1}'.format(name, iso)
+                index.add(('city', pk, name, name_ru, slug,
+                           countries.get(iso, iso)))
+
+        for rows in iter_chunks(Airport.objects.all(),
+                                ('name', 'name_ru', 'slug', 'city')):
+            for iata, name, name_ru, slug, city_id in rows:
+                index.add(('airport', iata, name, name_ru, slug,
+                           cities.get(city_id, '')), iata)
+        index.finish()
+        # reverse() is slow compared to search itself, so urls are made
+        # by appending slug to prefix (slug ends all detail urls)
+        index.url_prefixes = dict(
+            (type_, reverse('loc:' + type_, kwargs={'slug': '-'})[:-1])
+            for type_ in ('country', 'city', 'airport'))
+        return index
+
+    def add(self, entry, code=None):
+        name, name_ru = entry[2], entry[3]
+        self.keys.append((name.lower(), len(self.entries)))
+        if name_ru and name_ru.lower() != name.lower():
+            self.keys.append((name_ru.lower(), len(self.entries)))
+        if code:
+            self.codes.setdefault(code.upper(), []).append(len(self.entries))
+        self.entries.append(entry)
+
+    def finish(self):
+        """Sort keys after all entries are added"""
+        self.keys.sort()
+        self.entry_ids = [i for _, i in self.keys]
+        self.keys = [k for k, _ in self.keys]
+
+    def search(self, query, limit=10):
+        query = query.strip()
+        if not query:
+            return []
+        found = list(self.codes.get(query.upper(), ()))[:limit]
+        seen = set(found)
+        prefix = query.lower()
+        pos = bisect.bisect_left(self.keys, prefix)
+        keys, entry_ids = self.keys, self.entry_ids
+        while (len(found) < limit and pos < len(keys) and
+               keys[pos].startswith(prefix)):
+            i = entry_ids[pos]
+            if i not in seen:
+                seen.add(i)
+                found.append(i)
+            pos += 1
+        return [self.entries[i] for i in found]
+
+
+index = CatalogSnapshot(PrefixIndex.from_db)
+
+
+def search(query, limit=10):
+    """Search catalog by name prefix or code, return JSON-ready dicts"""
+    results = []
+    snapshot = index.get()
+    for type_, code, name, name_ru, slug, context in snapshot.search(
+                                                                query, limit):
+        results.append({
+            'type': type_,
+            'code': code,
+            'name': name,
+            'name_ru': name_ru,
+            'context': context,
+            'slug': slug,
+            'url': snapshot.url_prefixes[type_] + slug,
+        })
+    return results
@@ -26,7 +26,7 @@ def alpha_range(lang):
 def gmaps_url(location):
     lat, lon = location.latitude, location.longitude
     params = {
-        'll': '{0},{1}'.format(lat, lon)
+        'll': '{0:.6f},{1:.6f}'.format(lat, lon)
     }
     if isinstance(location, Airport):
         z = 15
@@ -0,0 +1,1262 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+import os
+import re
+import gzip
+import json
+import time
+import shutil
+import sqlite3
+import tempfile
+import unittest
+import threading
+from io import BytesIO
+from decimal import Decimal
+from StringIO import StringIO
+
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.exceptions import ValidationError
+from django.core.management import call_command
+from django.core.urlresolvers import reverse, resolve
+from django.db import DatabaseError, connection, transaction
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import override_settings
+from django.utils.http import http_date
+
+from aircat import dbpool, routers
+from aircat.middleware import (
+    get_query_budget, query_shape, make_profile_token)
+
+from locations import catalog, geo, lookup, search, urls, views
+from locations.models import (
+    Country, City, Airport, coordinate_field, slugify_args)
+from locations.management import (
+    dataexporter, prerender, queryaudit, staging)
+from locations.management.commands.importdata import Command as ImportCommand
+from locations.management.dataimporter import DataImporter, sqlite_fast_mode
+from locations.management.validation import BatchValidator
+
+
+class BatchValidatorTest(unittest.TestCase):
+
+    """Test BatchValidator against per-object `clean_fields()`"""
+
+    def check_same_as_clean_fields(self, model_cls, rows, exclude=None):
+        objs = [model_cls(**row) for row in rows]
+        errors = BatchValidator(model_cls, exclude).validate(objs)
+        for row, obj, error in zip(rows, objs, errors):
+            expected_obj = model_cls(**row)
+            try:
+                expected_obj.clean_fields(exclude=exclude)
+            except ValidationError as e:
+                self.assertIsNotNone(error, row)
+                self.assertEqual(error.message_dict, e.message_dict)
+                self.assertEqual(str(error), str(e))
+            else:
+                self.assertIsNone(error, row)
+                for f in model_cls._meta.fields:
+                    self.assertEqual(getattr(obj, f.attname),
+                                     getattr(expected_obj, f.attname))
+
+    def test_float_coordinates(self):
+        to_python = BatchValidator.converter(
+                                coordinate_field('lat', 90, use_float=True))
+        self.assertEqual(to_python('55.75'), 55.75)
+        for value in ('x', 'nan', 'inf'):
+            self.assertRaises(ValueError, to_python, value)
+
+    def test_country(self):
+        valid = dict(iso_code='RU', name='Russia', name_ru='Россия',
+                     slug='ru-russia', latitude='60.0', longitude='100.0')
+        rows = [valid]
+        for field, value in (('iso_code', 'R'), ('iso_code', 'RUS'),
+                             ('name', ''), ('name', 'x' * 101),
+                             ('name_ru', ''), ('slug', None),
+                             ('latitude', 'abc'), ('latitude', '90.5'),
+                             ('longitude', '-180.000001'),
+                             ('longitude', None)):
+            row = dict(valid)
+            row[field] = value
+            rows.append(row)
+        rows.append(dict(valid, iso_code='', latitude='-91', name=''))
+        self.check_same_as_clean_fields(Country, rows)
+
+    def test_city(self):
+        valid = dict(name='Moscow', name_ru='Москва', slug='ru-moscow',
+                     latitude='55.75222', longitude='37.61556',
+                     country_id='RU')
+        rows = [valid,
+                dict(valid, name_ru='М' * 101),
+                dict(valid, latitude='', longitude='1e3')]
+        self.check_same_as_clean_fields(City, rows, ('country',))
+
+    def test_airport(self):
+        valid = dict(iata_code='SVO', name='Sheremetyevo',
+                     name_ru='Шереметьево', slug='svo-sheremetyevo',
+                     latitude='55.972642', longitude='37.414589',
+                     altitude='622', city_id=1)
+        rows = [valid,
+                dict(valid, altitude='6.5'),
+                dict(valid, altitude=''),
+                dict(valid, iata_code='SV', altitude=None),
+                dict(valid, slug='s' * 101)]
+        self.check_same_as_clean_fields(Airport, rows, ('city',))
+
+
+class StubGeoProvider(object):
+
+    cities = {
+        'Moscow': (('Moscow', 'Москва'), ('55.75', '37.61')),
+        'Saint Petersburg': (('Saint Petersburg', 'Санкт-Петербург'),
+                             ('59.93', '30.31')),
+    }
+
+    def country_city_by_iata(self, iata_code):
+        return None
+
+    def country_iso_code(self, name):
+        return 'RU' if name == 'Russia' else None
+
+    def add_alt_city_name(self, iso_code, name, alt_name):
+        pass
+
+    def country_names(self, iso_code):
+        return ('Russia', 'Россия') if iso_code == 'RU' else None
+
+    def country_latlon(self, iso_code):
+        return ('60', '100') if iso_code == 'RU' else None
+
+    def city_names(self, iso_code, name):
+        return self.cities.get(name, (None,))[0]
+
+    def city_latlon(self, iso_code, name):
+        return self.cities.get(name, (None, None))[1]
+
+    def airport_names(self, iata_code):
+        return None
+
+
+class DataImporterTest(TestCase):
+
+    data = (b'1,"Sheremetyevo","Moscow","Russia","SVO","UUEE",'
+            b'55.972642,37.414589,622,3,"N"\n'
+            b'2,"Domod\xe9dovo","Moscow","Russia","DME","UUDD",'
+            b'55.408611,37.906111,588,3,"N"\n'
+            b'3,"Pulkovo","Saint Petersburg","Russia","LED","ULLI",'
+            b'59.800292,30.262503,78,3,"N"\n'
+            b'4,"Nowhere","Atlantis","Russia","XXX","XXXX",'
+            b'0.0,0.0,0,3,"N"\n')
+
+    def test_import_with_geo_provider(self):
+        columns = dict((c, i) for i, c in
+                       enumerate(ImportCommand.default_format.split(',')))
+        stderr = StringIO()
+        importer = DataImporter(columns, stdout=StringIO(), stderr=stderr,
+                                gp=StubGeoProvider())
+        importer.start(BytesIO(self.data), buffer_size=2)
+        self.assertEqual(sorted(Airport.objects.values_list('iata_code',
+                                                            flat=True)),
+                         ['LED', 'SVO'])
+        self.assertEqual(Country.objects.get().airport_count, 2)
+        self.assertIn('SKIP: Invalid encoding of row 2', stderr.getvalue())
+
+
+class FastImportTest(TransactionTestCase):
+
+    pragmas = ('journal_mode', 'synchronous', 'cache_size', 'temp_store')
+
+    def sqlite_state(self):
+        cursor = connection.cursor()
+        pragmas = []
+        for name in self.pragmas:
+            cursor.execute('PRAGMA {0}'.format(name))
+            pragmas.append(cursor.fetchone()[0])
+        cursor.execute("SELECT name, sql FROM sqlite_master "
+                       "WHERE type = 'index' AND tbl_name LIKE 'locations_%%'")
+        return pragmas, sorted(cursor.fetchall())
+
+    def import_data(self, gp=None, buffer_size=2):
+        columns = dict((c, i) for i, c in
+                       enumerate(ImportCommand.default_format.split(',')))
+        importer = DataImporter(columns, stdout=StringIO(), stderr=StringIO(),
+                                fast=True, gp=gp or StubGeoProvider())
+        importer.start(BytesIO(DataImporterTest.data),
+                       buffer_size=buffer_size)
+        return importer
+
+    def test_settings_restored(self):
+        state = self.sqlite_state()
+        with sqlite_fast_mode(connection, (Country, City, Airport)):
+            pragmas, indexes = self.sqlite_state()
+            self.assertEqual(pragmas[1], 0)  # synchronous OFF
+            self.assertTrue(all(sql.startswith('CREATE UNIQUE ')
+                                for name, sql in indexes if sql))
+            self.assertLess(len(indexes), len(state[1]))
+        self.assertEqual(self.sqlite_state(), state)
+
+        with self.assertRaises(ValueError):
+            with sqlite_fast_mode(connection, (Country, City, Airport)):
+                raise ValueError
+        self.assertEqual(self.sqlite_state(), state)
+
+    def test_settings_restored_after_failed_import(self):
+        class FailingGeoProvider(StubGeoProvider):
+            def city_names(self, iso_code, name):
+                if name == 'Atlantis':
+                    raise ValueError
+                return super(FailingGeoProvider, self).city_names(iso_code,
+                                                                  name)
+        state = self.sqlite_state()
+        with self.assertRaises(ValueError):
+            # fails after SVO is flushed
+            self.import_data(FailingGeoProvider(), buffer_size=1)
+        self.assertEqual(self.sqlite_state(), state)
+        self.assertFalse(Airport.objects.exists())
+
+    def test_import_into_populated_db(self):
+        state = self.sqlite_state()
+        self.import_data()
+        self.assertEqual(self.sqlite_state(), state)
+        Airport.objects.filter(pk='SVO').delete()
+        importer = self.import_data()
+        # existing objects are preloaded, not looked up row by row
+        self.assertEqual(importer.existing_airports, set(['LED']))
+        self.assertEqual(sorted(importer.cities), [('RU', 'Moscow'),
+                                                   ('RU', 'Saint Petersburg')])
+        self.assertEqual((importer.inserted_airport_cnt,
+                          importer.existing_airport_cnt), (1, 1))
+        self.assertEqual(City.objects.count(), 2)
+        self.assertEqual(City.objects.get(name='Moscow').airport_count, 2)
+
+
+class StagingImportTest(TransactionTestCase):
+
+    def setUp(self):
+        country = Country.objects.create(
+            iso_code='RU', name='Russia', name_ru='Россия', slug='ru-russia',
+            latitude='60.0', longitude='100.0', city_count=1,
+            airport_count=1)
+        moscow = City.objects.create(
+            country=country, name='Moscow', name_ru='Москва',
+            slug='ru-moscow', latitude='55.75', longitude='37.61',
+            airport_count=1)
+        Airport.objects.create(
+            iata_code='SVO', city=moscow, name='Sheremetyevo', slug='svo',
+            altitude=622, latitude='55.972642', longitude='37.414589')
+        self.tables = staging.StagingTables(suffix='test')
+        self.tables.create()
+
+    def tearDown(self):
+        self.tables.drop()
+
+    def import_data(self, data=DataImporterTest.data):
+        columns = dict((c, i) for i, c in
+                       enumerate(ImportCommand.default_format.split(',')))
+        importer = DataImporter(columns, stdout=StringIO(),
+                                stderr=StringIO(), gp=StubGeoProvider(),
+                                models=self.tables.models)
+        importer.start(BytesIO(data), buffer_size=2)
+
+    def test_version_not_bumped_before_publish(self):
+        version = catalog.bump_version()
+        self.import_data()
+        self.assertEqual(catalog.get_version(), version)
+        self.assertEqual(self.tables.models[2].objects.count(), 2)
+        self.assertEqual(Airport.objects.count(), 1)
+
+    def table_names(self):
+        return connection.introspection.table_names()
+
+    def test_publish(self):
+        self.import_data()
+        self.tables.build_indexes()
+        # live tables are intact until publish
+        self.assertEqual(list(Airport.objects.values_list('pk', flat=True)),
+                         ['SVO'])
+        self.assertEqual(City.objects.count(), 1)
+
+        self.tables.publish()
+        led = Airport.objects.select_related('city__country').get(pk='LED')
+        self.assertEqual(led.city.name, 'Saint Petersburg')
+        self.assertEqual(led.city.country.name_ru, 'Россия')
+        self.assertEqual(Airport.objects.get(pk='SVO').city.name, 'Moscow')
+        country = Country.objects.get()
+        self.assertEqual((country.city_count, country.airport_count), (2, 2))
+        self.assertEqual([t for t in self.table_names()
+                          if t.endswith('_test') or '_old_' in t], [])
+        # foreign keys reference renamed live tables
+        cursor = connection.cursor()
+        cursor.execute("SELECT sql FROM sqlite_master WHERE name = %s",
+                       ['locations_airport'])
+        self.assertNotIn('_test', cursor.fetchone()[0])
+
+    def test_failed_publish_is_rolled_back(self):
+        self.import_data()
+        cursor = connection.cursor()
+        # rename of live table to old one fails
+        cursor.execute('CREATE TABLE locations_airport_old_test (x integer)')
+        with self.assertRaises(DatabaseError):
+            self.tables.publish()
+        self.assertEqual(list(Airport.objects.values_list('pk', flat=True)),
+                         ['SVO'])
+        self.assertEqual(self.tables.models[2].objects.count(), 2)
+        cursor.execute('DROP TABLE locations_airport_old_test')
+
+    def test_failed_import_drops_staging_tables(self):
+        self.tables.drop()
+        command = ImportCommand()
+        command.stdout, command.stderr = StringIO(), StringIO()
+
+        def fail():
+            raise staging.Error('index build failed')
+        self.tables.build_indexes = fail
+        importer = DataImporter(
+            dict((c, i) for i, c in
+                 enumerate(ImportCommand.default_format.split(','))),
+            stdout=StringIO(), stderr=StringIO(), gp=StubGeoProvider(),
+            models=self.tables.models)
+        with self.assertRaises(staging.Error):
+            command.staging_import(importer, self.tables,
+                                   BytesIO(DataImporterTest.data),
+                                   {'buffer_size': 2})
+        self.assertEqual([t for t in self.table_names()
+                          if t.endswith('_test')], [])
+        self.assertEqual(Airport.objects.count(), 1)
+
+
+class MigrateCoordinatesTest(TransactionTestCase):
+
+    tables = ('locations_country', 'locations_city', 'locations_airport')
+
+    def setUp(self):
+        country = Country.objects.create(
+            iso_code='RU', name='Russia', name_ru='Россия', slug='ru-russia',
+            latitude='60.0', longitude='100.0', city_count=2,
+            airport_count=2)
+        for name, iata, lat, lon in (
+                ('Moscow', 'SVO', '55.972642', '37.414589'),
+                ('Saint Petersburg', 'LED', '59.800292', '30.262503')):
+            city = City.objects.create(
+                country=country, name=name, slug=iata.lower(),
+                name_ru='Москва' if iata == 'SVO' else '',
+                latitude='55.75', longitude='37.61', airport_count=1)
+            Airport.objects.create(
+                iata_code=iata, city=city, name=iata, slug=iata.lower(),
+                altitude=0, latitude=lat, longitude=lon)
+
+    def column_types(self, table):
+        cursor = connection.cursor()
+        cursor.execute('PRAGMA table_info({0})'.format(table))
+        return dict((row[1], row[2].lower()) for row in cursor.fetchall())
+
+    def rebuild_live_tables(self, coordinates='decimal', dropped=()):
+        """Rebuild live tables with `coordinates` column type (e.g. 'real'
+        as if they were created with `CATALOG_FLOAT_COORDINATES` on) and
+        without `dropped` columns (as in DB of older version)"""
+        cursor = connection.cursor()
+        for table in self.tables:
+            columns = ', '.join('"{0}"'.format(c)
+                                for c in self.column_types(table)
+                                if c not in dropped)
+            cursor.execute('SELECT type, sql FROM sqlite_master '
+                           'WHERE tbl_name = %s AND sql IS NOT NULL', [table])
+            rows = cursor.fetchall()
+            create = [sql for kind, sql in rows if kind == 'table'][0]
+            create = create.replace('"{0}"'.format(table),
+                                    '"{0}_old"'.format(table), 1)
+            create = create.replace(' decimal', ' ' + coordinates)
+            for column in dropped:
+                create = re.sub(r',\s*"{0}" [^,]*'.format(column), '', create)
+            cursor.execute(create)
+            cursor.execute('INSERT INTO "{0}_old" ({1}) SELECT {1} FROM "{0}"'
+                           .format(table, columns))
+            cursor.execute('DROP TABLE "{0}"'.format(table))
+            cursor.execute('ALTER TABLE "{0}_old" RENAME TO "{0}"'
+                           .format(table))
+            for kind, sql in rows:
+                if kind == 'index' and not any('"{0}"'.format(c) in sql
+                                               for c in dropped):
+                    cursor.execute(sql)
+        transaction.commit_unless_managed()
+
+    def test_convert_populated_db(self):
+        self.rebuild_live_tables(coordinates='real')
+        self.assertEqual(self.column_types('locations_airport')['latitude'],
+                         'real')
+        version = catalog.get_version()
+        call_command('migratecoordinates', stdout=StringIO(),
+                     stderr=StringIO())
+
+        for table in self.tables:
+            types = self.column_types(table)
+            self.assertEqual((types['latitude'], types['longitude']),
+                             ('decimal', 'decimal'))
+        self.assertEqual([t for t in connection.introspection.table_names()
+                          if t.startswith('locations_') and
+                          t not in self.tables], [])
+        svo = Airport.objects.select_related('city__country').get(pk='SVO')
+        self.assertEqual((svo.latitude, svo.longitude),
+                         (Decimal('55.972642'), Decimal('37.414589')))
+        self.assertEqual((svo.city.name, svo.city.country.name_ru),
+                         ('Moscow', 'Россия'))
+        self.assertEqual(sorted(City.objects.filter(country='RU')
+                                .values_list('airport_count', flat=True)),
+                         [1, 1])
+        country = Country.objects.get()
+        self.assertEqual((country.city_count, country.airport_count), (2, 2))
+        self.assertNotEqual(catalog.get_version(), version)
+        # new rows get next ids
+        self.assertEqual(City.objects.create(
+            country=country, name='Kazan', slug='kzn', latitude='55.79',
+            longitude='49.12').pk, 3)
+
+    def test_upgrade_old_db(self):
+        derived = ('name_fl', 'name_ru_fl', 'city_count', 'airport_count')
+        self.rebuild_live_tables(dropped=derived)
+        self.assertNotIn('name_fl', self.column_types('locations_city'))
+        stdout = StringIO()
+        call_command('migratecoordinates', stdout=stdout, stderr=StringIO())
+        self.assertIn('Filled missing columns of locations_city: name_fl, '
+                      'name_ru_fl, airport_count', stdout.getvalue())
+
+        country = Country.objects.get()
+        self.assertEqual((country.name_fl, country.name_ru_fl), ('R', 'Р'))
+        self.assertEqual((country.city_count, country.airport_count), (2, 2))
+        moscow = City.objects.get(name='Moscow')
+        self.assertEqual((moscow.name_fl, moscow.name_ru_fl), ('M', 'М'))
+        self.assertEqual(moscow.airport_count, 1)
+        self.assertEqual(City.objects.get(pk=2).name_ru_fl, '')
+        self.assertEqual(Airport.objects.get(pk='LED').name_fl, 'L')
+        cursor = connection.cursor()
+        cursor.execute("SELECT COUNT(*) FROM sqlite_master WHERE type = "
+                       "'index' AND tbl_name = 'locations_city' "
+                       "AND sql LIKE '%%name_ru_fl%%'")
+        self.assertEqual(cursor.fetchone()[0], 1)
+
+
+class ExportDataTest(TestCase):
+
+    airports = (('SVO', 'Sheremetyevo', 'Moscow', '55.972642', '37.414589'),
+                ('DME', 'Domodedovo', 'Moscow', '55.408611', '37.906111'),
+                ('LED', 'Pulkovo', 'Saint Petersburg', '59.800292',
+                 '30.262503'))
+
+    def setUp(self):
+        self.output_dir = tempfile.mkdtemp()
+        gp = StubGeoProvider()
+        country = Country.objects.create(
+            iso_code='RU', name='Russia', name_ru='Россия', slug='ru-russia',
+            latitude='60.0', longitude='100.0')
+        cities = {}
+        for name in gp.cities:
+            (name, name_ru), (lat, lon) = gp.cities[name]
+            cities[name] = City.objects.create(
+                country=country, name=name, name_ru=name_ru,
+                slug=slugify_args('RU', name), latitude=lat, longitude=lon)
+        for iata, name, city, lat, lon in self.airports:
+            Airport.objects.create(
+                iata_code=iata, city=cities[city], name=name,
+                slug=iata.lower(), altitude=100, latitude=lat, longitude=lon)
+
+    def tearDown(self):
+        shutil.rmtree(self.output_dir)
+
+    def export(self, *args, **options):
+        path = os.path.join(self.output_dir, 'export')
+        call_command('exportdata', path, *args, stderr=StringIO(), **options)
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def test_csv_round_trip(self):
+        data = self.export()
+        Airport.objects.all().delete()
+        City.objects.all().delete()
+        Country.objects.all().delete()
+        columns = dict((c, i) for i, c in
+                       enumerate(ImportCommand.default_format.split(',')))
+        importer = DataImporter(columns, stdout=StringIO(),
+                                stderr=StringIO(), gp=StubGeoProvider())
+        importer.start(BytesIO(data))
+        for iata, name, city, lat, lon in self.airports:
+            airport = Airport.objects.select_related('city').get(pk=iata)
+            self.assertEqual((airport.name, airport.city.name,
+                              airport.city.country_id, airport.altitude),
+                             (name, city, 'RU', 100))
+            self.assertAlmostEqual(float(airport.latitude), float(lat))
+            self.assertAlmostEqual(float(airport.longitude), float(lon))
+        self.assertEqual(Country.objects.get().airport_count, 3)
+
+    def test_jsonl_and_gzip(self):
+        data = self.export(format='jsonl')
+        rows = [json.loads(line) for line in data.decode('utf8').splitlines()]
+        self.assertEqual([r['model'] for r in rows],
+                         ['country'] + ['city'] * 2 + ['airport'] * 3)
+        self.assertEqual(rows[0]['name_ru'], 'Россия')
+        compressed = self.export(format='jsonl', gzip=True)
+        self.assertEqual(
+            gzip.GzipFile(fileobj=BytesIO(compressed)).read(), data)
+
+    def test_snapshot(self):
+        data = self.export(format='snapshot')
+        tables = {}
+        for name, fields, rows in dataexporter.read_snapshot(BytesIO(data)):
+            tables.setdefault(name, []).extend(
+                dict(zip(fields, row)) for row in rows)
+        self.assertEqual(sorted(a['iata_code'] for a in tables['airport']),
+                         ['DME', 'LED', 'SVO'])
+        self.assertEqual(tables['country'][0]['latitude'], 60.0)
+        self.assertEqual(len(tables['city']), 2)
+        for bad in (b'', data[:-3], b'\x80\x02 not a snapshot'):
+            with self.assertRaises(dataexporter.Error):
+                list(dataexporter.read_snapshot(BytesIO(bad)))
+
+
+class CatalogPageCacheTest(TestCase):
+
+    def setUp(self):
+        # start from fresh version so pages cached by other runs are missed
+        catalog.bump_version()
+        Country.objects.create(iso_code='RU', name='Russia',
+                               name_ru='Россия', slug='ru-russia',
+                               latitude='60.0', longitude='100.0',
+                               airport_count=1)
+
+    def test_cached_until_catalog_changed(self):
+        url = reverse('loc:countries')
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        with self.assertNumQueries(0):
+            cached = self.client.get(url)
+        self.assertEqual(cached.content, response.content)
+
+        Country.objects.create(iso_code='BY', name='Belarus',
+                               name_ru='Беларусь', slug='by-belarus',
+                               latitude='53.0', longitude='28.0',
+                               airport_count=1)
+        self.assertNotIn(b'Belarus', self.client.get(url).content)
+        catalog.bump_version()
+        self.assertIn(b'Belarus', self.client.get(url).content)
+
+    def test_filter_params_in_key(self):
+        url = reverse('loc:countries')
+        self.assertIn(b'Russia', self.client.get(url).content)
+        self.assertNotIn(b'Russia', self.client.get(url + '?fl_en=B').content)
+
+    def test_version_cache_follows_settings(self):
+        # test runner replaces shared caches with in-process ones
+        self.assertIsInstance(catalog.cache, LocMemCache)
+        version = catalog.get_version()
+        with self.settings(CACHES={'default': {
+                'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                'LOCATION': 'aircat-test-other'}}):
+            self.assertIsNone(catalog.cache.get(catalog.VERSION_KEY))
+        self.assertEqual(catalog.get_version(), version)
+
+
+class ConditionalGetTest(TestCase):
+
+    def setUp(self):
+        catalog.bump_version()
+        Country.objects.create(iso_code='RU', name='Russia',
+                               name_ru='Россия', slug='ru-russia',
+                               latitude='60.0', longitude='100.0',
+                               airport_count=1)
+
+    def test_not_modified_until_catalog_changed(self):
+        url = reverse('loc:country', kwargs={'slug': 'ru-russia'})
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        self.assertFalse(etag.startswith('W/'))
+        self.assertIn('max-age=0', response['Cache-Control'])
+        with self.assertNumQueries(0):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+        other = self.client.get(reverse('loc:countries') + '?fl_en=R')
+        self.assertNotEqual(other['ETag'], etag)
+        catalog.bump_version()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_if_modified_since(self):
+        url = reverse('loc:countries')
+        last_modified = self.client.get(url)['Last-Modified']
+        with self.assertNumQueries(0):
+            response = self.client.get(
+                url, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 304)
+
+    def test_validators_of_cached_page(self):
+        url = reverse('loc:countries')
+        tagged = self.client.get(url + '?utm=x')['ETag']
+        # page cached for other query string gets validators of request
+        response = self.client.get(url)
+        etag = response['ETag']
+        self.assertNotEqual(etag, tagged)
+        for i in range(2):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 304)
+        response = self.client.get(url + '?utm=x', HTTP_IF_NONE_MATCH=tagged)
+        self.assertEqual(response.status_code, 304)
+
+    def test_new_release(self):
+        url = reverse('loc:country', kwargs={'slug': 'ru-russia'})
+        with self.settings(CATALOG_RELEASE='r1'):
+            response = self.client.get(url)
+        etag, last_modified = response['ETag'], response['Last-Modified']
+        deployed = time.time() + 3600
+        with self.settings(CATALOG_RELEASE='r2',
+                           CATALOG_RELEASE_TIME=deployed):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag,
+                                       HTTP_IF_MODIFIED_SINCE=last_modified)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotEqual(response['ETag'], etag)
+            self.assertEqual(response['Last-Modified'],
+                             http_date(int(deployed)))
+            response = self.client.get(
+                url, HTTP_IF_MODIFIED_SINCE=last_modified)
+            self.assertEqual(response.status_code, 200)
+
+
+class KeysetPaginationTest(TestCase):
+
+    names = [('Abakan', 'Абакан'), ('Anadyr', 'Анадырь'),
+             ('Barnaul', 'Барнаул'), ('Bratsk', 'Братск'),
+             ('Chita', 'Чита')]
+
+    def setUp(self):
+        catalog.bump_version()
+        self.country = Country.objects.create(
+            iso_code='RU', name='Russia', name_ru='Россия', slug='ru-russia',
+            latitude='60.0', longitude='100.0', airport_count=1)
+        for name, name_ru in self.names:
+            City.objects.create(country=self.country, name=name,
+                                name_ru=name_ru, slug='ru-' + name.lower(),
+                                latitude='50.0', longitude='100.0',
+                                airport_count=1)
+        self.url = reverse('loc:cities', kwargs={'country': 'RU'})
+
+    def walk(self, url, attr='name'):
+        """Follow next links, then previous ones, return visited pages"""
+        forward, backward = [], []
+        page = None
+        while url:
+            ctx = self.client.get(url).context
+            page = ctx['page_obj']
+            forward.append([getattr(c, attr) for c in ctx['city_list']])
+            url = page.next_url
+        url = page.previous_url
+        while url:
+            ctx = self.client.get(url).context
+            backward.append([getattr(c, attr) for c in ctx['city_list']])
+            url = ctx['page_obj'].previous_url
+        return forward, backward[::-1]
+
+    def test_pages(self):
+        forward, backward = self.walk(self.url + '?size=2')
+        self.assertEqual(forward, [['Abakan', 'Anadyr'],
+                                   ['Barnaul', 'Bratsk'], ['Chita']])
+        self.assertEqual(backward, forward[:-1])
+
+    def test_letter_filter(self):
+        forward, _ = self.walk(self.url + '?size=1&fl_en=B')
+        self.assertEqual(forward, [['Barnaul'], ['Bratsk']])
+        forward, _ = self.walk(self.url + '?size=1&fl_ru=Б', 'name_ru')
+        self.assertEqual(forward, [['Барнаул'], ['Братск']])
+
+    def test_page_size_bounded(self):
+        ctx = self.client.get(self.url + '?size=0').context
+        self.assertEqual(len(ctx['city_list']), 1)
+        ctx = self.client.get(self.url + '?size=100000').context
+        self.assertEqual(len(ctx['city_list']), len(self.names))
+        self.assertFalse(ctx['is_paginated'])
+
+    def test_empty_hidden(self):
+        City.objects.create(country=self.country, name='Aldan',
+                            slug='ru-aldan', latitude='58.6',
+                            longitude='125.4')
+        forward, _ = self.walk(self.url)
+        self.assertEqual(forward, [[name for name, _ in self.names]])
+
+    def test_letter_facets(self):
+        self.assertEqual(City.objects.get(name='Chita').name_ru_fl, 'Ч')
+        facets = self.client.get(self.url).context['letter_facets']()
+        self.assertEqual(facets, {'en': [('A', 2), ('B', 2), ('C', 1)],
+                                  'ru': [('А', 2), ('Б', 2), ('Ч', 1)]})
+
+    def test_letter_panel_cached(self):
+        self.client.get(self.url + '?size=2')
+        # other page of the same list: country is cached, only cities are
+        # queried
+        with self.assertNumQueries(1):
+            self.client.get(self.url + '?size=3')
+
+    def test_invalid_cursor(self):
+        for cursor in ('%%%', 'e30', 'WyJhIiwiYiJd'):
+            response = self.client.get(self.url + '?after=' + cursor)
+            self.assertEqual(response.status_code, 404)
+
+
+class SearchTest(TestCase):
+
+    def setUp(self):
+        search.index.reset()
+        ru = Country.objects.create(
+            iso_code='RU', name='Russia', name_ru='Россия', slug='ru-russia',
+            latitude='60.0', longitude='100.0')
+        moscow = City.objects.create(
+            country=ru, name='Moscow', name_ru='Москва', slug='ru-moscow',
+            latitude='55.75', longitude='37.62')
+        Airport.objects.create(
+            iata_code='SVO', city=moscow, name='Sheremetyevo',
+            name_ru='Шереметьево', slug='svo-sheremetyevo', altitude=622,
+            latitude='55.97', longitude='37.41')
+
+    def search(self, q, **params):
+        params['q'] = q
+        response = self.client.get(reverse('loc:search'), params)
+        self.assertEqual(response.status_code, 200)
+        results = json.loads(response.content.decode('utf8'))['results']
+        return [(r['type'], r['code']) for r in results]
+
+    def test_prefixes_and_codes(self):
+        self.assertEqual(self.search('mos'), [('city', City.objects.get().pk)])
+        self.assertEqual(self.search('ШЕР'), [('airport', 'SVO')])
+        self.assertEqual(self.search('svo'), [('airport', 'SVO')])
+        self.assertEqual(self.search('ru'), [('country', 'RU')])
+        self.assertEqual(self.search(' '), [])
+        self.assertEqual(self.search('x'), [])
+
+    def test_limit(self):
+        City.objects.create(
+            country_id='RU', name='Mozhaysk', name_ru='Можайск',
+            slug='ru-mozhaysk', latitude='55.5', longitude='36.0')
+        search.index.reset()
+        self.assertEqual(len(self.search('mo')), 2)
+        self.assertEqual(len(self.search('mo', limit=1)), 1)
+
+    def test_url(self):
+        result = search.search('SVO')[0]
+        self.assertEqual(result['url'], reverse(
+                        'loc:airport', kwargs={'slug': 'svo-sheremetyevo'}))
+        self.assertEqual(result['context'], 'Moscow, RU')
+
+
+class NearbyTest(TestCase):
+
+    airports = [('SVO', 55.972642, 37.414589), ('DME', 55.408611, 37.906111),
+                ('LED', 59.800292, 30.262503),
+                # both sides of the antimeridian
+                ('SVU', -16.8028, 179.341), ('TVU', -16.6906, -179.877)]
+
+    def setUp(self):
+        geo.index.reset()
+        country = Country.objects.create(
+            iso_code='RU', name='Russia', slug='ru-russia',
+            latitude='60.0', longitude='100.0')
+        city = City.objects.create(
+            country=country, name='Moscow', slug='ru-moscow',
+            latitude='55.75', longitude='37.62')
+        for iata, lat, lon in self.airports:
+            Airport.objects.create(
+                iata_code=iata, city=city, name=iata, slug=iata.lower(),
+                altitude=0, latitude=str(lat), longitude=str(lon))
+
+    def nearby(self, **params):
+        response = self.client.get(reverse('loc:nearby'), params)
+        if response.status_code != 200:
+            return response.status_code
+        results = json.loads(response.content.decode('utf8'))['results']
+        return [r['code'] for r in results]
+
+    def test_nearest_first(self):
+        self.assertEqual(self.nearby(lat=55.75, lon=37.62, radius=100),
+                         ['SVO', 'DME'])
+        self.assertEqual(self.nearby(lat=55.75, lon=37.62, radius=1000),
+                         ['SVO', 'DME', 'LED'])
+        self.assertEqual(
+            self.nearby(lat=55.75, lon=37.62, radius=1000, limit=1), ['SVO'])
+        self.assertEqual(self.nearby(lat=0, lon=0, radius=1000), [])
+
+    def test_antimeridian(self):
+        self.assertEqual(self.nearby(lat=-16.7, lon=-179.9, radius=200),
+                         ['TVU', 'SVU'])
+
+    def test_same_as_full_scan(self):
+        index = geo.index.get()
+        entries = [e for cell in index.cells.values() for e in cell]
+        for lat, lon, radius in ((89.9, 0, 2000), (-16, 179.9, 500),
+                                 (57, 34, 400), (57, 34, 20000)):
+            expected = sorted(
+                (geo.haversine(lat, lon, e[0], e[1]), e[2]) for e in entries)
+            expected = [code for dist, code in expected if dist <= radius]
+            found = [e[2] for dist, e in index.nearest(lat, lon, radius, 10)]
+            self.assertEqual(found, expected)
+
+    def test_distances(self):
+        svo = Airport.objects.get(pk='SVO')
+        led = Airport.objects.get(pk='LED')
+        self.assertAlmostEqual(svo.distance_to(led), 599, delta=1)
+        self.assertAlmostEqual(svo.distance_to(svo), 0)
+
+        geo.arrays[Airport].reset()
+        from_codes, to_codes, matrix = geo.distances('SVO,LED', 'city:{0}'
+                                            .format(svo.city_id))
+        self.assertEqual(from_codes, ['SVO', 'LED'])
+        self.assertEqual(to_codes, sorted(a[0] for a in self.airports))
+        for i, a in enumerate(from_codes):
+            for j, b in enumerate(to_codes):
+                self.assertAlmostEqual(
+                    matrix[i][j], Airport.objects.get(pk=a).distance_to(
+                                            Airport.objects.get(pk=b)))
+
+        response = self.client.get(reverse('loc:distance'),
+                                   {'route': 'SVO,LED,SVO'})
+        data = json.loads(response.content.decode('utf8'))
+        self.assertEqual([(l['from'], l['to']) for l in data['legs']],
+                         [('SVO', 'LED'), ('LED', 'SVO')])
+        self.assertAlmostEqual(data['distance'], 2 * svo.distance_to(led),
+                               delta=0.1)
+        for params in ({'route': 'SVO'}, {'route': 'SVO,XXX'},
+                       {'from': 'SVO'}, {'from': 'SVO', 'to': 'city:0'}):
+            response = self.client.get(reverse('loc:distance'), params)
+            self.assertEqual(response.status_code, 400)
+
+    def test_distance_matrix_limit(self):
+        geo.arrays[Airport].reset()
+        distance_matrix = geo.distance_matrix
+        limit = views.MAX_DISTANCE_MATRIX
+
+        def fail(*args, **kwargs):
+            raise AssertionError('matrix computed')
+        geo.distance_matrix = fail
+        views.MAX_DISTANCE_MATRIX = 4
+        try:
+            response = self.client.get(reverse('loc:distance'), {
+                'from': 'SVO,DME,LED', 'to': 'SVO,DME'})
+        finally:
+            geo.distance_matrix = distance_matrix
+            views.MAX_DISTANCE_MATRIX = limit
+        self.assertEqual(response.status_code, 400)
+        self.assertIn(b'Too many airports', response.content)
+
+    def test_coordinate_arrays(self):
+        geo.arrays[Airport].reset()
+        arrays = geo.coordinate_arrays(Airport)
+        self.assertEqual(list(arrays.pks), sorted(a[0] for a in self.airports))
+        for iata, lat, lon in self.airports:
+            i = arrays.position(iata)
+            self.assertAlmostEqual(arrays.latitudes[i], lat)
+            self.assertAlmostEqual(arrays.longitudes[i], lon)
+        with self.assertNumQueries(0):
+            self.assertIs(geo.coordinate_arrays(Airport), arrays)
+        # distance computations use the same arrays
+        coords = geo.airport_coords()
+        self.assertIs(coords.lats, arrays.latitudes)
+        with self.assertNumQueries(0):
+            self.assertIs(geo.airport_coords(), coords)
+        Airport.objects.filter(pk='SVU').delete()
+        catalog.bump_version()
+        geo.arrays[Airport].checked_at = 0
+        self.assertEqual(len(geo.coordinate_arrays(Airport)), 4)
+        self.assertEqual(len(geo.coordinate_arrays(City)), 1)
+
+    def test_bad_params(self):
+        self.assertEqual(self.nearby(lat=55), 400)
+        self.assertEqual(self.nearby(lat='x', lon=37), 400)
+        self.assertEqual(self.nearby(lat=95, lon=37), 400)
+        self.assertEqual(self.nearby(lat=55, lon=37, radius=0), 400)
+
+
+class CatalogApiTest(TestCase):
+
+    def setUp(self):
+        country = Country.objects.create(
+            iso_code='RU', name='Russia', name_ru='Россия', slug='ru-russia',
+            latitude='60.0', longitude='100.0')
+        Country.objects.create(
+            iso_code='BY', name='Belarus', slug='by-belarus',
+            latitude='53.0', longitude='28.0')
+        self.moscow = City.objects.create(
+            country=country, name='Moscow', slug='ru-moscow',
+            latitude='55.75', longitude='37.62')
+        spb = City.objects.create(
+            country=country, name='Saint Petersburg', slug='ru-spb',
+            latitude='59.95', longitude='30.32')
+        for iata, city in (('SVO', self.moscow), ('DME', self.moscow),
+                           ('LED', spb)):
+            Airport.objects.create(
+                iata_code=iata, city=city, name=iata, slug=iata.lower(),
+                altitude=0, latitude='55.0', longitude='37.0')
+
+    def get(self, table, **params):
+        response = self.client.get(reverse('loc:api', args=[table]), params)
+        if response.status_code != 200:
+            return response.status_code
+        content = b''.join(response.streaming_content)
+        if response.has_header('Content-Encoding'):
+            content = gzip.GzipFile(fileobj=BytesIO(content)).read()
+        return json.loads(content.decode('utf8'))
+
+    def test_rows(self):
+        data = self.get('countries')
+        self.assertEqual(data['next'], None)
+        self.assertEqual([r['iso_code'] for r in data['results']],
+                         ['BY', 'RU'])
+        self.assertEqual(data['results'][1]['name_ru'], 'Россия')
+        self.assertEqual(data['results'][1]['latitude'], 60.0)
+        data = self.get('airports', city=self.moscow.pk)
+        self.assertEqual([r['iata_code'] for r in data['results']],
+                         ['DME', 'SVO'])
+        self.assertEqual(len(self.get('cities', country='RU')['results']), 2)
+        self.assertEqual(self.get('cities', country='XX'), 404)
+        self.assertEqual(self.get('cities', limit='0'), 400)
+
+    def test_continuation(self):
+        codes, after = [], ''
+        for i in range(3):
+            data = self.get('airports', limit=2, after=after, gzip=1)
+            codes.extend(r['iata_code'] for r in data['results'])
+            after = data['next']
+            if after is None:
+                break
+        self.assertEqual(codes, ['DME', 'LED', 'SVO'])
+        self.assertEqual(i, 1)
+
+
+@override_settings(QUERY_INSTRUMENTATION=True, QUERY_REPEAT_THRESHOLD=3)
+class QueryBudgetTest(TestCase):
+
+    """Render every view and check it fits into its query budget"""
+
+    def setUp(self):
+        catalog.bump_version()
+        search.index.reset()
+        geo.index.reset()
+        geo.arrays[Airport].reset()
+        for iso, name in (('RU', 'Russia'), ('BY', 'Belarus')):
+            country = Country.objects.create(
+                iso_code=iso, name=name, slug=iso.lower(),
+                latitude='55.0', longitude='35.0', airport_count=1)
+            for i in range(3):
+                city = City.objects.create(
+                    country=country, name='{0} city {1}'.format(name, i),
+                    slug='{0}-{1}'.format(iso.lower(), i),
+                    latitude='55.0', longitude='35.0', airport_count=1)
+                for j in range(3):
+                    iata = '{0}{1}{2}'.format(iso[0], i, j)
+                    Airport.objects.create(
+                        iata_code=iata, city=city, name=iata, slug=iata,
+                        altitude=0, latitude='55.0', longitude='35.0')
+        # in-memory indexes are built once per catalog version
+        search.index.get()
+        geo.index.get()
+        geo.airport_coords()
+
+    def sample_urls(self):
+        city = City.objects.get(slug='ru-1')
+        kwargs = {
+            'countries': {},
+            'country': {'slug': 'ru'},
+            'cities': {'country': 'RU'},
+            'city': {'slug': city.slug},
+            'airports': {'city': city.pk},
+            'airport': {'slug': 'R11'},
+            'search': {},
+            'nearby': {},
+            'distance': {},
+            'api': {'table': 'airports'},
+        }
+        params = {
+            'cities': ['', '?fl_en=R', '?fl_ru=R', '?size=1'],
+            'search': ['?q=r', '?q=R11'],
+            'nearby': ['?lat=55&lon=35&radius=100'],
+            'distance': ['?route=R00,B11', '?from=country:RU&to=city:{0}'
+                                           .format(city.pk)],
+            'api': ['', '?country=RU', '?city={0}&limit=1'.format(city.pk)],
+        }
+        for pattern in urls.urlpatterns:
+            self.assertIn(pattern.name, kwargs,
+                          'add sample url of new view to this test')
+            url = reverse('loc:' + pattern.name,
+                          kwargs=kwargs[pattern.name])
+            for query in params.get(pattern.name, ['']):
+                yield url + query
+
+    def test_query_budgets(self):
+        for url in self.sample_urls():
+            budget = get_query_budget(resolve(url.split('?')[0]).func)
+            self.assertIsNotNone(budget, 'no query_budget for ' + url)
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200, url)
+            count = int(response['X-Query-Count'])
+            self.assertLessEqual(count, budget, '{0}: {1} queries, budget '
+                                 'is {2}'.format(url, count, budget))
+            self.assertFalse(response.has_header('X-Query-Repeats'), url)
+
+    def test_query_shape(self):
+        self.assertEqual(
+            query_shape("SELECT * FROM t WHERE id = 12 AND n = 'it''s 1'"),
+            query_shape("SELECT * FROM t WHERE id = 3 AND n = 'x'"))
+
+
+class PrerenderTest(TestCase):
+
+    def setUp(self):
+        catalog.bump_version()
+        self.output_dir = tempfile.mkdtemp()
+        self.renderer = prerender.Prerenderer(self.output_dir, processes=1)
+        country = Country.objects.create(
+            iso_code='RU', name='Russia', slug='ru-russia',
+            latitude='60.0', longitude='100.0', airport_count=1)
+        for name in ('Moscow', 'Kazan'):
+            City.objects.create(
+                country=country, name=name, slug='ru-' + name.lower(),
+                latitude='55.0', longitude='40.0', airport_count=1)
+
+    def tearDown(self):
+        shutil.rmtree(self.output_dir)
+
+    def test_incremental(self):
+        rendered, failed, removed = self.renderer.run()
+        self.assertEqual(failed, [])
+        # index, countries, country, cities, 2 x (city, airports)
+        self.assertEqual(len(rendered), 8)
+        filename = prerender.page_file(self.output_dir,
+                                       '/locations/city/ru-kazan')
+        with open(filename, 'rb') as f:
+            self.assertIn(b'Kazan', f.read())
+
+        self.assertEqual(self.renderer.run()[0], [])
+
+        City.objects.filter(name='Kazan').update(name_ru='Казань')
+        City.objects.filter(name='Moscow').delete()
+        rendered, failed, removed = self.renderer.run()
+        self.assertEqual(sorted(rendered), [
+            '/locations/airports/{0}'.format(City.objects.get().pk),
+            '/locations/cities/RU', '/locations/city/ru-kazan'])
+        self.assertEqual(len(removed), 2)
+        self.assertFalse(os.path.exists(prerender.page_file(
+                            self.output_dir, '/locations/city/ru-moscow')))
+
+
+class QueryAuditTest(TestCase):
+
+    def test_plan_problems(self):
+        self.assertEqual(queryaudit.plan_problems('sqlite', [
+            'SCAN locations_city', 'USE TEMP B-TREE FOR ORDER BY']),
+            [queryaudit.FULL_SCAN, queryaudit.TEMP_SORT])
+        self.assertEqual(queryaudit.plan_problems('sqlite', [
+            'SEARCH locations_city USING INDEX i (country_iso=?)']), [])
+        self.assertEqual(queryaudit.plan_problems('postgresql', [
+            'Sort  (cost=1.03..1.03 rows=1 width=4)',
+            '  ->  Seq Scan on locations_city  (cost=0.00..1.02 rows=1)']),
+            [queryaudit.TEMP_SORT, queryaudit.FULL_SCAN])
+
+    def test_suggest_missing_index(self):
+        audit = queryaudit.QueryAudit()
+        query = queryaudit.AuditedQuery(
+            'by altitude', Airport.objects.filter(altitude=0)
+                                          .order_by('name'),
+            ('altitude',), ('name',))
+        audit.check(query)
+        self.assertEqual(query.problems,
+                         [queryaudit.FULL_SCAN, queryaudit.TEMP_SORT])
+        queries = [query] + audit.run()
+        suggested = audit.suggest(queries)
+        self.assertEqual(suggested, [(Airport, ('altitude', 'name'))])
+        # views, API and importer use existing indexes
+        self.assertEqual([q.label for q in queries[1:] if q.problems], [])
+
+
+class ProfileMiddlewareTest(TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        Country.objects.create(
+            iso_code='RU', name='Russia', slug='ru-russia',
+            latitude='60.0', longitude='100.0')
+        self.url = reverse('loc:country', kwargs={'slug': 'ru-russia'})
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def get(self, **extra):
+        with self.settings(PROFILING_ENABLED=True, PROFILING_DIR=self.dir,
+                           PROFILING_KEEP=2):
+            return self.client.get(self.url, **extra)
+
+    def test_profile(self):
+        response = self.get()
+        self.assertFalse(response.has_header('X-Profile-File'))
+
+        for i in range(3):
+            response = self.get(HTTP_X_PROFILE=make_profile_token())
+            self.assertEqual(response.status_code, 200)
+            self.assertIn(b'Russia', response.content)
+        name = response['X-Profile-File']
+        self.assertEqual(sorted(os.listdir(self.dir))[-2:],
+                         [name + '.prof', name + '.txt'])
+        # older profiles are removed
+        self.assertEqual(len(os.listdir(self.dir)), 4)
+
+        lookup.cache.reset()
+        response = self.get(HTTP_X_PROFILE=make_profile_token(),
+                            HTTP_X_PROFILE_MODE='summary')
+        summary = response.content.decode('utf8')
+        self.assertIn('locations/country_detail.html', summary)
+        self.assertIn('SQL: 1 queries', summary)
+
+    def test_bad_token(self):
+        response = self.get(HTTP_X_PROFILE=make_profile_token() + 'x')
+        self.assertEqual(response.status_code, 403)
+
+
+class ReplicaRouterTest(unittest.TestCase):
+
+    class OtherModel(object):
+        class _meta:
+            app_label = 'other'
+
+    def make_router(self, **options):
+        options.setdefault('CATALOG_READ_YOUR_WRITES', 0)
+        with override_settings(CATALOG_REPLICAS=('replica1', 'replica2'),
+                               **options):
+            return routers.ReplicaRouter()
+
+    def test_round_robin(self):
+        router = self.make_router()
+        chosen = []
+        for i in range(3):
+            # one replica for all queries of request
+            self.assertEqual(router.db_for_read(Country),
+                             router.db_for_read(City))
+            chosen.append(router.db_for_read(Airport))
+            router.release()
+        self.assertEqual(chosen, ['replica1', 'replica2', 'replica1'])
+
+    def test_least_loaded(self):
+        router = self.make_router(CATALOG_REPLICA_SELECTION='least_loaded')
+        # request in other thread is still served by replica1
+        thread = threading.Thread(target=router.db_for_read, args=(City,))
+        thread.start()
+        thread.join()
+        for i in range(2):
+            self.assertEqual(router.db_for_read(City), 'replica2')
+            router.release()
+        self.assertEqual(router.load, {'replica1': 1, 'replica2': 0})
+
+    def test_primary(self):
+        router = self.make_router()
+        self.assertEqual(router.db_for_write(Country), 'default')
+        self.assertIsNone(router.db_for_read(self.OtherModel))
+        self.assertIsNone(router.db_for_write(self.OtherModel))
+        with routers.use_primary():
+            self.assertEqual(router.db_for_read(Country), 'default')
+        self.assertFalse(router.allow_syncdb('replica1', Country))
+
+    def test_read_your_writes(self):
+        router = self.make_router(CATALOG_READ_YOUR_WRITES=60)
+        catalog.bump_version()
+        self.assertEqual(router.db_for_read(Country), 'default')
+        router.release()
+        self.assertEqual(router.load, {'replica1': 0, 'replica2': 0})
+
+    def test_change_check_throttled(self):
+        router = self.make_router(CATALOG_READ_YOUR_WRITES=60)
+        catalog.cache.clear()
+        # stamp started anew after cache loss is not a change
+        catalog.get_version()
+        self.assertEqual(router.db_for_read(Country), 'replica1')
+        router.release()
+        catalog.bump_version()
+        # noticed on next check only
+        self.assertEqual(router.db_for_read(Country), 'replica2')
+        router.release()
+        router.checked_at -= router.check_interval
+        self.assertEqual(router.db_for_read(Country), 'default')
+        router.release()
+
+    def test_no_replicas(self):
+        with override_settings(CATALOG_REPLICAS=()):
+            router = routers.ReplicaRouter()
+        self.assertIsNone(router.db_for_read(Country))
+        self.assertIsNone(router.db_for_write(Country))
+
+
+class ObjectLookupTest(TestCase):
+
+    def setUp(self):
+        country = Country.objects.create(
+            iso_code='RU', name='Russia', slug='ru-russia',
+            latitude='60.0', longitude='100.0')
+        self.city = City.objects.create(
+            country=country, name='Moscow', slug='ru-moscow',
+            latitude='55.75', longitude='37.61')
+
+    def test_read_through(self):
+        with self.assertNumQueries(1):
+            city = lookup.get(City, 'slug', 'ru-moscow')
+            self.assertEqual(city.country.name, 'Russia')
+        with self.assertNumQueries(0):
+            self.assertIs(lookup.get(City, 'pk', str(self.city.pk)), city)
+            self.assertIs(lookup.get(City, 'slug', 'ru-moscow'), city)
+        self.assertRaises(City.DoesNotExist, lookup.get, City, 'pk', 'x')
+        self.assertRaises(Country.DoesNotExist,
+                          lookup.get, Country, 'iso_code', 'US')
+
+    def test_invalidated_by_import(self):
+        lookup.get(City, 'slug', 'ru-moscow')
+        # bulk update does not send signals, as import
+        City.objects.update(name='Moskva')
+        self.assertEqual(lookup.get(City, 'slug', 'ru-moscow').name, 'Moscow')
+        catalog.bump_version()
+        lookup.cache.checked_at = 0
+        self.assertEqual(lookup.get(City, 'slug', 'ru-moscow').name, 'Moskva')
+
+    def test_lru(self):
+        lru = lookup.LRUCache(2)
+        lru.set('a', 1)
+        lru.set('b', 2)
+        lru.get('a')
+        lru.set('c', 3)
+        self.assertEqual((lru.get('a'), lru.get('b'), lru.get('c')),
+                         (1, None, 3))
+        self.assertEqual(len(lru), 2)
+
+
+class ConnectionPoolTest(unittest.TestCase):
+
+    def test_reuse(self):
+        pool = dbpool.ConnectionPool(max_age=None, size=1, check_after=30)
+        self.assertIsNone(pool.get())
+        first, second = [sqlite3.connect(':memory:') for i in range(2)]
+        pool.put(first, 0)
+        # pool is full
+        pool.put(second, 0)
+        self.assertRaises(sqlite3.ProgrammingError, second.execute, 'SELECT 1')
+        self.assertEqual(pool.get(), (first, 0))
+        self.assertIsNone(pool.get())
+
+    def test_max_age(self):
+        pool = dbpool.ConnectionPool(max_age=60, size=2, check_after=30)
+        old, new = [sqlite3.connect(':memory:') for i in range(2)]
+        pool.put(new, time.time())
+        # connection which expired while idle
+        pool.idle.insert(0, (old, time.time() - 70, time.time()))
+        self.assertEqual(pool.get()[0], new)
+        # expired connection is closed
+        self.assertIsNone(pool.get())
+        self.assertRaises(sqlite3.ProgrammingError, old.execute, 'SELECT 1')
+
+    def test_health_check(self):
+        pool = dbpool.ConnectionPool(max_age=None, size=2, check_after=0)
+        good, broken = [sqlite3.connect(':memory:') for i in range(2)]
+        pool.put(good, 0)
+        pool.put(broken, 0)
+        broken.close()
+        self.assertEqual(pool.get(), (good, 0))
@@ -2,19 +2,33 @@
 
 from django.conf.urls import patterns, url
 
+from locations.decorators import catalog_conditional, catalog_page_cache
 from locations.views import (
      CountryListView, CityListView, AirportListView,
-     CountryDetailView, CityDetailView, AirportDetailView)
+     CountryDetailView, CityDetailView, AirportDetailView,
+     search, nearby, distance, catalog_api)
 
+# all pages depend on catalog data only, conditional requests are
+# answered before page cache and views
 urlpatterns = patterns('',
-    url(r'^countries$', CountryListView.as_view(), name='countries'),
-    url(r'^country/(?P<slug>[\w-]+)$', CountryDetailView.as_view(),
-        name='country'),
-    url(r'^cities/(?P<country>[A-Z]{2})$', CityListView.as_view(),
+    url(r'^countries$',
+        catalog_conditional(catalog_page_cache()(CountryListView.as_view())),
+        name='countries'),
+    url(r'^country/(?P<slug>[\w-]+)$',
+        catalog_conditional(CountryDetailView.as_view()), name='country'),
+    url(r'^cities/(?P<country>[A-Z]{2})$',
+        catalog_conditional(catalog_page_cache()(CityListView.as_view())),
         name='cities'),
-    url(r'^city/(?P<slug>[\w-]+)$', CityDetailView.as_view(), name='city'),
-    url(r'^airports/(?P<city>\d+)$', AirportListView.as_view(),
+    url(r'^city/(?P<slug>[\w-]+)$',
+        catalog_conditional(CityDetailView.as_view()), name='city'),
+    url(r'^airports/(?P<city>\d+)$',
+        catalog_conditional(catalog_page_cache()(AirportListView.as_view())),
         name='airports'),
-    url(r'^airport/(?P<slug>[\w-]+)$', AirportDetailView.as_view(),
-        name='airport'),
+    url(r'^airport/(?P<slug>[\w-]+)$',
+        catalog_conditional(AirportDetailView.as_view()), name='airport'),
+    url(r'^search$', catalog_conditional(search), name='search'),
+    url(r'^nearby$', catalog_conditional(nearby), name='nearby'),
+    url(r'^distance$', catalog_conditional(distance), name='distance'),
+    url(r'^api/(?P<table>countries|cities|airports)$',
+        catalog_conditional(catalog_api), name='api'),
 )
@@ -2,11 +2,130 @@
 
 from __future__ import unicode_literals
 
-from django.shortcuts import get_object_or_404
+import json
+import base64
+import binascii
+from functools import partial
+
+from django.core.exceptions import ValidationError
+from django.db.models import Count
 from django.views.generic import DetailView, ListView
-from django.http import Http404
+from django.http import (
+    Http404, HttpResponse, HttpResponseBadRequest, StreamingHttpResponse)
+from django.utils.text import compress_sequence
+
+from locations import geo, lookup, search as catalog_search
+from locations.management.dataexporter import DataExporter
+from locations.models import Country, City, Airport, first_letter
+from locations.queryutils import seek
+from locations.templatetags.location_utils import alpha_range
+
+
+class KeysetPage(object):
+
+    """Page of keyset paginated list
+
+    Mimics `django.core.paginator.Page` interface used by templates.
+    """
+
+    def __init__(self, object_list, has_next, has_previous,
+                 next_url=None, previous_url=None):
+        self.object_list = object_list
+        self._has_next = has_next
+        self._has_previous = has_previous
+        self.next_url = next_url
+        self.previous_url = previous_url
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def has_next(self):
+        return self._has_next
+
+    def has_previous(self):
+        return self._has_previous
+
+    def has_other_pages(self):
+        return self._has_next or self._has_previous
+
+
+class KeysetPaginationMixin(object):
+
+    """Keyset (seek) pagination for list views
+
+    Instead of page numbers pages are addressed with `after` and `before`
+    GET params: opaque cursors with ordering key values of the last row of
+    previous page (first row of next page). Every page is fetched with
+    one range query on the ordering key, so deep pages cost the same as
+    the first one when key is indexed. Ordering key must be unique within
+    listed queryset. Page size may be changed with `size` GET param, but
+    not above `max_paginate_by`.
+    """
+
+    paginate_by = 100
+    max_paginate_by = 500
+    ordering_key = ('name',)
+
+    def get_ordering_key(self):
+        return self.ordering_key
+
+    def get_paginate_by(self, queryset):
+        try:
+            size = int(self.request.GET.get('size', self.paginate_by))
+        except ValueError:
+            size = self.paginate_by
+        return max(1, min(size, self.max_paginate_by))
 
-from locations.models import Country, City, Airport
+    def paginate_queryset(self, queryset, page_size):
+        key = self.get_ordering_key()
+        args = self.request.GET
+        backward = bool(args.get('before')) and not args.get('after')
+        cursor = args.get('before') if backward else args.get('after')
+        values = self.decode_cursor(cursor, len(key)) if cursor else None
+
+        objs = list(seek(queryset, key, values, backward)[:page_size + 1])
+        has_more = len(objs) > page_size
+        objs = objs[:page_size]
+        if backward:
+            objs.reverse()
+            has_next, has_previous = True, has_more
+        else:
+            has_next, has_previous = has_more, values is not None
+
+        page = KeysetPage(objs, has_next, has_previous)
+        if objs and has_next:
+            page.next_url = self.get_page_url('after', objs[-1], key)
+        if objs and has_previous:
+            page.previous_url = self.get_page_url('before', objs[0], key)
+        return (None, page, objs, page.has_other_pages())
+
+    def get_page_url(self, param, obj, key):
+        args = self.request.GET.copy()
+        args.pop('after', None)
+        args.pop('before', None)
+        args[param] = self.encode_cursor([getattr(obj, f) for f in key])
+        return '{0}?{1}'.format(self.request.path, args.urlencode())
+
+    @staticmethod
+    def encode_cursor(values):
+        data = json.dumps(values, separators=(',', ':')).encode('utf8')
+        return base64.urlsafe_b64encode(data).decode('ascii').rstrip('=')
+
+    @staticmethod
+    def decode_cursor(cursor, length):
+        try:
+            cursor = cursor.encode('ascii')
+            data = base64.urlsafe_b64decode(cursor + b'=' * (-len(cursor) % 4))
+            values = json.loads(data.decode('utf8'))
+        except (ValueError, TypeError, UnicodeError, binascii.Error):
+            raise Http404('Invalid page cursor')
+        if (not isinstance(values, list) or len(values) != length
+                or not all(isinstance(v, (int, type(''))) for v in values)):
+            raise Http404('Invalid page cursor')
+        return values
 
 
 class FirstLetterFilterMixin(object):
@@ -19,14 +138,44 @@ class FirstLetterFilterMixin(object):
                 # no filtration required
                 return qs
             attr = 'name_ru'
-            qs = qs.order_by('name_ru')
         else:
             attr = 'name'
-        fl = fl[0]
         kwargs = {}
-        kwargs[attr + '__istartswith'] = fl
+        kwargs[attr + '_fl'] = first_letter(fl)
         return qs.filter(**kwargs)
 
+    def get_letter_facets(self, qs):
+        """Return letters having objects in `qs` with objects count
+
+        Result is {'en': [(letter, count), ...], 'ru': [...]}, `qs` must
+        not be filtered by letter. Views put it to context unevaluated
+        (see `letter_facets_context`), so queries are skipped when letter
+        panel is taken from cache.
+        """
+        facets = {}
+        for lang, attr in (('en', 'name_fl'), ('ru', 'name_ru_fl')):
+            counts = dict(self.letter_counts(qs, attr))
+            facets[lang] = [(letter, counts[letter])
+                            for letter in alpha_range(lang)
+                            if counts.get(letter)]
+        return facets
+
+    @staticmethod
+    def letter_counts(qs, attr):
+        """(letter, count) pairs of first letter field `attr` in `qs`"""
+        return qs.order_by().values_list(attr).annotate(cnt=Count('pk'))
+
+    def letter_facets_context(self, qs):
+        # template calls it on access
+        return {'letter_facets': partial(self.get_letter_facets, qs)}
+
+    def get_ordering_key(self):
+        args = self.request.GET
+        if args.get('fl_ru') and not args.get('fl_en'):
+            # russian names are not unique, english ones are
+            return ('name_ru', 'name')
+        return ('name',)
+
     def get_filter_context_data(self):
         context = {}
         args = self.request.GET
@@ -36,49 +185,55 @@ class FirstLetterFilterMixin(object):
         return context
 
 
-class CountryListView(ListView, FirstLetterFilterMixin):
+class CountryListView(FirstLetterFilterMixin, KeysetPaginationMixin,
+                      ListView):
 
     model = Country
+    # list and two letter facets
+    query_budget = 3
 
     def get_queryset(self):
-        return self.filter_by_first_letter(Country.objects.all())
+        return self.filter_by_first_letter(Country.objects.non_empty())
 
     def get_context_data(self, **kwargs):
         ctx = super(CountryListView, self).get_context_data(**kwargs)
         ctx.update(self.get_filter_context_data())
+        ctx.update(self.letter_facets_context(Country.objects.non_empty()))
         return ctx
 
 
-class CityListView(ListView, FirstLetterFilterMixin):
+class CityListView(FirstLetterFilterMixin, KeysetPaginationMixin, ListView):
 
     model = City
+    # country, list and two letter facets
+    query_budget = 4
 
     def dispatch(self, request, *args, **kwargs):
-        self.country = get_object_or_404(Country, iso_code=kwargs['country'])
+        self.country = get_cached_or_404(Country, 'pk', kwargs['country'])
         return super(CityListView, self).dispatch(request, *args, **kwargs)
 
     def get_queryset(self):
-        qs = City.objects.filter(country=self.country)
+        qs = City.objects.non_empty().filter(country=self.country)
         return self.filter_by_first_letter(qs)
 
     def get_context_data(self, **kwargs):
         ctx = super(CityListView, self).get_context_data(**kwargs)
         ctx.update(self.get_filter_context_data())
+        ctx.update(self.letter_facets_context(
+                        City.objects.non_empty().filter(country=self.country)))
         ctx['country'] = self.country
         return ctx
 
 
-class AirportListView(ListView):
+class AirportListView(KeysetPaginationMixin, ListView):
 
     model = Airport
+    # city with country and list
+    query_budget = 2
 
     def dispatch(self, request, *args, **kwargs):
-        try:
-            city = City.objects.select_related().get(id=kwargs['city'])
-        except City.DoesNotExist:
-            raise Http404
-        self.city = city
-        self.country = city.country
+        self.city = get_cached_or_404(City, 'pk', kwargs['city'])
+        self.country = self.city.country
         return super(AirportListView, self).dispatch(request, *args, **kwargs)
 
     def get_queryset(self):
@@ -91,17 +246,31 @@ class AirportListView(ListView):
         return ctx
 
 
-class CountryDetailView(DetailView):
+def get_cached_or_404(model, field, value):
+    try:
+        return lookup.get(model, field, value)
+    except model.DoesNotExist:
+        raise Http404
+
+
+class CachedObjectMixin(object):
+
+    """Detail view getting object by slug from `lookup` cache"""
+
+    def get_object(self, queryset=None):
+        return get_cached_or_404(self.model, 'slug', self.kwargs['slug'])
+
+
+class CountryDetailView(CachedObjectMixin, DetailView):
 
     model = Country
+    query_budget = 1
 
 
-class CityDetailView(DetailView):
+class CityDetailView(CachedObjectMixin, DetailView):
 
     model = City
-
-    def get_queryset(self):
-        return City.objects.select_related()
+    query_budget = 1
 
     def get_context_data(self, **kwargs):
         ctx = super(CityDetailView, self).get_context_data(**kwargs)
@@ -109,15 +278,170 @@ class CityDetailView(DetailView):
         return ctx
 
 
-class AirportDetailView(DetailView):
-
-    model = City
+class AirportDetailView(CachedObjectMixin, DetailView):
 
-    def get_queryset(self):
-        return Airport.objects.select_related()
+    model = Airport
+    query_budget = 1
 
     def get_context_data(self, **kwargs):
         ctx = super(AirportDetailView, self).get_context_data(**kwargs)
         ctx['city'] = self.object.city
         ctx['country'] = self.object.city.country
         return ctx
+
+
+def json_response(data):
+    data = json.dumps(data, ensure_ascii=False, separators=(',', ':'))
+    return HttpResponse(data, content_type='application/json; charset=utf-8')
+
+
+def get_limit(request, default, maximum):
+    try:
+        limit = int(request.GET.get('limit', default))
+    except ValueError:
+        limit = default
+    return max(1, min(limit, maximum))
+
+
+def search(request):
+    """Autocomplete: find locations by name prefix, ISO or IATA code"""
+    limit = get_limit(request, 10, 50)
+    results = catalog_search.search(request.GET.get('q', ''), limit)
+    return json_response({'results': results})
+
+# served from memory once index is built
+search.query_budget = 0
+
+
+def nearby(request):
+    """Find airports within `radius` km of (`lat`, `lon`), nearest first"""
+    args = request.GET
+    try:
+        lat, lon = float(args['lat']), float(args['lon'])
+        radius = float(args.get('radius', 100))
+    except (KeyError, ValueError):
+        return HttpResponseBadRequest('lat, lon and radius must be numbers')
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180 and
+            0 < radius <= 2000):
+        return HttpResponseBadRequest('lat, lon or radius is out of range')
+    results = geo.nearby_airports(lat, lon, radius,
+                                  get_limit(request, 10, 100))
+    return json_response({'results': results})
+
+nearby.query_budget = 0
+
+
+# max number of from x to pairs computed by `distance` view
+MAX_DISTANCE_MATRIX = 10000
+
+
+def distance(request):
+    """Great-circle distances between airports
+
+    `route=SVO,LED,JFK` returns legs of route and total distance,
+    `from=...&to=...` - distance matrix between airports selected by IATA
+    codes, `city:<id>` or `country:<ISO code>` (comma separated).
+    """
+    args = request.GET
+    try:
+        if args.get('route'):
+            legs = geo.route_legs(args['route'].split(','))
+            if not legs:
+                raise ValueError('Route must have at least two airports')
+            return json_response({
+                'legs': [{'from': a, 'to': b, 'distance': round(d, 1)}
+                         for a, b, d in legs],
+                'distance': round(sum(d for a, b, d in legs), 1),
+            })
+        if not args.get('from') or not args.get('to'):
+            raise ValueError('Either route or from and to are required')
+        from_codes, to_codes, matrix = geo.distances(
+                args['from'], args['to'], max_size=MAX_DISTANCE_MATRIX)
+    except ValueError as e:
+        return HttpResponseBadRequest(e)
+    return json_response({
+        'from': from_codes,
+        'to': to_codes,
+        'distances': [[round(d, 1) for d in row] for row in matrix],
+    })
+
+distance.query_budget = 0
+
+
+# API table -> (exporter table name, model, filters: GET param -> lookup)
+api_tables = {
+    'countries': ('country', Country, {}),
+    'cities': ('city', City, {'country': (Country, 'country')}),
+    'airports': ('airport', Airport, {'country': (Country, 'city__country'),
+                                      'city': (City, 'city')}),
+}
+
+
+def catalog_rows(table, filters, after, limit, chunk_size=2000):
+    """Yield JSON encoded pieces of API response
+
+    Rows are fetched in chunks of `chunk_size` ordered by primary key (see
+    `DataExporter.iter_table`), so memory usage doesn't depend on number
+    of rows. Response ends with `next` cursor when `limit` rows are sent
+    and there may be more.
+    """
+    name, model, _ = api_tables[table]
+    fields = dict((n, f) for n, m, f in DataExporter.tables)[name]
+    keys = (model._meta.pk.name,) + fields
+    exporter = DataExporter(chunk_size)
+    qs = model.objects.filter(**filters)
+    dumps = partial(json.dumps, ensure_ascii=False, separators=(',', ':'))
+
+    yield '{{"model":{0},"results":['.format(dumps(name)).encode('utf8')
+    sent, next_after = 0, None
+    for rows in exporter.iter_table(model, fields, qs, after):
+        if limit is not None and sent + len(rows) >= limit:
+            more = sent + len(rows) > limit or len(rows) == chunk_size
+            rows = rows[:limit - sent]
+            if more:
+                next_after = rows[-1][0]
+        lines = ',\n'.join(dumps(dict(zip(keys, row))) for row in rows)
+        yield ((',\n' if sent else '\n') + lines).encode('utf8')
+        sent += len(rows)
+        if next_after is not None:
+            break
+    yield '],"next":{0}}}\n'.format(dumps(next_after)).encode('utf8')
+
+
+def catalog_api(request, table):
+    """Stream rows of catalog table as JSON
+
+    `countries`, `cities` (filtered by `country` ISO code) or `airports`
+    (filtered by `country` or `city` id) in primary key order. At most
+    `limit` rows are returned if given, then listing is continued from
+    `after` primary key given by `next` of previous response (null on last
+    page). With `gzip=1` response is gzip encoded.
+    """
+    name, model, table_filters = api_tables[table]
+    args = request.GET
+    filters = {}
+    for param, (parent, lookup_name) in table_filters.items():
+        if args.get(param):
+            filters[lookup_name] = get_cached_or_404(parent, 'pk', args[param])
+    after = args.get('after') or None
+    limit = None
+    try:
+        if after is not None:
+            after = model._meta.pk.to_python(after)
+        if args.get('limit'):
+            limit = int(args['limit'])
+            if limit < 1:
+                raise ValueError
+    except (ValueError, ValidationError):
+        return HttpResponseBadRequest('Invalid after or limit')
+
+    content = catalog_rows(table, filters, after, limit)
+    response = StreamingHttpResponse(
+                    content, content_type='application/json; charset=utf-8')
+    if args.get('gzip') == '1':
+        response.streaming_content = compress_sequence(content)
+        response['Content-Encoding'] = 'gzip'
+    return response
+
+# rows are fetched while response is streamed, only filters are checked
+catalog_api.query_budget = 1